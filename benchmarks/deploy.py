@@ -0,0 +1,609 @@
+"""
+End-to-end benchmark of the deploy path.
+
+Starts mock_connect in a subprocess and the extension's EndpointHandler on a
+local Tornado server in this process, then publishes generated notebooks the
+way the publish dialog does (`inspect_environment`, `deploy`, then `job_get`
+until the job finishes) across a matrix of notebook sizes, output types, app
+modes and extra files. For each case it reports latency percentiles, the
+peak RSS of this process and its bundle workers, and throughput.
+
+Run from the repository root:
+
+    python -m benchmarks.deploy                     # default matrix
+    python -m benchmarks.deploy --quick             # one small case
+    python -m benchmarks.deploy --sizes small,medium,large --outputs none,text,html,image
+    python -m benchmarks.deploy --save-baseline benchmarks/baseline.json
+    python -m benchmarks.deploy --baseline benchmarks/baseline.json
+
+With `--baseline` the exit status is 1 if any case's latency or peak RSS grew
+by more than `--tolerance` over the baseline, so a CI job on a consistent
+machine can catch regressions in the deploy path. Baselines are only
+comparable between runs on the same machine.
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import zlib
+from typing import Dict, List, Optional
+
+import nbformat
+from jupyter_client.kernelspec import KernelSpecManager
+from notebook.services.contents.filemanager import FileContentsManager
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.web import Application
+
+import mock_connect
+import rsconnect_jupyter
+from rsconnect_jupyter.extension import RSConnectJupyter
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+# Code cells per notebook size.
+SIZES = {"small": 10, "medium": 100, "large": 500}
+
+OUTPUTS = ("none", "text", "html", "image")
+
+APP_MODES = ("jupyter-static", "static", "jupyter-voila")
+
+# Number and size in bytes of the extra files deployed with the notebook.
+EXTRA_FILES = {"none": (0, 0), "some": (10, 100 * 1024), "many": (200, 10 * 1024)}
+
+DEFAULT_MATRIX = {
+    "sizes": ["small", "large"],
+    "outputs": ["text", "image"],
+    "modes": ["jupyter-static", "static"],
+    "extra_files": ["none", "many"],
+}
+
+QUICK_MATRIX = {
+    "sizes": ["small"],
+    "outputs": ["text"],
+    "modes": ["jupyter-static"],
+    "extra_files": ["none"],
+}
+
+# Seconds between job_get polls while a deployment runs.
+POLL_INTERVAL = 0.02
+
+# Seconds between samples of the resident set size.
+RSS_SAMPLE_INTERVAL = 0.02
+
+RESULTS_FORMAT = 1
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def _png(width: int, height: int, seed: int) -> bytes:
+    """
+    A PNG of random grey pixels, which compresses about as badly as a real plot.
+    """
+    rng = random.Random(seed)
+    rows = b"".join(b"\x00" + bytes(rng.getrandbits(8) for _ in range(width)) for _ in range(height))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+def _code_cell(output: str, index: int):
+    """
+    A code cell whose stored output is of the given type. Running the cell, as
+    static deployments do, produces the same output.
+    """
+    if output == "none":
+        return nbformat.v4.new_code_cell("x_%d = %d" % (index, index))
+    if output == "text":
+        text = "\n".join("row %d: %s" % (row, "abcdefghij" * 5) for row in range(20)) + "\n"
+        source = "print(%r, end='')" % text
+        outputs = [nbformat.v4.new_output("stream", name="stdout", text=text)]
+    elif output == "html":
+        rows = "".join("<tr><td>%d</td><td>%d</td></tr>" % (row, row * index) for row in range(50))
+        html = "<table>%s</table>" % rows
+        source = "from IPython.display import HTML\nHTML(%r)" % html
+        outputs = [
+            nbformat.v4.new_output(
+                "execute_result",
+                data={"text/html": html, "text/plain": "<IPython.core.display.HTML object>"},
+                execution_count=index + 1,
+            )
+        ]
+    elif output == "image":
+        png = base64.b64encode(_png(96, 96, index)).decode("ascii")
+        source = "import base64\nfrom IPython.display import Image\nImage(data=base64.b64decode(%r))" % png
+        outputs = [
+            nbformat.v4.new_output(
+                "execute_result",
+                data={"image/png": png, "text/plain": "<IPython.core.display.Image object>"},
+                execution_count=index + 1,
+            )
+        ]
+    else:
+        raise ValueError("Unknown output type: %s" % output)
+    return nbformat.v4.new_code_cell(source, execution_count=index + 1, outputs=outputs)
+
+
+def make_content(directory: str, size: str, output: str, extra_files: str) -> dict:
+    """
+    Writes a notebook, its requirements.txt and any extra files to `directory`.
+
+    :return: the notebook's path relative to `directory` and the extra files'.
+    """
+    os.makedirs(directory, exist_ok=True)
+    nb = nbformat.v4.new_notebook()
+    nb.metadata["kernelspec"] = {"name": "python3", "display_name": "Python 3", "language": "python"}
+    for index in range(SIZES[size]):
+        if index % 5 == 0:
+            nb.cells.append(nbformat.v4.new_markdown_cell("## Section %d" % (index // 5)))
+        nb.cells.append(_code_cell(output, index))
+    nbformat.write(nb, os.path.join(directory, "benchmark.ipynb"))
+
+    # read as is, so environment inspection doesn't run pip
+    with open(os.path.join(directory, "requirements.txt"), "w") as f:
+        f.write("six\n")
+
+    count, file_size = EXTRA_FILES[extra_files]
+    rng = random.Random(count)
+    files = []
+    for index in range(count):
+        name = "data/file_%03d.bin" % index
+        os.makedirs(os.path.join(directory, "data"), exist_ok=True)
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(bytes(rng.getrandbits(8) for _ in range(file_size)))
+        files.append(name)
+    return {"notebook_path": os.path.basename(directory) + "/benchmark.ipynb", "files": files}
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    The `percent` percentile of `values`, interpolating between the closest ranks.
+    """
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * percent / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def _rss(pid: int) -> Optional[int]:
+    try:
+        with open("/proc/%d/statm" % pid) as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class RssSampler(object):
+    """
+    Samples the resident set size of this process plus its bundle workers in
+    the background and keeps the highest total. Where /proc isn't available,
+    falls back to this process's peak since it started.
+    """
+
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self) -> Optional[int]:
+        own = _rss(os.getpid())
+        if own is None:
+            return None
+        return own + sum(_rss(child.pid) or 0 for child in multiprocessing.active_children())
+
+    def _run(self):
+        while not self._stop.is_set():
+            sample = self._sample()
+            if sample is None:
+                return
+            self.peak = max(self.peak, sample)
+            self._stop.wait(RSS_SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        if self.peak == 0 and resource is not None:
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            scale = 1 if sys.platform == "darwin" else 1024
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def start_mock_connect(log_path: str, profile: Optional[str] = None):
+    """
+    Starts mock_connect in a subprocess, so the Connect side's memory and CPU
+    don't count against the extension.
+
+    :param profile: the mock_connect profile of latency and failures to
+    simulate, by name or JSON file path.
+    :return: the server URL and the process.
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    args = [sys.executable, mock_connect.__file__, "--port", str(port)]
+    if profile:
+        args += ["--profile", profile]
+    with open(log_path, "wb") as log:
+        process = subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT)
+    url = "http://127.0.0.1:%d/" % port
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            urllib.request.urlopen(url + "__api__/server_settings").close()
+            return url, process
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise BenchmarkError("mock_connect didn't start, see %s" % log_path)
+            time.sleep(0.1)
+
+
+class BenchmarkEndpointHandler(rsconnect_jupyter.EndpointHandler):
+    def get_current_user(self):
+        return "benchmark"
+
+
+class Benchmark(object):
+    """
+    The extension on a local Tornado server, and a client publishing to
+    mock_connect through it.
+    """
+
+    def __init__(self, root_dir: str, connect_url: str, bundle_workers: int, cache: bool, **options):
+        """
+        :param options: other RSConnectJupyter options.
+        """
+        self.root_dir = root_dir
+        self.connect_url = connect_url
+        self.api_key = next(iter(mock_connect.api_keys))
+        settings = dict(
+            bundle_workers=bundle_workers,
+            bundle_cache_size=RSConnectJupyter.bundle_cache_size.default_value if cache else 0,
+            bundle_cache_dir=os.path.join(root_dir, ".bundle_cache"),
+            max_pending=1024,
+        )
+        settings.update(options)
+        self.extension = RSConnectJupyter(**settings)
+        self.server = None
+        self.base_url = None
+        self.client = None
+        self._names = itertools.count()
+
+    async def start(self):
+        app = Application(
+            [(r"/rsconnect_jupyter/(?P<action>\w+)", BenchmarkEndpointHandler)],
+            rsconnect_jupyter=self.extension,
+            contents_manager=FileContentsManager(root_dir=self.root_dir),
+            kernel_manager=None,
+            kernel_spec_manager=KernelSpecManager(),
+            base_url="/",
+        )
+        sockets = bind_sockets(0, "127.0.0.1")
+        self.server = HTTPServer(app)
+        self.server.add_sockets(sockets)
+        self.base_url = "http://127.0.0.1:%d/rsconnect_jupyter/" % sockets[0].getsockname()[1]
+        self.client = AsyncHTTPClient(max_clients=256)
+        self.extension.start()
+
+    def stop(self):
+        self.server.stop()
+        self.extension.shutdown()
+
+    def app_name(self) -> str:
+        # each deployment creates an app, and app names must be unique
+        return "benchmark%d" % next(self._names)
+
+    async def post(self, action: str, body: dict) -> dict:
+        response = await self.client.fetch(
+            self.base_url + action, method="POST", body=json.dumps(body), request_timeout=3600, raise_error=False
+        )
+        if response.code != 200:
+            raise BenchmarkError("%s failed with %d: %s" % (action, response.code, response.body.decode("utf-8")))
+        return json.loads(response.body)
+
+    async def deploy(self, content: dict, app_mode: str) -> dict:
+        """
+        Publishes the content once, as the publish dialog does.
+
+        :return: the end to end `seconds` and the job's `timings`.
+        """
+        started = time.monotonic()
+        environment = None
+        environment_seconds = None
+        if app_mode != "static":
+            inspected = await self.post(
+                "inspect_environment", {"notebook_path": content["notebook_path"], "kernel_name": "python3"}
+            )
+            environment = inspected["environment"]
+            environment_seconds = time.monotonic() - started
+
+        job = await self.post(
+            "deploy",
+            {
+                "notebook_path": content["notebook_path"],
+                "notebook_title": "Benchmark",
+                "notebook_name": self.app_name(),
+                "app_id": None,
+                "server_address": self.connect_url,
+                "api_key": self.api_key,
+                "disable_tls_check": False,
+                "app_mode": app_mode,
+                "environment": environment,
+                "environment_seconds": environment_seconds,
+                "files": content["files"],
+            },
+        )
+        while job["state"] not in ("succeeded", "failed"):
+            await asyncio.sleep(POLL_INTERVAL)
+            job = await self.post("job_get", {"job_id": job["job_id"], "cursor": job["cursor"]})
+        if job["state"] == "failed":
+            raise BenchmarkError(job["error"])
+        return {"seconds": time.monotonic() - started, "timings": job["timings"]}
+
+    async def run_case(self, case: dict, iterations: int, concurrency: int, warmup: int) -> dict:
+        directory = os.path.join(self.root_dir, case["name"].replace("/", "-"))
+        content = make_content(directory, case["size"], case["output"], case["extra_files"])
+        result = dict(case, iterations=iterations, concurrency=concurrency)
+        result["notebook_bytes"] = os.path.getsize(os.path.join(directory, "benchmark.ipynb"))
+
+        try:
+            for _ in range(warmup):
+                await self.deploy(content, case["mode"])
+
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def deploy():
+                async with semaphore:
+                    return await self.deploy(content, case["mode"])
+
+            with RssSampler() as rss:
+                started = time.monotonic()
+                deploys = await asyncio.gather(*[deploy() for _ in range(iterations)])
+                elapsed = time.monotonic() - started
+        except BenchmarkError as exc:
+            result["error"] = str(exc)
+            return result
+
+        latencies = [deployed["seconds"] for deployed in deploys]
+        bundle_bytes = deploys[0]["timings"]["build"]["bytes"]
+        phases = sorted({phase for deployed in deploys for phase in deployed["timings"]})
+        result.update(
+            bundle_bytes=bundle_bytes,
+            latency={
+                "p50": percentile(latencies, 50),
+                "p90": percentile(latencies, 90),
+                "p99": percentile(latencies, 99),
+                "mean": sum(latencies) / len(latencies),
+                "max": max(latencies),
+            },
+            phases={
+                phase: percentile(
+                    [deployed["timings"][phase]["seconds"] for deployed in deploys if phase in deployed["timings"]], 50
+                )
+                for phase in phases
+            },
+            peak_rss_bytes=rss.peak,
+            throughput={
+                "deploys_per_second": iterations / elapsed,
+                "bundle_bytes_per_second": bundle_bytes * iterations / elapsed,
+            },
+        )
+        return result
+
+
+def cases(matrix: Dict[str, List[str]]) -> List[dict]:
+    return [
+        {
+            "name": "%s/%s/%s/files-%s" % (mode, size, output, extra_files),
+            "mode": mode,
+            "size": size,
+            "output": output,
+            "extra_files": extra_files,
+        }
+        for mode, size, output, extra_files in itertools.product(
+            matrix["modes"], matrix["sizes"], matrix["outputs"], matrix["extra_files"]
+        )
+    ]
+
+
+def run_benchmark(
+    matrix: Dict[str, List[str]],
+    iterations: int = 5,
+    concurrency: int = 1,
+    warmup: int = 1,
+    bundle_workers: int = 0,
+    cache: bool = False,
+    connect_profile: Optional[str] = None,
+    progress=None,
+) -> dict:
+    """
+    Runs every case in the matrix.
+
+    :param matrix: the `sizes`, `outputs`, `modes` and `extra_files` to combine.
+    :param iterations: timed deployments per case.
+    :param concurrency: deployments of a case running at the same time.
+    :param warmup: untimed deployments before each case.
+    :param bundle_workers: bundle worker processes; 0 builds in this process,
+    so the peak RSS includes the builds.
+    :param cache: whether unchanged bundles are reused from the bundle cache.
+    :param connect_profile: the mock_connect profile to run against.
+    :param progress: called with each case's result as it finishes.
+    :return: the results, as saved in baseline files.
+    """
+    with tempfile.TemporaryDirectory(prefix="rsc_benchmark") as root_dir:
+        connect_url, mock = start_mock_connect(os.path.join(root_dir, "mock_connect.log"), connect_profile)
+        benchmark = Benchmark(root_dir, connect_url, bundle_workers, cache)
+
+        async def run():
+            await benchmark.start()
+            try:
+                results = []
+                for case in cases(matrix):
+                    result = await benchmark.run_case(case, iterations, concurrency, warmup)
+                    if progress is not None:
+                        progress(result)
+                    results.append(result)
+                return results
+            finally:
+                benchmark.stop()
+
+        try:
+            results = asyncio.run(run())
+        finally:
+            mock.kill()
+            mock.wait()
+
+    return {
+        "format": RESULTS_FORMAT,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "environment": {
+            "rsconnect_jupyter": rsconnect_jupyter.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "options": {
+            "iterations": iterations,
+            "concurrency": concurrency,
+            "warmup": warmup,
+            "bundle_workers": bundle_workers,
+            "cache": cache,
+        },
+        "cases": results,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    :return: a description of each measurement that is worse than in the
+    baseline by more than `tolerance`, a fraction, or of each case that
+    failed but succeeded in the baseline.
+    """
+    previous = {case["name"]: case for case in baseline["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        before = previous.get(case["name"])
+        if before is None or "error" in before:
+            continue
+        if "error" in case:
+            regressions.append("%s: failed: %s" % (case["name"], case["error"]))
+            continue
+        measurements = [
+            ("p50 latency", case["latency"]["p50"], before["latency"]["p50"]),
+            ("p90 latency", case["latency"]["p90"], before["latency"]["p90"]),
+            ("peak RSS", case["peak_rss_bytes"], before["peak_rss_bytes"]),
+        ]
+        for label, now, then in measurements:
+            if then and now > then * (1 + tolerance):
+                regressions.append(
+                    "%s: %s %.4g -> %.4g (+%.0f%%)" % (case["name"], label, then, now, (now / then - 1) * 100)
+                )
+    return regressions
+
+
+def format_result(result: dict) -> str:
+    if "error" in result:
+        return "%-45s failed: %s" % (result["name"], result["error"])
+    latency = result["latency"]
+    return "%-45s p50 %7.3fs  p90 %7.3fs  p99 %7.3fs  rss %7.1f MB  %6.2f deploys/s  %7.2f MB/s" % (
+        result["name"],
+        latency["p50"],
+        latency["p90"],
+        latency["p99"],
+        result["peak_rss_bytes"] / 1024 / 1024,
+        result["throughput"]["deploys_per_second"],
+        result["throughput"]["bundle_bytes_per_second"] / 1024 / 1024,
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark deploying notebooks through rsconnect_jupyter.")
+    parser.add_argument("--quick", action="store_true", help="run a single small case")
+    parser.add_argument("--sizes", help="comma separated: %s" % ", ".join(SIZES))
+    parser.add_argument("--outputs", help="comma separated: %s" % ", ".join(OUTPUTS))
+    parser.add_argument("--modes", help="comma separated: %s" % ", ".join(APP_MODES))
+    parser.add_argument("--extra-files", help="comma separated: %s" % ", ".join(EXTRA_FILES))
+    parser.add_argument("--iterations", type=int, default=5, help="timed deployments per case")
+    parser.add_argument("--concurrency", type=int, default=1, help="deployments per case running at once")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed deployments before each case")
+    parser.add_argument("--bundle-workers", type=int, default=0, help="bundle worker processes")
+    parser.add_argument("--cache", action="store_true", help="reuse unchanged bundles from the bundle cache")
+    parser.add_argument(
+        "--connect-profile", help="mock_connect profile of latency and failures, by name or JSON file path"
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write the results as the new baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="fail if the results are worse than this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown over the baseline")
+    args = parser.parse_args(argv)
+
+    matrix = dict(QUICK_MATRIX if args.quick else DEFAULT_MATRIX)
+    for key, choices in (("sizes", SIZES), ("outputs", OUTPUTS), ("modes", APP_MODES), ("extra_files", EXTRA_FILES)):
+        value = getattr(args, key)
+        if value:
+            matrix[key] = value.split(",")
+            unknown = set(matrix[key]) - set(choices)
+            if unknown:
+                parser.error("unknown %s: %s" % (key.replace("_", " "), ", ".join(sorted(unknown))))
+    # a regression check without a baseline would silently pass
+    if args.baseline and not os.path.exists(args.baseline):
+        parser.error("no baseline at %s; save one on master with --save-baseline" % args.baseline)
+
+    results = run_benchmark(
+        matrix,
+        iterations=args.iterations,
+        concurrency=args.concurrency,
+        warmup=args.warmup,
+        bundle_workers=args.bundle_workers,
+        cache=args.cache,
+        connect_profile=args.connect_profile,
+        progress=lambda result: print(format_result(result), flush=True),
+    )
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Wrote %s" % path)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against %s:" % args.baseline)
+            for regression in regressions:
+                print("  " + regression)
+            return 1
+        print("No regressions against %s" % args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,415 @@
+"""
+Multi-user load test of the server extension.
+
+Simulates users publishing at the same time, each following the protocol of
+the publish dialog in static/rsconnect.js against EndpointHandler:
+`verify_server`, `app_search`, `inspect_environment`, `deploy`, polling
+`job_get` for the deployment's log, and `app_config`. Connect is a local
+mock_connect in a subprocess; the extension runs on its own IOLoop in a
+background thread, as in a notebook server, while the simulated browsers
+share another.
+
+The number of users is raised step by step. Each step reports how late the
+extension's IOLoop ran (any request arriving then would have waited as
+long), the latency distribution and error rate of each action, and the
+completed publishes per second, and the first step where the extension is
+saturated is pointed out.
+
+    python -m benchmarks.load
+    python -m benchmarks.load --users 1,8,32,64 --bundle-workers 4 --max-workers 8
+
+Against mock_connect's default profile, Connect answers at once and
+deployment tasks finish immediately; `--connect-profile realistic` (or
+`slow`, `flaky`, or a JSON file, see mock_connect.PROFILES) adds latency,
+limited upload bandwidth, failures and tasks that log for a while. At high
+concurrency mock_connect itself may become the bottleneck; compare the
+`app_config` latency, which is little more than a round trip to it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional
+
+from tornado.httpclient import AsyncHTTPClient
+
+from benchmarks.deploy import (
+    APP_MODES,
+    OUTPUTS,
+    SIZES,
+    Benchmark,
+    BenchmarkError,
+    make_content,
+    percentile,
+    start_mock_connect,
+)
+from rsconnect_jupyter.extension import RSConnectJupyter
+
+# The order actions are reported in, which is the order a publish makes them.
+ACTIONS = ("verify_server", "app_search", "inspect_environment", "deploy", "job_get", "app_config")
+
+# Seconds a single request may take before it counts as failed.
+REQUEST_TIMEOUT = 300
+
+# Seconds between IOLoop lag samples.
+LAG_INTERVAL = 0.01
+
+
+def summarize(values: List[float]) -> Optional[dict]:
+    if not values:
+        return None
+    return {
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+class LoopLagMonitor(object):
+    """
+    Measures how late an IOLoop runs a callback scheduled `interval` seconds
+    ahead, which is how long a request arriving then would have waited.
+    """
+
+    def __init__(self, interval: float = LAG_INTERVAL):
+        self.interval = interval
+        self.samples: List[float] = []
+
+    async def run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(time.monotonic() - expected, 0.0))
+
+    def collect(self) -> List[float]:
+        """
+        :return: the samples taken since the last call.
+        """
+        samples, self.samples = self.samples, []
+        return samples
+
+
+class ServerThread(object):
+    """
+    Runs a Benchmark's server on its own event loop in a background thread.
+    """
+
+    def __init__(self, benchmark: Benchmark):
+        self.benchmark = benchmark
+        self.lag = LoopLagMonitor()
+        self.loop = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.benchmark.start())
+        lag_task = self.loop.create_task(self.lag.run())
+        self._started.set()
+        self.loop.run_forever()
+        lag_task.cancel()
+        self.benchmark.stop()
+
+    def start(self):
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+
+async def run_session(
+    client: AsyncHTTPClient,
+    benchmark: Benchmark,
+    content: dict,
+    app_mode: str,
+    poll_interval: float,
+    record: Callable[[str, float, int], None],
+) -> bool:
+    """
+    Publishes once, as a user of the publish dialog would.
+
+    :param record: called with the action, seconds taken and HTTP status of
+    every request.
+    :return: whether the publish succeeded.
+    """
+
+    async def call(action: str, body: dict) -> dict:
+        started = time.monotonic()
+        response = await client.fetch(
+            benchmark.base_url + action,
+            method="POST",
+            body=json.dumps(body),
+            request_timeout=REQUEST_TIMEOUT,
+            raise_error=False,
+        )
+        record(action, time.monotonic() - started, response.code)
+        if response.code != 200:
+            raise BenchmarkError("%s failed with %d" % (action, response.code))
+        return json.loads(response.body)
+
+    server = {
+        "server_address": benchmark.connect_url,
+        "api_key": benchmark.api_key,
+        "disable_tls_check": False,
+    }
+    try:
+        await call("verify_server", server)
+        await call("app_search", dict(server, notebook_title="Load test", app_id=None))
+        environment = None
+        if app_mode != "static":
+            inspected = await call(
+                "inspect_environment", {"notebook_path": content["notebook_path"], "kernel_name": "python3"}
+            )
+            environment = inspected["environment"]
+        job = await call(
+            "deploy",
+            dict(
+                server,
+                notebook_path=content["notebook_path"],
+                notebook_title="Load test",
+                notebook_name=benchmark.app_name(),
+                app_id=None,
+                app_mode=app_mode,
+                environment=environment,
+                files=content["files"],
+            ),
+        )
+        while job["state"] not in ("succeeded", "failed"):
+            await asyncio.sleep(poll_interval)
+            job = await call("job_get", {"job_id": job["job_id"], "cursor": job["cursor"]})
+        if job["state"] == "failed":
+            return False
+        await call("app_config", dict(server, app_id=job["result"]["app_id"]))
+        return True
+    except BenchmarkError:
+        return False
+
+
+async def run_level(
+    server: ServerThread, contents: List[dict], users: int, rounds: int, app_mode: str, poll_interval: float
+) -> dict:
+    """
+    Runs `users` users at once, each publishing `rounds` times in a row.
+    """
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Counter] = defaultdict(Counter)
+
+    def record(action: str, seconds: float, code: int):
+        latencies[action].append(seconds)
+        statuses[action][code] += 1
+
+    # enough connections that requests don't queue in the client
+    client = AsyncHTTPClient(force_instance=True, max_clients=users * 2)
+
+    async def user(index: int) -> int:
+        completed = 0
+        for _ in range(rounds):
+            completed += await run_session(client, server.benchmark, contents[index], app_mode, poll_interval, record)
+        return completed
+
+    server.lag.collect()
+    started = time.monotonic()
+    completed = sum(await asyncio.gather(*[user(index) for index in range(users)]))
+    elapsed = time.monotonic() - started
+    lag = server.lag.collect()
+    client.close()
+
+    requests = sum(sum(counts.values()) for counts in statuses.values())
+    errors = sum(sum(counts.values()) - counts[200] for counts in statuses.values())
+    actions = {}
+    for action in ACTIONS:
+        if action in statuses:
+            counts = statuses[action]
+            total = sum(counts.values())
+            actions[action] = {
+                "requests": total,
+                "error_rate": (total - counts[200]) / total,
+                "status_codes": {str(code): count for code, count in sorted(counts.items())},
+                "latency": summarize(latencies[action]),
+            }
+    return {
+        "users": users,
+        "publishes": users * rounds,
+        "failed_publishes": users * rounds - completed,
+        "seconds": elapsed,
+        "publishes_per_second": completed / elapsed,
+        "requests": requests,
+        "error_rate": errors / requests if requests else 0.0,
+        "loop_lag": summarize(lag),
+        "actions": actions,
+    }
+
+
+def saturation(levels: List[dict], max_error_rate: float, max_lag: float, min_speedup: float) -> Optional[dict]:
+    """
+    Finds the first level at which the extension is saturated: requests fail,
+    the IOLoop falls behind, or adding users no longer adds throughput.
+
+    :param min_speedup: the fraction by which throughput must rise over the
+    best level so far for a level to count as scaling.
+    :return: the level's `users` and the `reasons`, or None.
+    """
+    best = 0.0
+    for level in levels:
+        reasons = []
+        if level["error_rate"] > max_error_rate:
+            reasons.append("%.1f%% of requests failed" % (level["error_rate"] * 100))
+        if level["loop_lag"] is not None and level["loop_lag"]["p99"] > max_lag:
+            reasons.append("IOLoop lag p99 was %.0f ms" % (level["loop_lag"]["p99"] * 1000))
+        if best and level["publishes_per_second"] < best * (1 + min_speedup):
+            reasons.append("throughput stopped rising (%.2f publishes/s)" % level["publishes_per_second"])
+        if reasons:
+            return {"users": level["users"], "reasons": reasons}
+        best = max(best, level["publishes_per_second"])
+    return None
+
+
+def run_load_test(
+    user_levels: List[int],
+    rounds: int = 1,
+    app_mode: str = "jupyter-static",
+    size: str = "small",
+    output: str = "text",
+    poll_interval: float = 1.0,
+    connect_profile: Optional[str] = None,
+    progress=None,
+    **options
+) -> List[dict]:
+    """
+    Runs each number of users in turn against one extension.
+
+    :param poll_interval: seconds between `job_get` polls, 1 in the dialog.
+    :param connect_profile: the mock_connect profile to run against.
+    :param progress: called with each level's result as it finishes.
+    :param options: RSConnectJupyter options, e.g. bundle_workers.
+    :return: one result per level.
+    """
+    with tempfile.TemporaryDirectory(prefix="rsc_load") as root_dir:
+        connect_url, mock = start_mock_connect(os.path.join(root_dir, "mock_connect.log"), connect_profile)
+        try:
+            # a notebook per user, as each user publishes their own
+            contents = [
+                make_content(os.path.join(root_dir, "user%d" % index), size, output, "none")
+                for index in range(max(user_levels))
+            ]
+            options.setdefault("bundle_workers", RSConnectJupyter.bundle_workers.default_value)
+            options.setdefault("max_pending", RSConnectJupyter.max_pending.default_value)
+            server = ServerThread(Benchmark(root_dir, connect_url, cache=False, **options))
+            server.start()
+            try:
+
+                async def run():
+                    levels = []
+                    for users in user_levels:
+                        level = await run_level(server, contents, users, rounds, app_mode, poll_interval)
+                        if progress is not None:
+                            progress(level)
+                        levels.append(level)
+                    return levels
+
+                return asyncio.run(run())
+            finally:
+                server.stop()
+        finally:
+            mock.kill()
+            mock.wait()
+
+
+def format_level(level: dict) -> str:
+    lag = level["loop_lag"] or {"p50": 0, "p99": 0, "max": 0}
+    lines = [
+        "%4d users  %6.2f publishes/s  %5.1f%% errors  %d/%d failed  IOLoop lag p50 %.1f ms p99 %.1f ms max %.1f ms"
+        % (
+            level["users"],
+            level["publishes_per_second"],
+            level["error_rate"] * 100,
+            level["failed_publishes"],
+            level["publishes"],
+            lag["p50"] * 1000,
+            lag["p99"] * 1000,
+            lag["max"] * 1000,
+        )
+    ]
+    for action, stats in level["actions"].items():
+        latency = stats["latency"]
+        lines.append(
+            "      %-20s %5d requests  %5.1f%% errors  p50 %8.1f ms  p90 %8.1f ms  p99 %8.1f ms"
+            % (
+                action,
+                stats["requests"],
+                stats["error_rate"] * 100,
+                latency["p50"] * 1000,
+                latency["p90"] * 1000,
+                latency["p99"] * 1000,
+            )
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test rsconnect_jupyter with concurrent publishing users.")
+    parser.add_argument("--users", default="1,2,4,8,16,32", help="comma separated numbers of concurrent users")
+    parser.add_argument("--rounds", type=int, default=1, help="publishes per user at each level")
+    parser.add_argument("--mode", default="jupyter-static", choices=APP_MODES)
+    parser.add_argument("--size", default="small", choices=list(SIZES))
+    parser.add_argument("--cell-output", default="text", choices=OUTPUTS)
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between job_get polls")
+    parser.add_argument(
+        "--connect-profile", help="mock_connect profile of latency and failures, by name or JSON file path"
+    )
+    parser.add_argument("--bundle-workers", type=int, default=RSConnectJupyter.bundle_workers.default_value)
+    parser.add_argument("--max-workers", type=int, default=RSConnectJupyter.max_workers.default_value)
+    parser.add_argument("--max-pending", type=int, default=RSConnectJupyter.max_pending.default_value)
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="error rate that counts as saturated")
+    parser.add_argument(
+        "--max-lag", type=float, default=0.1, help="IOLoop lag p99, in seconds, that counts as saturated"
+    )
+    parser.add_argument(
+        "--min-speedup", type=float, default=0.1, help="throughput gain needed for more users to count as scaling"
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    try:
+        user_levels = [int(users) for users in args.users.split(",")]
+    except ValueError:
+        parser.error("--users must be comma separated numbers")
+
+    levels = run_load_test(
+        user_levels,
+        rounds=args.rounds,
+        app_mode=args.mode,
+        size=args.size,
+        output=args.cell_output,
+        poll_interval=args.poll_interval,
+        connect_profile=args.connect_profile,
+        progress=lambda level: print(format_level(level), flush=True),
+        bundle_workers=args.bundle_workers,
+        max_workers=args.max_workers,
+        max_pending=args.max_pending,
+    )
+    saturated = saturation(levels, args.max_error_rate, args.max_lag, args.min_speedup)
+    if saturated is None:
+        print("Not saturated at up to %d users" % max(user_levels))
+    else:
+        print("Saturated at %d users: %s" % (saturated["users"], "; ".join(saturated["reasons"])))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"levels": levels, "saturation": saturated}, f, indent=2)
+            f.write("\n")
+        print("Wrote %s" % args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,11 +5,35 @@
 
 # To run:
 # FLASK_APP=mock_connect.py flask run --host=0.0.0.0
+# or, with HTTP/1.1 keep-alive as on a real Connect server:
+# python mock_connect.py --port 5000
+# and to keep content across restarts, or to hold many apps or large bundles:
+# python mock_connect.py --port 5000 --db mock_connect.db --seed-apps 100000
+# and to add latency, failures and slow, chatty deployments (see PROFILES):
+# python mock_connect.py --port 5000 --profile flaky
+# or to replay traffic recorded with c.RSConnectJupyter.record_connect_traffic:
+# python mock_connect.py --port 5000 --replay connect_traffic.jsonl
+# (with flask run, set MOCK_CONNECT_DB, MOCK_CONNECT_BUNDLE_DIR,
+# MOCK_CONNECT_PROFILE and MOCK_CONNECT_REPLAY instead)
 
 # Use the API key below (0123456789abcdef0123456789abcdef) in rsconnect-jupyter
 
-import io
+import atexit
+import bisect
+import contextlib
+import functools
+import heapq
+import math
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
 import tarfile
+import tempfile
+import threading
+import time
 import uuid
 from datetime import datetime
 from json import dumps, loads
@@ -48,12 +72,547 @@ class IdGenerator(object):
         return self._value
 
 
-app = Flask(__name__)
+# Bytes read or written at a time when streaming bundles.
+CHUNK_SIZE = 1024 * 1024
+
+# Largest bundle upload accepted by `serve`.
+MAX_UPLOAD_SIZE = 64 * 1024 * 1024 * 1024
+
+# Number of bundles whose manifest and HTML are kept parsed in memory.
+BUNDLE_CACHE_SIZE = 64
+
+# Threads serving requests other than uploads in `serve`.
+WSGI_THREADS = 32
+
+# Fields that apps may be sorted by without looking inside their JSON.
+SQLITE_APP_COLUMNS = ("id", "name", "title", "updated_time")
+
+
+def _object_id(object_id):
+    try:
+        return int(object_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _sort_key(field):
+    def key(connect_app):
+        return connect_app.get(field) or ""
+
+    return key
+
+
+class Store(object):
+    """
+    Where apps, bundles and tasks are kept. Bundles are always streamed to
+    files in `bundle_dir` rather than held in memory.
+
+    Apps returned by the store may be modified and passed to `save_app`.
+    """
+
+    def __init__(self, bundle_dir):
+        self.bundle_dir = bundle_dir
+        if not os.path.isdir(bundle_dir):
+            os.makedirs(bundle_dir)
+
+    def bundle_path(self, bundle_id):
+        return os.path.join(self.bundle_dir, "bundle-%d.tar.gz" % bundle_id)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Makes the changes within one unit, which is much faster for many
+        changes to a SQLite store.
+        """
+        with self._lock:
+            yield
+
+
+class MemoryStore(Store):
+    """
+    Keeps apps and tasks in memory, indexed by name and by title so that
+    creating apps and searching them by title don't scan every app.
+    """
+
+    def __init__(self, bundle_dir=None):
+        if bundle_dir is None:
+            bundle_dir = tempfile.mkdtemp(prefix="mock_connect")
+            atexit.register(shutil.rmtree, bundle_dir, True)
+        super(MemoryStore, self).__init__(bundle_dir)
+        self._lock = threading.RLock()
+        self._apps = {}
+        self._app_ids = IdGenerator()
+        # id -> the (name, title) the app is indexed under
+        self._indexed = {}
+        self._names = {}
+        self._titles = []
+        self._bundles = {}
+        self._bundle_ids = IdGenerator()
+        self._tasks = {}
+        self._task_ids = IdGenerator()
+
+    def app_count(self):
+        return len(self._apps)
+
+    def bundle_count(self):
+        return len(self._bundles)
+
+    def create_app(self, connect_app):
+        """
+        Adds an app, setting its `id`.
+
+        :return: the app, or None if another app has the same name.
+        """
+        with self._lock:
+            name = connect_app.get("name")
+            if name and name in self._names:
+                return None
+            connect_app["id"] = self._app_ids.next()
+            self._apps[connect_app["id"]] = connect_app
+            self._index(connect_app)
+            return connect_app
+
+    def get_app(self, app_id):
+        return self._apps.get(_object_id(app_id))
+
+    def save_app(self, connect_app):
+        with self._lock:
+            self._apps[connect_app["id"]] = connect_app
+            self._index(connect_app)
+
+    def _index(self, connect_app):
+        app_id = connect_app["id"]
+        name, title = connect_app.get("name"), connect_app.get("title") or ""
+        old = self._indexed.get(app_id)
+        if old == (name, title):
+            return
+        if old is not None:
+            if self._names.get(old[0]) == app_id:
+                del self._names[old[0]]
+            del self._titles[bisect.bisect_left(self._titles, (old[1], app_id))]
+        if name:
+            self._names[name] = app_id
+        bisect.insort(self._titles, (title, app_id))
+        self._indexed[app_id] = (name, title)
+
+    def search_apps(self, prefix, sort, descending, start, count):
+        """
+        :return: the page of apps whose title starts with `prefix`, and how
+        many apps matched in all.
+        """
+        with self._lock:
+            if prefix:
+                ids = []
+                index = bisect.bisect_left(self._titles, (prefix,))
+                while index < len(self._titles) and self._titles[index][0].startswith(prefix):
+                    ids.append(self._titles[index][1])
+                    index += 1
+                matches = [self._apps[app_id] for app_id in sorted(ids)]
+            else:
+                matches = list(self._apps.values())
+        if not sort:
+            return matches[start : start + count], len(matches)
+        # matches are in id order, and the sorts are stable, so ties are
+        # broken by id in the same direction as the sort
+        if descending:
+            matches.reverse()
+        if start + count < len(matches):
+            select = heapq.nlargest if descending else heapq.nsmallest
+            return select(start + count, matches, key=_sort_key(sort))[start:], len(matches)
+        matches.sort(key=_sort_key(sort), reverse=descending)
+        return matches[start : start + count], len(matches)
+
+    def create_bundle(self, bundle, upload_path):
+        """
+        Adds a bundle, setting its `id`, and moves its uploaded tarball from
+        `upload_path` to `bundle_path`.
+        """
+        with self._lock:
+            bundle["id"] = self._bundle_ids.next()
+            os.replace(upload_path, self.bundle_path(bundle["id"]))
+            self._bundles[bundle["id"]] = bundle
+            return bundle
+
+    def get_bundle(self, bundle_id):
+        return self._bundles.get(_object_id(bundle_id))
+
+    def create_task(self, task):
+        with self._lock:
+            task["id"] = self._task_ids.next()
+            self._tasks[task["id"]] = task
+            return task
+
+    def get_task(self, task_id):
+        return self._tasks.get(_object_id(task_id))
+
+
+class SqliteStore(Store):
+    """
+    Keeps apps, bundles and tasks in a SQLite database, so they survive a
+    restart and needn't fit in memory. Names and titles are indexed.
+    """
+
+    def __init__(self, path, bundle_dir=None):
+        super(SqliteStore, self).__init__(bundle_dir or path + "-bundles")
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS apps (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE,
+                title TEXT NOT NULL,
+                updated_time TEXT,
+                body TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS apps_title ON apps (title);
+            CREATE INDEX IF NOT EXISTS apps_updated_time ON apps (updated_time);
+            CREATE TABLE IF NOT EXISTS bundles (id INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, body TEXT NOT NULL);
+            """
+        )
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _execute(self, sql, *params):
+        """
+        :return: the id of the row inserted, if any.
+        """
+        with self._lock:
+            return self._db.execute(sql, params).lastrowid
+
+    def _fetch(self, sql, *params):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def _fetch_item(self, table, item_id):
+        rows = self._fetch("SELECT id, body FROM %s WHERE id = ?" % table, _object_id(item_id))
+        return self._load(rows[0]) if rows else None
+
+    @staticmethod
+    def _load(row):
+        item = loads(row[1])
+        item["id"] = row[0]
+        return item
+
+    def _count(self, table):
+        return self._fetch("SELECT COUNT(*) FROM %s" % table)[0][0]
+
+    def app_count(self):
+        return self._count("apps")
+
+    def bundle_count(self):
+        return self._count("bundles")
+
+    def create_app(self, connect_app):
+        try:
+            app_id = self._execute(
+                "INSERT INTO apps (name, title, updated_time, body) VALUES (?, ?, ?, ?)",
+                connect_app.get("name") or None,
+                connect_app.get("title") or "",
+                connect_app.get("updated_time"),
+                dumps(connect_app),
+            )
+        except sqlite3.IntegrityError:
+            return None
+        connect_app["id"] = app_id
+        return connect_app
+
+    def get_app(self, app_id):
+        return self._fetch_item("apps", app_id)
+
+    def save_app(self, connect_app):
+        self._execute(
+            "UPDATE apps SET name = ?, title = ?, updated_time = ?, body = ? WHERE id = ?",
+            connect_app.get("name") or None,
+            connect_app.get("title") or "",
+            connect_app.get("updated_time"),
+            dumps(connect_app),
+            connect_app["id"],
+        )
+
+    def search_apps(self, prefix, sort, descending, start, count):
+        where, params = "", ()
+        if prefix:
+            # the range of titles starting with prefix, so the title index is used
+            where, params = "WHERE title >= ? AND title < ?", (prefix, prefix + "\U0010ffff")
+        total = self._fetch("SELECT COUNT(*) FROM apps " + where, *params)[0][0]
+        order = "id"
+        if sort in SQLITE_APP_COLUMNS:
+            order = "{0} {1}, id {1}".format(sort, "DESC" if descending else "ASC")
+        elif sort and re.match(r"^\w+$", sort):
+            order = "COALESCE(json_extract(body, '$.{0}'), '') {1}, id {1}".format(
+                sort, "DESC" if descending else "ASC"
+            )
+        rows = self._fetch(
+            "SELECT id, body FROM apps %s ORDER BY %s LIMIT ? OFFSET ?" % (where, order), *(params + (count, start))
+        )
+        return [self._load(row) for row in rows], total
+
+    def create_bundle(self, bundle, upload_path):
+        with self._lock:
+            bundle["id"] = self._db.execute("INSERT INTO bundles (body) VALUES (?)", (dumps(bundle),)).lastrowid
+            os.replace(upload_path, self.bundle_path(bundle["id"]))
+        return bundle
+
+    def get_bundle(self, bundle_id):
+        return self._fetch_item("bundles", bundle_id)
+
+    def create_task(self, task):
+        task["id"] = self._execute("INSERT INTO tasks (body) VALUES (?)", dumps(task))
+        return task
+
+    def get_task(self, task_id):
+        return self._fetch_item("tasks", task_id)
+
+
+def configure(db=None, bundle_dir=None):
+    """
+    Replaces the store: SQLite if `db` is a path, otherwise in memory.
+    Bundles are kept in `bundle_dir`, by default next to the database or in
+    a temporary directory.
+    """
+    global store
+    store = SqliteStore(db, bundle_dir) if db else MemoryStore(bundle_dir)
+    read_manifest.cache_clear()
+    read_html.cache_clear()
+    return store
+
+
+# Profiles make the server behave more like a real one, for performance
+# testing. Pick one by name with --profile, or pass the path of a JSON file
+# in the same format:
+#
+#   latency:  {endpoint: distribution} of the time taken to respond
+#   errors:   {endpoint: {"rate": p, "status_codes": [...]}} of responses
+#             that fail with one of `status_codes`
+#   timeouts: {endpoint: {"rate": p, "seconds": s}} of responses that hang
+#             for `seconds` and then fail with 504, as a proxy would
+#   upload_bandwidth: bytes per second that bundle uploads are read at
+#   task:     {"lines": n, "seconds": s, "failure_rate": p}; each deployment's
+#             task logs `n` pip install lines over `s` seconds, and fails
+#             with probability `p`
+#   seed:     seeds the random choices, so a run can be repeated exactly
+#
+# Endpoints are the names of the view functions below (`applications`,
+# `upload`, `get_task`, ...), and `default` applies to any not listed. A
+# distribution is {"constant": seconds}, {"uniform": [low, high]},
+# {"exponential": mean} or {"lognormal": [median, sigma]}.
+PROFILES = {
+    "default": {},
+    "realistic": {
+        "latency": {"default": {"lognormal": [0.03, 0.5]}, "upload": {"lognormal": [0.1, 0.5]}},
+        "upload_bandwidth": 10 * 1024 * 1024,
+        "task": {"lines": 500, "seconds": 10},
+    },
+    "slow": {
+        "latency": {"default": {"lognormal": [0.3, 0.75]}},
+        "upload_bandwidth": 1024 * 1024,
+        "task": {"lines": 3000, "seconds": 60},
+    },
+    "flaky": {
+        "latency": {"default": {"lognormal": [0.03, 0.5]}},
+        "errors": {"default": {"rate": 0.05, "status_codes": [500, 502, 503]}},
+        "timeouts": {"default": {"rate": 0.01, "seconds": 30}},
+        "task": {"lines": 500, "seconds": 10, "failure_rate": 0.05},
+    },
+}
+
+
+def sample(rng, distribution):
+    ((kind, params),) = distribution.items()
+    if kind == "constant":
+        return params
+    if kind == "uniform":
+        return rng.uniform(*params)
+    if kind == "exponential":
+        return rng.expovariate(1.0 / params)
+    if kind == "lognormal":
+        median, sigma = params
+        return rng.lognormvariate(math.log(median), sigma)
+    raise ValueError("Unknown distribution %r" % kind)
+
+
+class Profile(object):
+    """
+    Makes the random choices for a profile in PROFILES.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.upload_bandwidth = settings.get("upload_bandwidth", 0)
+        self.task = dict({"lines": 0, "seconds": 0, "failure_rate": 0}, **settings.get("task", {}))
+        self._lock = threading.Lock()
+        self._random = {}
+
+    def _random_for(self, endpoint):
+        # one generator per endpoint, so the choices for each don't depend on
+        # how requests to the others interleave
+        if endpoint not in self._random:
+            self._random[endpoint] = random.Random("%s:%s" % (self.settings.get("seed", 0), endpoint))
+        return self._random[endpoint]
+
+    def _setting(self, name, endpoint):
+        settings = self.settings.get(name, {})
+        return settings.get(endpoint, settings.get("default"))
+
+    def response(self, endpoint):
+        """
+        Decides how a request to `endpoint` is answered.
+
+        :return: the seconds to wait before responding, and the status code
+        to fail with or None.
+        """
+        latency = self._setting("latency", endpoint)
+        errors = self._setting("errors", endpoint)
+        timeouts = self._setting("timeouts", endpoint)
+        with self._lock:
+            rng = self._random_for(endpoint)
+            delay = sample(rng, latency) if latency else 0.0
+            if timeouts and rng.random() < timeouts["rate"]:
+                return delay + timeouts["seconds"], 504
+            if errors and rng.random() < errors["rate"]:
+                return delay, rng.choice(errors.get("status_codes", [500]))
+        return delay, None
+
+    def task_failed(self):
+        with self._lock:
+            return self._random_for("task").random() < self.task["failure_rate"]
+
+
+def use_profile(name=None):
+    """
+    Replaces the profile with one from PROFILES, or from a JSON file if
+    `name` is a path.
+    """
+    global profile
+    if name is None or name in PROFILES:
+        settings = PROFILES[name or "default"]
+    else:
+        with open(name) as f:
+            settings = loads(f.read())
+    profile = Profile(settings)
+    return profile
+
+
+class Throttle(object):
+    """
+    Paces a stream of bytes to `bandwidth` bytes per second, or not at all
+    if it's 0.
+    """
+
+    def __init__(self, bandwidth):
+        self.bandwidth = bandwidth
+        self._started = time.monotonic()
+        self._received = 0
+
+    def delay(self, size):
+        """
+        :return: the seconds to wait after another `size` bytes.
+        """
+        if not self.bandwidth:
+            return 0.0
+        self._received += size
+        return max(self._received / self.bandwidth - (time.monotonic() - self._started), 0.0)
+
+
+# Response headers that describe the original connection rather than the response.
+REPLAY_SKIPPED_HEADERS = {"connection", "content-length", "date", "server", "set-cookie", "transfer-encoding"}
+
+
+class Replay(object):
+    """
+    Serves the responses in a recording of Connect traffic made with the
+    extension's `c.RSConnectJupyter.record_connect_traffic`, instead of
+    acting as Connect. Each request gets the next response recorded for the
+    same method and URI, or failing that the same path, after the time
+    Connect took to give it, multiplied by `speed`. Once the recorded
+    responses run out, the last is repeated, so polling a finished task
+    keeps finding it finished.
+
+    Requests that failed without a response are answered with 502.
+    """
+
+    def __init__(self, path, speed=1.0):
+        # the package is only needed, and so only imported, to replay
+        from rsconnect_jupyter.recording import RECORDING_FORMAT, redact_uri
+
+        self._redact_uri = redact_uri
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._by_uri = {}
+        self._by_path = {}
+        self._served = {}
+        with open(path) as f:
+            header = loads(f.readline() or "{}")
+            if header.get("format") != RECORDING_FORMAT:
+                raise ValueError("%s is not a recording of Connect traffic" % path)
+            for line in f:
+                if line.strip():
+                    entry = loads(line)
+                    self._by_uri.setdefault((entry["method"], entry["uri"]), []).append(entry)
+                    self._by_path.setdefault((entry["method"], entry["uri"].partition("?")[0]), []).append(entry)
+
+    def next(self, method, uri):
+        """
+        :return: the recorded exchange to answer a request with, or None if
+        nothing like it was recorded.
+        """
+        # recorded URIs have their secrets redacted, so compare them redacted
+        uri = self._redact_uri(uri)
+        with self._lock:
+            for key, recorded in (("uri", self._by_uri), ("path", self._by_path)):
+                match = (method, uri) if key == "uri" else (method, uri.partition("?")[0])
+                entries = recorded.get(match)
+                if entries:
+                    served = self._served.get((key, match), 0)
+                    self._served[(key, match)] = served + 1
+                    return entries[min(served, len(entries) - 1)]
+        return None
+
+    def delay(self, entry):
+        return entry["seconds"] * self.speed
+
+    @staticmethod
+    def response(entry):
+        """
+        :return: the status code, headers and body to answer with.
+        """
+        if entry is None:
+            return 404, {"Content-Type": "application/json"}, dumps({"error": "Not in the recording"})
+        if "error" in entry:
+            return 502, {"Content-Type": "application/json"}, dumps({"error": entry["error"]})
+        headers = {
+            name: value
+            for name, value in entry["response_headers"].items()
+            if name.lower() not in REPLAY_SKIPPED_HEADERS
+        }
+        body = dumps(entry["response_body"]) if "response_body" in entry else entry.get("response_text", "")
+        return entry["status"], headers, body
+
 
+def use_replay(path=None, speed=1.0):
+    """
+    Replays the recording at `path`, or stops replaying if it's None.
+    """
+    global replay
+    replay = Replay(path, speed) if path else None
+    return replay
+
+
+app = Flask(__name__)
 
-apps, app_id_generator = {}, IdGenerator()
-bundles, bundle_id_generator = {}, IdGenerator()
-tasks, task_id_generator = {}, IdGenerator()
 api_keys = {"0123456789abcdef0123456789abcdef": "admin"}
 
 # noinspection SpellCheckingInspection
@@ -120,11 +679,15 @@ def json(f):
     return wrapper
 
 
-def item_by_id(d):
+def item_by_id(kind):
+    """
+    Looks up the `object_id` in the URL with the store's `get_<kind>`.
+    """
+
     def decorator(f):
         @wraps(f)
         def wrapper(object_id, *args, **kw):
-            item = d.get(object_id)
+            item = getattr(store, "get_" + kind)(object_id)
             if item is None:
                 return dumps(error(404, "Not found"))
             return f(item, *args, **kw)
@@ -137,6 +700,31 @@ def item_by_id(d):
 api = Blueprint("api", __name__)
 
 
+@app.before_request
+def serve_replay():
+    if replay is None:
+        return None
+    # the body isn't needed, but must be read before answering
+    while request.stream.read(CHUNK_SIZE):
+        pass
+    query = request.query_string.decode("utf-8")
+    entry = replay.next(request.method, request.path + ("?" + query if query else ""))
+    if entry is not None:
+        time.sleep(replay.delay(entry))
+    status_code, headers, body = replay.response(entry)
+    return body, status_code, headers
+
+
+@app.before_request
+def apply_profile():
+    endpoint = (request.endpoint or "default").rpartition(".")[2]
+    delay, status_code = profile.response(endpoint)
+    if delay:
+        time.sleep(delay)
+    if status_code is not None:
+        return jsonify({"error": "Injected failure"}), status_code
+
+
 @app.route("/")
 def index():
     return "<html><body>Welcome to Mock Connect!</body></html>"
@@ -153,45 +741,55 @@ def timestamp():
     return datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
 
+def create_app(connect_app, user):
+    """
+    Adds an app owned by `user` to the store.
+
+    :return: the app, or None if its name is taken.
+    """
+    connect_app["guid"] = str(uuid.uuid4())
+    connect_app["owner_username"] = user.get("username")
+    connect_app["owner_first_name"] = user.get("first_name")
+    connect_app["owner_last_name"] = user.get("last_name")
+    connect_app["owner_email"] = user.get("email")
+    connect_app["owner_locked"] = user.get("locked")
+    connect_app.setdefault("bundle_id", None)
+    connect_app["needs_config"] = True
+    connect_app["access_type"] = None
+    connect_app["description"] = ""
+    connect_app.setdefault("app_mode", None)
+    connect_app["created_time"] = connect_app["updated_time"] = timestamp()
+    connect_app.setdefault("title", "")
+    if store.create_app(connect_app) is None:
+        return None
+    connect_app["url"] = "{0}content/{1}".format(url_for("index", _external=True), connect_app["id"])
+    store.save_app(connect_app)
+    return connect_app
+
+
 @api.route("applications", methods=["GET", "POST"])
 @authenticated
 @json
 def applications():
     if request.method == "POST":
-        connect_app = request.get_json(force=True)
-        name = connect_app.get("name")
-        if name and [existing_app for existing_app in apps.values() if existing_app.get("name") == name]:
+        connect_app = create_app(request.get_json(force=True), g.user)
+        if connect_app is None:
             return error(409, "An object with that name already exists.")
-
-        connect_app["id"] = app_id_generator.next()
-        connect_app["guid"] = str(uuid.uuid4())
-        connect_app["url"] = "{0}content/{1}".format(url_for("index", _external=True), connect_app["id"])
-        connect_app["owner_username"] = g.user.get("username")
-        connect_app["owner_first_name"] = g.user.get("first_name")
-        connect_app["owner_last_name"] = g.user.get("last_name")
-        connect_app["owner_email"] = g.user.get("email")
-        connect_app["owner_locked"] = g.user.get("locked")
-        connect_app["bundle_id"] = None
-        connect_app["needs_config"] = True
-        connect_app["access_type"] = None
-        connect_app["description"] = ""
-        connect_app["app_mode"] = None
-        connect_app["created_time"] = timestamp()
-        connect_app.setdefault("title", "")
-        apps[str(connect_app["id"])] = connect_app
         return connect_app
     else:
+        start = int(request.args.get("start", 0))
         count = int(request.args.get("count", 10000))
-        search = request.args.get("search")
-
-        def match(app_to_match):
-            return search is None or (app_to_match.get("title") or "").startswith(search)
-
-        matches = list(filter(match, apps.values()))[:count]
+        page, total = store.search_apps(
+            request.args.get("search"),
+            request.args.get("sort"),
+            request.args.get("order") == "desc",
+            start,
+            count,
+        )
         return {
-            "count": len(matches),
-            "total": len(matches),
-            "applications": matches,
+            "count": len(page),
+            "total": total,
+            "applications": page,
         }
 
 
@@ -199,12 +797,14 @@ def applications():
 @api.route("applications/<object_id>", methods=["GET", "POST"])
 @authenticated
 @json
-@item_by_id(apps)
+@item_by_id("app")
 def application(connect_app):
     if request.method == "GET":
         return connect_app
     else:
         connect_app.update(request.get_json(force=True))
+        connect_app["updated_time"] = timestamp()
+        store.save_app(connect_app)
         return connect_app
 
 
@@ -212,47 +812,81 @@ def application(connect_app):
 @api.route("applications/<object_id>/config")
 @authenticated
 @json
-@item_by_id(apps)
+@item_by_id("app")
 def config(connect_app):
     return {"config_url": "{0}content/apps/{1}".format(url_for("index", _external=True), connect_app["id"])}
 
 
+class BundleUpload(object):
+    """
+    A bundle being streamed to a temporary file in the store's bundle_dir.
+    """
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(suffix=".upload", dir=store.bundle_dir)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk):
+        self._file.write(chunk)
+
+    def finish(self, connect_app):
+        """
+        :return: the bundle, added to the store.
+        """
+        self._file.close()
+        ts = timestamp()
+        bundle = {
+            "app_id": connect_app["id"],
+            "created_time": ts,
+            "updated_time": ts,
+        }
+        return store.create_bundle(bundle, self.path)
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
 # noinspection PyUnresolvedReferences
 @api.route("applications/<object_id>/upload", methods=["POST"])
 @authenticated
 @json
-@item_by_id(apps)
+@item_by_id("app")
 def upload(connect_app):
-    bundle_id = bundle_id_generator.next()
-    ts = timestamp()
-
-    bundle = {
-        "id": bundle_id,
-        "app_id": connect_app["id"],
-        "created_time": ts,
-        "updated_time": ts,
-    }
-    bundles[bundle_id] = (bundle, request.data)
-    return bundle
-
-
-def read_bundle_file(tarball, filename):
-    bio = io.BytesIO(tarball)
-    with tarfile.open("r:gz", fileobj=bio) as tar:
+    bundle_upload = BundleUpload()
+    throttle = Throttle(profile.upload_bandwidth)
+    try:
+        chunk = request.stream.read(CHUNK_SIZE)
+        while chunk:
+            bundle_upload.write(chunk)
+            time.sleep(throttle.delay(len(chunk)))
+            chunk = request.stream.read(CHUNK_SIZE)
+    except Exception:
+        bundle_upload.discard()
+        raise
+    return bundle_upload.finish(connect_app)
+
+
+def read_bundle_file(path, filename):
+    with tarfile.open(path, "r:gz") as tar:
         return tar.extractfile(filename).read()
 
 
-def read_manifest(tarball):
-    manifest_data = read_bundle_file(tarball, "manifest.json").decode("utf-8")
+# bundles never change once uploaded, so what is read from them is kept
+@functools.lru_cache(maxsize=BUNDLE_CACHE_SIZE)
+def read_manifest(path):
+    manifest_data = read_bundle_file(path, "manifest.json").decode("utf-8")
     return loads(manifest_data)
 
 
-def read_html(tarball):
-    manifest = read_manifest(tarball)
+@functools.lru_cache(maxsize=BUNDLE_CACHE_SIZE)
+def read_html(path):
+    manifest = read_manifest(path)
     meta = manifest["metadata"]
     # noinspection SpellCheckingInspection
     filename = meta.get("primary_html") or meta.get("entrypoint")
-    return read_bundle_file(tarball, filename).decode("utf-8")
+    return read_bundle_file(path, filename).decode("utf-8")
 
 
 app_modes = {
@@ -266,18 +900,17 @@ app_modes = {
 @api.route("applications/<object_id>/deploy", methods=["POST"])
 @authenticated
 @json
-@item_by_id(apps)
+@item_by_id("app")
 def deploy(connect_app):
     bundle_id = request.get_json(force=True).get("bundle")
     if bundle_id is None:
         return error(400, "bundle_id is required")  # message and status code probably wrong
 
-    if bundle_id not in bundles:
+    bundle = store.get_bundle(bundle_id)
+    if bundle is None:
         return error(404, "bundle %s not found" % bundle_id)  # message and status code probably wrong
 
-    bundle, tarball = bundles[bundle_id]
-
-    manifest = read_manifest(tarball)
+    manifest = read_manifest(store.bundle_path(bundle["id"]))
     pprint(manifest)
 
     old_app_mode = connect_app["app_mode"]
@@ -289,29 +922,66 @@ def deploy(connect_app):
 
     connect_app["app_mode"] = new_app_mode
     connect_app["bundle_id"] = bundle_id
-    connect_app["last_deployed_time"] = timestamp()
+    connect_app["last_deployed_time"] = connect_app["updated_time"] = timestamp()
+    store.save_app(connect_app)
 
-    task_id = task_id_generator.next()
     task = {
-        "id": task_id,
         "user_id": 0,
-        "finished": True,
-        "code": 0,
-        "error": "",
-        "last_status": 0,
-        "status": ["Building static content", "Deploying static content"],
+        "started": time.time(),
+        "lines": profile.task["lines"],
+        "seconds": profile.task["seconds"],
+        "failed": profile.task_failed(),
+    }
+    return task_status(store.create_task(task), 0)
+
+
+def task_line(task, index):
+    """
+    :return: line `index` of a task's log: simulated pip install output,
+    then the outcome.
+    """
+    if index < task["lines"]:
+        package = "package%d" % (index // 3)
+        return (
+            "Collecting %s" % package,
+            "  Downloading %s-1.0.0-py3-none-any.whl (%d kB)" % (package, 10 + index % 990),
+            "Installing collected packages: %s" % package,
+        )[index % 3]
+    if task["failed"]:
+        return ["Building static content", "Error: simulated deployment failure"][index - task["lines"]]
+    return ["Building static content", "Deploying static content"][index - task["lines"]]
+
+
+def task_status(task, first_status):
+    """
+    :return: the task as Connect reports it: the log lines written so far,
+    from `first_status` on, and whether it has finished.
+    """
+    elapsed = time.time() - task["started"]
+    finished = elapsed >= task["seconds"]
+    if finished:
+        written = task["lines"] + 2
+    else:
+        written = int(task["lines"] * elapsed / task["seconds"])
+    failed = finished and task["failed"]
+    return {
+        "id": task["id"],
+        "user_id": task["user_id"],
+        "finished": finished,
+        "code": 1 if failed else 0,
+        "error": "Simulated deployment failure" if failed else "",
+        "last_status": written,
+        "status": [task_line(task, index) for index in range(first_status, written)],
     }
-    tasks[str(task_id)] = task
-    return task
 
 
 # noinspection PyUnresolvedReferences
 @api.route("tasks/<object_id>")
 @authenticated
 @json
-@item_by_id(tasks)
+@item_by_id("task")
 def get_task(task):
-    return task
+    return task_status(task, int(request.args.get("first_status", 0)))
 
 
 @api.route("server_settings")
@@ -320,12 +990,158 @@ def server_settings():
     return {"not_empty": True}
 
 
+@api.route("v1/server_settings/python")
+@authenticated
+@json
+def python_settings():
+    version = "%d.%d.%d" % sys.version_info[:3]
+    return {"installations": [{"version": version, "path": sys.executable}], "api_enabled": True}
+
+
 # noinspection PyUnresolvedReferences
 @app.route("/content/apps/<object_id>")
-@item_by_id(apps)
+@item_by_id("app")
 def content(connect_app):
-    bundle, tarball = bundles[connect_app["bundle_id"]]
-    return read_html(tarball)
+    if connect_app["bundle_id"] is None:
+        return dumps(error(404, "Not deployed"))
+    return read_html(store.bundle_path(connect_app["bundle_id"]))
 
 
 app.register_blueprint(api, url_prefix="/__api__")
+
+store = configure(os.environ.get("MOCK_CONNECT_DB"), os.environ.get("MOCK_CONNECT_BUNDLE_DIR"))
+profile = use_profile(os.environ.get("MOCK_CONNECT_PROFILE"))
+replay = use_replay(os.environ.get("MOCK_CONNECT_REPLAY"))
+
+
+def seed_apps(count):
+    """
+    Adds notebook apps until the store holds at least `count`, to benchmark
+    against a server with a large catalog.
+    """
+    with app.test_request_context(), store.transaction():
+        for index in range(store.app_count(), count):
+            create_app(
+                {
+                    "name": "seeded-%d" % index,
+                    "title": "Seeded notebook %d" % index,
+                    "app_mode": app_modes["jupyter-static"],
+                },
+                users["admin"],
+            )
+
+
+def tornado_app():
+    """
+    The app for Tornado. Bundle uploads are streamed to disk as they arrive,
+    which WSGI can't do, and everything else is handed to the Flask app.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from tornado import gen, web
+    from tornado.wsgi import WSGIContainer
+
+    @web.stream_request_body
+    class UploadHandler(web.RequestHandler):
+        async def prepare(self):
+            self.bundle_upload = None
+            self.replayed = None
+            if replay is not None:
+                self.request.connection.set_max_body_size(MAX_UPLOAD_SIZE)
+                self.replayed = replay.next("POST", self.request.uri)
+                return
+            delay, status_code = profile.response("upload")
+            if delay:
+                await gen.sleep(delay)
+            if status_code is not None:
+                self.set_status(status_code)
+                self.finish({"error": "Injected failure"})
+                return
+            auth = self.request.headers.get("Authorization", "")
+            if not auth.startswith("Key ") or auth[4:] not in api_keys:
+                raise web.HTTPError(401)
+            self.connect_app = store.get_app(self.path_kwargs["object_id"])
+            if self.connect_app is None:
+                self.set_status(404)
+                self.finish({"error": "Not found"})
+                return
+            self.request.connection.set_max_body_size(MAX_UPLOAD_SIZE)
+            self.bundle_upload = BundleUpload()
+            self.throttle = Throttle(profile.upload_bandwidth)
+
+        async def data_received(self, chunk):
+            if self.bundle_upload is None:
+                return
+            self.bundle_upload.write(chunk)
+            # not reading on until the delay is over slows the client down too
+            delay = self.throttle.delay(len(chunk))
+            if delay:
+                await gen.sleep(delay)
+
+        async def post(self, object_id):
+            if replay is not None:
+                if self.replayed is not None:
+                    await gen.sleep(replay.delay(self.replayed))
+                status_code, headers, body = replay.response(self.replayed)
+                self.set_status(status_code)
+                for name, value in headers.items():
+                    self.set_header(name, value)
+                self.finish(body)
+                return
+            bundle_upload, self.bundle_upload = self.bundle_upload, None
+            self.finish(bundle_upload.finish(self.connect_app))
+
+        def on_finish(self):
+            # the client went away, or the upload failed, before it was stored
+            if self.bundle_upload is not None:
+                self.bundle_upload.discard()
+                self.bundle_upload = None
+
+        on_connection_close = on_finish
+
+    try:
+        # so that slow responses from a profile don't hold up other requests
+        container = WSGIContainer(app, executor=ThreadPoolExecutor(WSGI_THREADS))
+    except TypeError:
+        # before Tornado 6.3, requests are handled one at a time
+        container = WSGIContainer(app)
+    return web.Application(
+        [
+            (r"/__api__/applications/(?P<object_id>[^/]+)/upload", UploadHandler),
+            (r".*", web.FallbackHandler, {"fallback": container}),
+        ]
+    )
+
+
+def serve(port, host="127.0.0.1"):
+    """
+    Serves the app with Tornado, which unlike the Flask development server
+    keeps HTTP/1.1 connections alive as Connect does.
+    """
+    from tornado.httpserver import HTTPServer
+    from tornado.ioloop import IOLoop
+
+    HTTPServer(tornado_app()).listen(port, host)
+    IOLoop.current().start()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a mock Posit Connect server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--db", help="keep content in this SQLite database rather than in memory")
+    parser.add_argument("--bundle-dir", help="directory for uploaded bundles")
+    parser.add_argument("--seed-apps", type=int, default=0, help="add notebook apps until there are this many")
+    parser.add_argument("--profile", help="latency and failures to simulate: %s, or a JSON file" % ", ".join(PROFILES))
+    parser.add_argument("--replay", help="serve the responses in this recording of Connect traffic")
+    parser.add_argument(
+        "--replay-speed", type=float, default=1.0, help="multiplies the recorded response times; 0 answers at once"
+    )
+    args = parser.parse_args()
+    configure(args.db, args.bundle_dir)
+    use_profile(args.profile)
+    use_replay(args.replay, args.replay_speed)
+    seed_apps(args.seed_apps)
+    serve(args.port, args.host)
@@ -1,36 +1,41 @@
+import asyncio
+import atexit
 import hashlib
 import json
 import os
 import sys
+import time
+from typing import Optional
 
 from six.moves.urllib.parse import unquote_plus
 from os.path import dirname
 
 from notebook.base.handlers import APIHandler
 from notebook.utils import url_path_join
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from tornado import web
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
 
 from rsconnect import VERSION
-from rsconnect.actions import test_server
-from rsconnect.api import (
-    RSConnect,
-    RSConnectException,
-    RSConnectServer,
-    override_title_search,
-    verify_api_key,
-)
-from rsconnect.bundle import (
-    make_notebook_html_bundle,
-    make_notebook_source_bundle,
-    make_voila_bundle,
-    write_manifest,
-)
-from rsconnect.environment import Environment
-from rsconnect.http_support import CookieJar
+from rsconnect.exception import RSConnectException
 
 from ssl import SSLError
 
+from rsconnect_jupyter.environment import (
+    EnvironmentInspectionError,
+    environment_fingerprint,
+    inspect_environment,
+    kernel_env,
+    kernel_python,
+    kernel_spec,
+    validate_environment,
+)
+from rsconnect_jupyter.executor import ExecutorBusy
+from rsconnect_jupyter.extension import RSConnectJupyter
+from rsconnect_jupyter.jobs import DeployJob, SharedBundle
 from rsconnect_jupyter.managers import get_model
+from rsconnect_jupyter.metrics import ACTION_DURATION, REGISTRY
 
 try:
     from rsconnect_jupyter.version import version as __version__  # noqa
@@ -75,262 +80,547 @@ def md5(s):
 
 # https://github.com/jupyter/notebook/blob/master/notebook/base/handlers.py
 class EndpointHandler(APIHandler):
+    @property
+    def extension(self) -> RSConnectJupyter:
+        return self.settings["rsconnect_jupyter"]
+
+    async def run_blocking(self, fn, *args, **kwargs):
+        """
+        Runs a blocking call on the extension's executor so the IOLoop stays
+        responsive while Connect is contacted or a bundle is built.
+        """
+        try:
+            return await self.extension.executor.run(fn, *args, **kwargs)
+        except ExecutorBusy as exc:
+            raise web.HTTPError(503, "rsconnect_jupyter is busy, try again shortly: %s" % exc)
+
+    def connect_client(self, data: dict, server_address: str = None, cookies: dict = None):
+        """
+        Checks out a pooled Connect client for the server and credentials in a
+        request body. Must be used from a blocking call, not on the IOLoop.
+        """
+        return self.extension.clients.client(
+            server_address or data["server_address"],
+            data["api_key"],
+            data["disable_tls_check"],
+            data.get("cadata", None),
+            cookies=cookies,
+        )
+
+    async def call_action(self, action: str, data: dict):
+        """
+        Runs an action, recording how long it took in the action metrics.
+        """
+        started = time.perf_counter()
+        status_code = 200
+        try:
+            return await self.post_actions[action](self, data)
+        except web.HTTPError as exc:
+            status_code = exc.status_code
+            raise
+        except Exception:
+            status_code = 500
+            raise
+        finally:
+            ACTION_DURATION.labels(action, status_code).observe(time.perf_counter() - started)
+
     @web.authenticated
     async def post(self, action):
-        data = self.get_json_body()
+        if action in self.post_actions:
+            self.finish(json.dumps(await self.call_action(action, self.get_json_body())))
 
-        if action == "verify_server":
-            server_address = data["server_address"]
-            api_key = data["api_key"]
-            disable_tls_check = data["disable_tls_check"]
-            cadata = data.get("cadata", None)
+    @web.authenticated
+    async def get(self, action):
+        if action in self.get_actions:
+            self.finish(json.dumps(await self.call_action(action, {})))
 
-            canonical_address = None
-            result = None
-            try:
-                canonical_address, result = test_server(
-                    RSConnectServer(server_address, api_key, disable_tls_check, cadata)
-                )
-            except SSLError as exc:
-                if exc.reason == "UNKNOWN_PROTOCOL":
-                    raise web.HTTPError(
-                        400,
-                        'Received an "SSL:UNKNOWN_PROTOCOL" error when trying to connect securely '
-                        + "to the Posit Connect server.\n"
-                        + '* Try changing "https://" in the "Server Address" field to "http://".\n'
-                        + "* If the condition persists, contact your Posit Connect server "
-                        + "administrator.",
-                    )
-                raise web.HTTPError(
-                    400,
-                    "A TLS error occurred when trying to reach the Posit Connect server.\n"
-                    + "* Ensure that the server address you entered is correct.\n"
-                    + "* Ask your Posit Connect administrator if you need a certificate bundle and\n"
-                    + '  upload it using "Upload TLS Certificate Bundle" below.',
-                )
-            except Exception as err:
-                self.log.exception("Unable to verify that the provided server is running Posit Connect")
-                raise web.HTTPError(
-                    400,
-                    "Unable to verify that the provided server is running Posit Connect: %s" % err,
-                )
-            if canonical_address is not None:
-                uri = canonical_address.url
-                try:
-                    verify_api_key(RSConnectServer(uri, api_key, disable_tls_check, cadata))
-                    address_hash = md5(server_address)
-                    self.finish(
-                        json.dumps(
-                            {
-                                "status": "Provided server is running Posit Connect",
-                                "address_hash": address_hash,
-                                "server_address": canonical_address.url,
-                            }
-                        )
-                    )
-                except RSConnectException:
-                    raise web.HTTPError(401, "Unable to verify the provided API key")
-            return
+    async def verify_server_action(self, data):
+        from rsconnect_jupyter.clients import ApiKeyError, verify_server
 
-        if action == "app_search":
-            uri = data["server_address"]
-            api_key = data["api_key"]
-            title = data["notebook_title"]
-            app_id = data.get("app_id")
-            disable_tls_check = data["disable_tls_check"]
-            cadata = data.get("cadata", None)
+        server_address = data["server_address"]
+        api_key = data["api_key"]
+        disable_tls_check = data["disable_tls_check"]
+        cadata = data.get("cadata", None)
 
-            try:
-                server = RSConnectServer(uri, api_key, disable_tls_check, cadata)
-                retval = override_title_search(server, app_id, title)
-            except RSConnectException as exc:
-                raise web.HTTPError(400, exc.message)
-            self.finish(json.dumps(retval))
-            return
+        verified = self.extension.verified.get(server_address, api_key, disable_tls_check, cadata)
+        if verified is not None:
+            return verified
 
-        if action == "deploy":
-            uri = data["server_address"]
-            app_id = data.get("app_id")
-            nb_title = data["notebook_title"]
-            nb_name = data["notebook_name"]
-            nb_path = unquote_plus(data["notebook_path"].strip("/"))
-            api_key = data["api_key"]
-            app_mode = data["app_mode"]
-            environment_dict = data.get("environment")
-            disable_tls_check = data["disable_tls_check"]
-            cadata = data.get("cadata", None)
-            extra_files = data.get("files", [])
-            hide_all_input = data.get("hide_all_input", False)
-            hide_tagged_input = data.get("hide_tagged_input", False)
-
-            model = await get_model(self.contents_manager, nb_path)
-
-            if model["type"] != "notebook":
-                # not a notebook
-                raise web.HTTPError(400, "Not a notebook: %s" % nb_path)
-
-            if not hasattr(self.contents_manager, "_get_os_path"):
-                raise web.HTTPError(400, "Notebook does not live on a mounted filesystem")
-
-            os_path = self.contents_manager._get_os_path(nb_path)
-
-            if app_mode == "static":
-                try:
-                    bundle = make_notebook_html_bundle(
-                        os_path, sys.executable, hide_all_input=hide_all_input, hide_tagged_input=hide_tagged_input
-                    )
-                except Exception as exc:
-                    self.log.exception("Bundle creation failed")
-                    raise web.HTTPError(500, "Bundle creation failed: %s" % exc)
-            elif app_mode == "jupyter-static":
-                if not environment_dict:
-                    raise web.HTTPError(400, "environment is required for jupyter-static app_mode")
-
-                try:
-                    bundle = make_notebook_source_bundle(
-                        os_path,
-                        Environment(**environment_dict),
-                        extra_files,
-                        hide_all_input=hide_all_input,
-                        hide_tagged_input=hide_tagged_input,
-                    )
-                except Exception as exc:
-                    self.log.exception("Bundle creation failed")
-                    raise web.HTTPError(500, "Bundle creation failed: %s" % exc)
-            elif app_mode == "jupyter-voila":
-                # workaround current dir issue with rsconnect-python's voila deployments
-                os.chdir(dirname(os_path))
-                if not environment_dict:
-                    raise web.HTTPError(400, "environment is required for jupyter-voila app_mode")
-
-                try:
-                    bundle = make_voila_bundle(
-                        os_path,
-                        None,
-                        extra_files,
-                        [],  # excludes
-                        False,  # force_generate
-                        Environment(**environment_dict),
-                    )
-                except Exception as exc:
-                    self.log.exception("Bundle creation failed")
-                    raise web.HTTPError(500, "Bundle creation failed: %s" % exc)
-            else:
+        try:
+            canonical_address, _ = await self.run_blocking(
+                verify_server, self.extension.clients, server_address, api_key, disable_tls_check, cadata
+            )
+        except web.HTTPError:
+            raise
+        except ApiKeyError:
+            raise web.HTTPError(401, "Unable to verify the provided API key")
+        except SSLError as exc:
+            if exc.reason == "UNKNOWN_PROTOCOL":
                 raise web.HTTPError(
                     400,
-                    'Invalid app_mode: %s, must be "static" or "jupyter-static"' % app_mode,
+                    'Received an "SSL:UNKNOWN_PROTOCOL" error when trying to connect securely '
+                    + "to the Posit Connect server.\n"
+                    + '* Try changing "https://" in the "Server Address" field to "http://".\n'
+                    + "* If the condition persists, contact your Posit Connect server "
+                    + "administrator.",
                 )
+            raise web.HTTPError(
+                400,
+                "A TLS error occurred when trying to reach the Posit Connect server.\n"
+                + "* Ensure that the server address you entered is correct.\n"
+                + "* Ask your Posit Connect administrator if you need a certificate bundle and\n"
+                + '  upload it using "Upload TLS Certificate Bundle" below.',
+            )
+        except Exception as err:
+            self.log.exception("Unable to verify that the provided server is running Posit Connect")
+            raise web.HTTPError(
+                400,
+                "Unable to verify that the provided server is running Posit Connect: %s" % err,
+            )
 
-            try:
-                server = RSConnectServer(uri, api_key, disable_tls_check, cadata)
-                with RSConnect(server) as api_client:
-                    retval = api_client.deploy(app_id, nb_name, nb_title, nb_title is not None, bundle)
-                    retval["cookies"] = server.cookie_jar.as_dict()
-            except RSConnectException as exc:
-                raise web.HTTPError(400, exc.message)
-
-            self.finish(json.dumps(retval))
-            return
-
-        if action == "app_get":
-            uri = data["server_address"]
-            api_key = data["api_key"]
-            app_id = data["app_id"]
-            disable_tls_check = data["disable_tls_check"]
-            cadata = data.get("cadata", None)
-
-            try:
-                server = RSConnectServer(uri, api_key, disable_tls_check, cadata)
-                with RSConnect(server) as api_client:
-                    retval = api_client.app_get(app_id)
-            except RSConnectException as exc:
-                raise web.HTTPError(400, exc.message)
-            self.finish(json.dumps(retval))
-            return
-
-        if action == "get_log":
-            uri = data["server_address"]
-            api_key = data["api_key"]
-            task_id = data["task_id"]
-            last_status = data["last_status"]
-            cookie_source = data.get("cookies", {})
-            disable_tls_check = data["disable_tls_check"]
-            cadata = data.get("cadata", None)
-
-            try:
-                rs_connect_server = RSConnectServer(uri, api_key, disable_tls_check, cadata)
-                rs_connect_server.cookie_jar = CookieJar.from_dict(cookie_source)
-                with RSConnect(rs_connect_server) as api_client:
-                    retval = api_client.task_get(task_id, last_status)
-                rs_connect_server.handle_bad_response(retval)
-            except RSConnectException as exc:
-                raise web.HTTPError(400, exc.message)
-            self.finish(json.dumps(retval))
-            return
+        verified = {
+            "status": "Provided server is running Posit Connect",
+            "address_hash": md5(server_address),
+            "server_address": canonical_address,
+        }
+        self.extension.verified.put(server_address, api_key, disable_tls_check, cadata, verified)
+        return verified
+
+    async def app_search_action(self, data):
+        title = data["notebook_title"]
+        app_id = data.get("app_id")
+        start = int(data.get("start", 0))
+        count = int(data.get("count", 5))
+
+        def search():
+            with self.connect_client(data) as api_client:
+                return self.extension.app_search.search(api_client, app_id, title, start, count)
+
+        try:
+            return await self.run_blocking(search)
+        except RSConnectException as exc:
+            raise web.HTTPError(400, exc.message)
+
+    async def content_params(self, data) -> dict:
+        """
+        Validates the notebook and options of a deployment.
+
+        :return: the deployment parameters that don't depend on the target.
+        """
+        nb_path = unquote_plus(data["notebook_path"].strip("/"))
+        app_mode = data["app_mode"]
+        environment_dict = data.get("environment")
+
+        model = await get_model(self.contents_manager, nb_path)
+
+        if model["type"] != "notebook":
+            # not a notebook
+            raise web.HTTPError(400, "Not a notebook: %s" % nb_path)
+
+        if not hasattr(self.contents_manager, "_get_os_path"):
+            raise web.HTTPError(400, "Notebook does not live on a mounted filesystem")
+
+        os_path = self.contents_manager._get_os_path(nb_path)
+
+        if app_mode not in ("static", "jupyter-static", "jupyter-voila"):
+            raise web.HTTPError(
+                400,
+                'Invalid app_mode: %s, must be "static" or "jupyter-static"' % app_mode,
+            )
+        if app_mode != "static" and not environment_dict:
+            raise web.HTTPError(400, "environment is required for %s app_mode" % app_mode)
+
+        return {
+            "app_mode": app_mode,
+            "os_path": os_path,
+            "python": sys.executable,
+            "environment": environment_dict,
+            "files": data.get("files", []),
+            "hide_all_input": data.get("hide_all_input", False),
+            "hide_tagged_input": data.get("hide_tagged_input", False),
+            "environment_seconds": data.get("environment_seconds"),
+        }
+
+    @staticmethod
+    def target_params(target: dict) -> dict:
+        return {
+            "server_address": target["server_address"],
+            "api_key": target["api_key"],
+            "disable_tls_check": target["disable_tls_check"],
+            "cadata": target.get("cadata", None),
+            "app_id": target.get("app_id"),
+            "notebook_name": target["notebook_name"],
+            "notebook_title": target["notebook_title"],
+        }
+
+    async def deploy_action(self, data):
+        params = await self.content_params(data)
+        job = DeployJob(dict(params, **self.target_params(data)))
+        self.extension.jobs.submit(job, job.run(self.extension))
+        return job.to_dict()
+
+    async def deploy_many_action(self, data):
+        """
+        Deploys the same content to several targets, e.g. a staging and a
+        production server. The bundle is built once and then uploaded and
+        deployed to every target concurrently, each by its own job.
+
+        Each of the body's `targets` has the server, credentials, app ID,
+        name and title of one deployment, which default to the body's.
+
+        :return: `jobs`, the job for each target in the same order.
+        """
+        params = await self.content_params(data)
+        shared = {key: value for key, value in data.items() if key != "targets"}
+        bundle = SharedBundle(len(data["targets"]))
+        jobs = []
+        for target in data["targets"]:
+            job = DeployJob(dict(params, **self.target_params(dict(shared, **target))), bundle)
+            self.extension.jobs.submit(job, job.run(self.extension))
+            jobs.append(job.to_dict())
+        return {"jobs": jobs}
+
+    async def job_get_action(self, data):
+        job = self.extension.jobs.get(data["job_id"])
+        if job is None:
+            raise web.HTTPError(404, "No such deployment: %s" % data["job_id"])
+        return job.to_dict(data.get("cursor", 0))
+
+    async def notebook_jobs_action(self, data):
+        """
+        Lists the latest deployment of a notebook to each server, so the
+        browser can record where it was published even if the tab that
+        started it went away, or follow it if it is still running.
+        """
+        nb_path = unquote_plus(data["notebook_path"].strip("/"))
+        os_path = self.contents_manager._get_os_path(nb_path)
+        jobs = []
+        for job in self.extension.jobs.for_notebook(os_path):
+            state = job.to_dict(len(job.log))
+            state.update(
+                server_address=job.params["server_address"],
+                notebook_title=job.params["notebook_title"],
+                app_mode=job.params["app_mode"],
+            )
+            jobs.append(state)
+        return {"jobs": jobs}
+
+    async def app_get_action(self, data):
+        app_id = data["app_id"]
+
+        def app_get():
+            with self.connect_client(data) as api_client:
+                return api_client.app_get(app_id)
+
+        try:
+            return await self.run_blocking(app_get)
+        except RSConnectException as exc:
+            raise web.HTTPError(400, exc.message)
+
+    async def get_log_action(self, data):
+        task_id = data["task_id"]
+        # Clients that send a cursor get only the lines after it, as `lines`,
+        # and the cursor to send next; others get the whole `status` list.
+        cursor = data.get("cursor")
+        last_status = cursor if cursor is not None else data.get("last_status")
+        cookie_source = data.get("cookies", {})
+
+        def task_get():
+            with self.connect_client(data, cookies=cookie_source) as api_client:
+                return api_client.handle_bad_response(api_client.task_get(task_id, last_status))
+
+        try:
+            retval = await self.run_blocking(task_get)
+        except RSConnectException as exc:
+            raise web.HTTPError(400, exc.message)
+        if cursor is not None:
+            retval["lines"] = retval.pop("status")
+            retval["cursor"] = retval.pop("last_status")
+        return retval
+
+    async def app_config_action(self, data):
+        app_id = data["app_id"]
+
+        def app_config():
+            with self.connect_client(data) as api_client:
+                return api_client.handle_bad_response(api_client.app_config(app_id))
+
+        try:
+            return await self.run_blocking(app_config)
+        except RSConnectException as exc:
+            raise web.HTTPError(400, exc.message)
+
+    async def write_manifest_action(self, data):
+        from rsconnect.bundle import write_manifest
+        from rsconnect.environment import Environment
+
+        environment_dict = data["environment"]
+        nb_path = unquote_plus(data["notebook_path"].strip("/"))
+        relative_dir = dirname(nb_path)
+        os_path = self.contents_manager._get_os_path(nb_path)
+        output_dir = dirname(os_path)
+        nb_name = os.path.basename(os_path)
+        created, skipped = await self.run_blocking(
+            write_manifest, relative_dir, nb_name, Environment(**environment_dict), output_dir
+        )
+        return {"created": created, "skipped": skipped}
 
-        if action == "app_config":
-            uri = data["server_address"]
-            api_key = data["api_key"]
-            app_id = data["app_id"]
-            disable_tls_check = data["disable_tls_check"]
-            cadata = data.get("cadata", None)
+    async def inspect_environment_action(self, data):
+        nb_path = unquote_plus(data["notebook_path"].strip("/"))
+        directory = dirname(self.contents_manager._get_os_path(nb_path))
+        spec = kernel_spec(
+            self.kernel_manager, self.kernel_spec_manager, data.get("kernel_id"), data.get("kernel_name")
+        )
+        python = kernel_python(spec)
+        if python is None:
+            # e.g. a remote kernel; the browser inspects through the kernel instead
+            return {"python": None, "environment": None}
+
+        env = kernel_env(spec)
+        conda_mode = bool(data.get("conda_mode"))
+        force_generate = bool(data.get("force_generate"))
+        fingerprint = None
+        if not force_generate:
+            fingerprint = await self.run_blocking(environment_fingerprint, python, directory, conda_mode, env)
+            environment = self.extension.environments.get(fingerprint)
+            if environment is not None:
+                return {"python": python, "environment": environment}
+
+        try:
+            environment = await self.run_blocking(
+                inspect_environment,
+                python,
+                directory,
+                conda_mode,
+                force_generate,
+                self.extension.environment_timeout,
+                env,
+            )
+        except EnvironmentInspectionError as exc:
+            raise web.HTTPError(400, str(exc))
+        if fingerprint is not None:
+            self.extension.environments.put(fingerprint, environment)
+        return {"python": python, "environment": environment}
+
+    async def kernel_environment_key(self, data) -> Optional[str]:
+        """
+        The cache key of an environment the browser inspected through the
+        notebook's kernel: a fingerprint of the notebook's directory and the
+        kernel's interpreter and environment variables, worked out here. It is
+        kept apart from the environments inspected by the server itself, so
+        what the browser reports is only reused for the browser.
+
+        :return: the key, or None if the interpreter isn't on this machine
+        (e.g. a remote kernel), since then nothing here changes when packages
+        are installed in the kernel and the environment mustn't be cached.
+        """
+        nb_path = unquote_plus(data["notebook_path"].strip("/"))
+        directory = dirname(self.contents_manager._get_os_path(nb_path))
+        spec = kernel_spec(
+            self.kernel_manager, self.kernel_spec_manager, data.get("kernel_id"), data.get("kernel_name")
+        )
 
+        def fingerprint():
+            if not os.path.isfile(data["python"]):
+                return None
+            return environment_fingerprint(data["python"], directory, bool(data.get("conda_mode")), kernel_env(spec))
+
+        key = await self.run_blocking(fingerprint)
+        return "kernel-" + key if key is not None else None
+
+    async def environment_lookup_action(self, data):
+        key = await self.kernel_environment_key(data)
+        return {"environment": self.extension.environments.get(key) if key is not None else None}
+
+    async def environment_store_action(self, data):
+        # any fingerprint in the body is ignored
+        try:
+            environment = validate_environment(data.get("environment"))
+        except ValueError as exc:
+            raise web.HTTPError(400, str(exc))
+        key = await self.kernel_environment_key(data)
+        if key is not None:
+            self.extension.environments.put(key, environment)
+        return {}
+
+    async def get_python_settings_action(self, data):
+        def python_settings():
+            with self.connect_client(data) as api_client:
+                return api_client.handle_bad_response(api_client.python_settings())
+
+        try:
+            return await self.run_blocking(python_settings)
+        except RSConnectException as exc:
+            raise web.HTTPError(400, exc.message)
+
+    async def plugin_version_action(self, data):
+        return {
+            "rsconnect_jupyter_server_extension": __version__,
+            "rsconnect_python_version": VERSION,
+        }
+
+    async def js_version_action(self, data):
+        # the version.json installed with the nbextension, which may differ
+        # from this package's if the two were installed separately
+        for path in self.settings.get("nbextensions_path", []):
+            version_file = os.path.join(path, "rsconnect_jupyter", "version.json")
+            if os.path.isfile(version_file):
+                with open(version_file) as f:
+                    return json.load(f)
+        raise web.HTTPError(404, "The rsconnect_jupyter nbextension is not installed")
+
+    async def config_action(self, data):
+        # the same section the nbextension reads from api/config/rsconnect_jupyter
+        return self.config_manager.get("rsconnect_jupyter")
+
+    async def status_action(self, data):
+        return self.extension.status()
+
+    async def batch_action(self, data):
+        """
+        Runs several actions in one request, concurrently, so the publish
+        dialog can load everything it needs in one round trip.
+
+        The body's `actions` is a list of `{"action": ..., "data": {...}}`.
+        Every other field of the body, such as the server address and API
+        key, is shared by all of the actions and overridden by their `data`.
+        An action given a `server_id` instead of an API key uses the
+        credentials saved for that server, so the dialog can load the
+        notebook's app before it has fetched the saved servers.
+
+        :return: a list with one entry per action, in the same order. Each is
+        either `{"status": 200, "result": ...}` or `{"status": ..., "message":
+        ...}` if the action failed; one failing doesn't fail the others.
+        """
+        shared = {key: value for key, value in data.items() if key != "actions"}
+
+        async def run(sub_action):
+            action = sub_action.get("action")
+            if action not in self.post_actions or action == "batch":
+                return {"status": 404, "message": "Unknown action: %s" % action}
+            action_data = dict(shared, **sub_action.get("data", {}))
+            if "server_id" in action_data and "api_key" not in action_data:
+                saved = self.config_manager.get("rsconnect_jupyter").get(action_data["server_id"])
+                if not saved or not saved.get("apiKey"):
+                    return {"status": 404, "message": "No saved server: %s" % action_data["server_id"]}
+                action_data.update(
+                    server_address=saved["server"],
+                    api_key=saved["apiKey"],
+                    disable_tls_check=saved.get("disableTLSCheck") or False,
+                    cadata=saved.get("cadata"),
+                )
             try:
-                server = RSConnectServer(uri, api_key, disable_tls_check, cadata)
-                with RSConnect(server) as api_client:
-                    retval = api_client.app_config(app_id)
-                server.handle_bad_response(retval)
-            except RSConnectException as exc:
-                raise web.HTTPError(400, exc.message)
-            self.finish(json.dumps(retval))
-            return
+                result = await self.call_action(action, action_data)
+            except web.HTTPError as exc:
+                return {"status": exc.status_code, "message": exc.log_message}
+            except Exception as exc:
+                self.log.exception("Action %s failed in a batch", action)
+                return {"status": 500, "message": str(exc)}
+            return {"status": 200, "result": result}
+
+        return await asyncio.gather(*[run(sub_action) for sub_action in data["actions"]])
+
+    # actions by name; those in `get_actions` can also be requested with GET
+    post_actions = {
+        "verify_server": verify_server_action,
+        "app_search": app_search_action,
+        "deploy": deploy_action,
+        "deploy_many": deploy_many_action,
+        "job_get": job_get_action,
+        "notebook_jobs": notebook_jobs_action,
+        "app_get": app_get_action,
+        "get_log": get_log_action,
+        "app_config": app_config_action,
+        "write_manifest": write_manifest_action,
+        "inspect_environment": inspect_environment_action,
+        "environment_lookup": environment_lookup_action,
+        "environment_store": environment_store_action,
+        "get_python_settings": get_python_settings_action,
+        "plugin_version": plugin_version_action,
+        "js_version": js_version_action,
+        "config": config_action,
+        "status": status_action,
+        "batch": batch_action,
+    }
+    get_actions = {"plugin_version", "status"}
+
+
+class JobEventsHandler(APIHandler):
+    """
+    Streams a deployment job's progress as Server-Sent Events. Every event is
+    a `job` event carrying the log lines added since the previous one, so any
+    number of tabs can follow a job while Connect is polled only once.
+
+    The event ID is the log cursor, letting EventSource resume after a
+    reconnect via the Last-Event-ID header.
+    """
+
+    # Seconds between keep-alive comments, to stop proxies timing out an idle stream.
+    heartbeat_interval = 15
+
+    @property
+    def extension(self) -> RSConnectJupyter:
+        return self.settings["rsconnect_jupyter"]
 
-        if action == "write_manifest":
-            environment_dict = data["environment"]
-            nb_path = unquote_plus(data["notebook_path"].strip("/"))
-            relative_dir = dirname(nb_path)
-            os_path = self.contents_manager._get_os_path(nb_path)
-            output_dir = dirname(os_path)
-            nb_name = os.path.basename(os_path)
-            created, skipped = write_manifest(relative_dir, nb_name, Environment(**environment_dict), output_dir)
-            self.finish(json.dumps({"created": created, "skipped": skipped}))
+    @web.authenticated
+    async def get(self, job_id):
+        job = self.extension.jobs.get(job_id)
+        if job is None:
+            raise web.HTTPError(404, "No such deployment: %s" % job_id)
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        # disable response buffering in nginx
+        self.set_header("X-Accel-Buffering", "no")
+
+        try:
+            cursor = int(self.request.headers.get("Last-Event-ID", 0))
+        except ValueError:
+            cursor = 0
+
+        try:
+            while True:
+                if await job.wait_for_change(cursor, self.heartbeat_interval):
+                    event = job.to_dict(cursor)
+                    cursor = event["cursor"]
+                    self.write("id: %d\nevent: job\ndata: %s\n\n" % (cursor, json.dumps(event)))
+                else:
+                    self.write(": keep-alive\n\n")
+                await self.flush()
+                if job.done and cursor == len(job.log):
+                    break
+        except StreamClosedError:
+            # the tab went away; the job carries on regardless
             return
+        self.finish()
 
-        if action == "get_python_settings":
-            uri = data["server_address"]
-            api_key = data["api_key"]
-            disable_tls_check = data["disable_tls_check"]
-            cadata = data.get("cadata", None)
 
-            try:
-                server = RSConnectServer(uri, api_key, disable_tls_check, cadata)
-                with RSConnect(server) as api_client:
-                    retval = api_client.python_settings()
-                server.handle_bad_response(retval)
-            except RSConnectException as exc:
-                raise web.HTTPError(400, exc.message)
-            self.finish(json.dumps(retval))
-            return
+class MetricsHandler(APIHandler):
+    """
+    Serves the extension's metrics in the Prometheus text format. They are
+    also included in the notebook server's own `/metrics`.
+    """
 
     @web.authenticated
-    def get(self, action):
-        if action == "plugin_version":
-            rsconnect_jupyter_server_extension = __version__
-            rsconnect_python_version = VERSION
-            self.finish(
-                json.dumps(
-                    {
-                        "rsconnect_jupyter_server_extension": rsconnect_jupyter_server_extension,
-                        "rsconnect_python_version": rsconnect_python_version,
-                    }
-                )
-            )
+    def get(self):
+        self.set_header("Content-Type", CONTENT_TYPE_LATEST)
+        self.finish(generate_latest(REGISTRY))
 
 
 def load_jupyter_server_extension(nb_app):
     nb_app.log.info("rsconnect_jupyter enabled!")
     web_app = nb_app.web_app
+    extension = RSConnectJupyter(config=getattr(nb_app, "config", None), log=nb_app.log)
+    web_app.settings["rsconnect_jupyter"] = extension
+    IOLoop.current().add_callback(extension.start)
+    # the notebook server has no shutdown hook for server extensions
+    atexit.register(extension.shutdown)
     host_pattern = ".*$"
     action_pattern = r"(?P<action>\w+)"
     route_pattern = url_path_join(web_app.settings["base_url"], r"/rsconnect_jupyter/%s" % action_pattern)
-    web_app.add_handlers(host_pattern, [(route_pattern, EndpointHandler)])
+    events_pattern = url_path_join(web_app.settings["base_url"], r"/rsconnect_jupyter/job_events/(?P<job_id>\w+)")
+    metrics_pattern = url_path_join(web_app.settings["base_url"], r"/rsconnect_jupyter/metrics")
+    web_app.add_handlers(
+        host_pattern,
+        [(events_pattern, JobEventsHandler), (metrics_pattern, MetricsHandler), (route_pattern, EndpointHandler)],
+    )
@@ -0,0 +1,669 @@
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from os.path import basename, dirname, isfile, join, splitext
+from pathlib import Path
+from typing import IO, Dict, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+from rsconnect.bundle import (
+    create_voila_manifest,
+    make_html_manifest,
+    make_source_manifest,
+    manifest_add_buffer,
+    manifest_add_file,
+)
+from rsconnect.environment import Environment
+from rsconnect.models import AppModes
+
+from rsconnect_jupyter.metrics import BUNDLE_BUILD_DURATION, BUNDLE_SIZE
+
+# How long past `timeout` the parent waits for a worker to give up on its own
+# before the pool is torn down.
+_HARD_TIMEOUT_GRACE = 10
+
+# Bytes of rendered notebook output held in memory before it spills to disk.
+DEFAULT_SPOOL_THRESHOLD = 8 * 1024 * 1024
+
+# Part of every bundle cache key; bump it when the bundle layout changes so
+# bundles cached by an older version are not reused.
+CACHE_FORMAT = 1
+
+
+class BundleBuildError(Exception):
+    pass
+
+
+def _warm_worker(memory_limit: int):
+    """
+    Process pool initializer. Imports the bundling stack once per worker so
+    individual builds don't pay for it, and applies the address space limit.
+    """
+    import nbconvert  # noqa: F401
+    import rsconnect.bundle  # noqa: F401
+
+    if memory_limit and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def _ping():
+    return os.getpid()
+
+
+class _BuildTimeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise _BuildTimeout()
+
+
+def _render_html(os_path: str, python: str, hide_all_input: bool, hide_tagged_input: bool, output: IO[bytes]):
+    """
+    Executes a notebook and renders it to HTML, streaming nbconvert's output
+    into `output` rather than collecting it in memory.
+    """
+    cmd = [python, "-m", "nbconvert", "--execute", "--stdout", "--log-level=ERROR", "--to=html", os_path]
+    if hide_all_input:
+        cmd.append("--no-input")
+    elif hide_tagged_input:
+        cmd.append("--TagRemovePreprocessor.remove_input_tags=hide_input")
+
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    try:
+        shutil.copyfileobj(process.stdout, output)
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+
+def _add_fileobj(bundle: tarfile.TarFile, name: str, fileobj: IO[bytes]):
+    info = tarfile.TarInfo(name)
+    info.size = fileobj.seek(0, os.SEEK_END)
+    fileobj.seek(0)
+    bundle.addfile(info, fileobj)
+
+
+def _add_path(bundle: tarfile.TarFile, name: str, path: str):
+    info = bundle.gettarinfo(path, name)
+    # only the content and permissions may affect the bundle's bytes
+    info.mtime = 0
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    if info.isreg():
+        with open(path, "rb") as f:
+            bundle.addfile(info, f)
+    else:
+        bundle.addfile(info)
+
+
+def _write_tar(output: IO[bytes], files: Dict[str, str], buffers: Dict[str, IO[bytes]]):
+    """
+    Writes a reproducible tar.gz: manifest.json first, then the other entries
+    sorted by name, with fixed timestamps and ownership, so the same inputs
+    always produce the same bytes.
+
+    :param files: files on disk, by their name in the bundle.
+    :param buffers: file objects, by their name in the bundle.
+    """
+    names = sorted(set(files) | set(buffers), key=lambda name: (name != "manifest.json", name))
+    with gzip.GzipFile(filename="", mode="wb", fileobj=output, mtime=0) as compressed:
+        with tarfile.open(mode="w", fileobj=compressed) as bundle:
+            for name in names:
+                if name in buffers:
+                    _add_fileobj(bundle, name, buffers[name])
+                else:
+                    _add_path(bundle, name, files[name])
+
+
+def _buffer(contents) -> IO[bytes]:
+    if isinstance(contents, str):
+        contents = contents.encode("utf-8")
+    return io.BytesIO(contents)
+
+
+def write_html_bundle(
+    output: IO[bytes],
+    os_path: str,
+    python: str,
+    hide_all_input: bool,
+    hide_tagged_input: bool,
+    spool_dir: str,
+    spool_threshold: int = DEFAULT_SPOOL_THRESHOLD,
+    timings: Optional[dict] = None,
+):
+    """
+    The streaming equivalent of `rsconnect.bundle.make_notebook_html_bundle`.
+    The rendered HTML is kept in memory up to `spool_threshold` bytes and in a
+    file in `spool_dir` beyond that; the tar.gz is written straight to `output`.
+
+    :param timings: if given, `render_seconds` and `rendered_bytes` are set on it.
+    """
+    html_name = splitext(basename(os_path))[0] + ".html"
+    manifest = json.dumps(make_html_manifest(html_name), indent=2)
+    with tempfile.SpooledTemporaryFile(max_size=spool_threshold, prefix="rsc_html", dir=spool_dir) as html:
+        started = time.monotonic()
+        _render_html(os_path, python, hide_all_input, hide_tagged_input, html)
+        if timings is not None:
+            timings["render_seconds"] = round(time.monotonic() - started, 3)
+            timings["rendered_bytes"] = html.tell()
+        _write_tar(output, {}, {html_name: html, "manifest.json": _buffer(manifest)})
+
+
+def write_source_bundle(
+    output: IO[bytes],
+    os_path: str,
+    environment: Environment,
+    extra_files: List[str],
+    hide_all_input: bool,
+    hide_tagged_input: bool,
+):
+    """
+    The streaming, reproducible equivalent of
+    `rsconnect.bundle.make_notebook_source_bundle`.
+    """
+    base_dir = dirname(os_path)
+    nb_name = basename(os_path)
+
+    manifest = make_source_manifest(AppModes.JUPYTER_NOTEBOOK, environment, nb_name, None)
+    if hide_all_input or hide_tagged_input:
+        manifest["jupyter"] = {}
+        if hide_all_input:
+            manifest["jupyter"]["hide_all_input"] = True
+        if hide_tagged_input:
+            manifest["jupyter"]["hide_tagged_input"] = True
+    manifest_add_file(manifest, nb_name, base_dir)
+    manifest_add_buffer(manifest, environment.filename, environment.contents)
+
+    extra_files = sorted(set(extra_files or []) - {nb_name, environment.filename, "manifest.json"})
+    for rel_path in extra_files:
+        manifest_add_file(manifest, rel_path, base_dir)
+
+    files = {Path(rel_path).as_posix(): join(base_dir, rel_path) for rel_path in [nb_name] + extra_files}
+    buffers = {
+        "manifest.json": _buffer(json.dumps(manifest, indent=2)),
+        environment.filename: _buffer(environment.contents),
+    }
+    _write_tar(output, files, buffers)
+
+
+def write_voila_bundle(output: IO[bytes], os_path: str, environment: Environment, extra_files: List[str]):
+    """
+    The streaming, reproducible equivalent of `rsconnect.bundle.make_voila_bundle`.
+    """
+    # rsconnect-python resolves relative extra files against the current
+    # directory, which is shared by every thread in the server
+    base_dir = dirname(os_path)
+    extra_files = [join(base_dir, extra_file) for extra_file in extra_files or []]
+    manifest = create_voila_manifest(
+        os_path, None, environment, extra_files=extra_files, excludes=[], force_generate=False
+    )
+    if manifest.data.get("files") is None:
+        raise BundleBuildError("No valid files were found for the manifest.")
+
+    buffers = {name: _buffer(contents) for name, contents in manifest.flattened_buffer.items()}
+    buffers["manifest.json"] = _buffer(json.dumps(manifest.flattened_copy.data, indent=2))
+    files = {}
+    for path in manifest.data["files"]:
+        rel_path = Path(path).relative_to(manifest.deploy_dir).as_posix()
+        # by the whole relative path, so e.g. data/requirements.txt is still bundled
+        if path not in manifest.buffer and rel_path not in buffers:
+            files[rel_path] = path
+    _write_tar(output, files, buffers)
+
+
+def bundle_key(
+    app_mode: str,
+    os_path: str,
+    python: str,
+    environment: Optional[dict],
+    extra_files: List[str],
+    hide_all_input: bool,
+    hide_tagged_input: bool,
+) -> Optional[str]:
+    """
+    A hash of everything a bundle is built from: the build options, and the
+    contents of the notebook, the extra files and, for voila, voila.json.
+
+    :return: the hex digest, or None if the bundle mustn't be cached: a file
+    can't be read, or the notebook is executed to render it ("static"), so its
+    output depends on more than its contents, such as data sources or the time.
+    """
+    if app_mode == "static":
+        return None
+    digest = hashlib.sha256()
+    options = [CACHE_FORMAT, app_mode, basename(os_path), environment, hide_all_input, hide_tagged_input]
+    digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+
+    base_dir = dirname(os_path)
+    rel_paths = set(extra_files or [])
+    # create_voila_manifest bundles the notebook directory's voila.json too
+    if app_mode == "jupyter-voila" and isfile(join(base_dir, "voila.json")):
+        rel_paths.add("voila.json")
+    try:
+        for rel_path in [basename(os_path)] + sorted(rel_paths):
+            digest.update(b"\0" + rel_path.encode("utf-8") + b"\0")
+            with open(join(base_dir, rel_path), "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def build_bundle(
+    app_mode: str,
+    os_path: str,
+    python: str,
+    environment: Optional[dict],
+    extra_files: List[str],
+    hide_all_input: bool,
+    hide_tagged_input: bool,
+    spool_dir: str,
+    timeout: float = 0,
+    spool_threshold: int = DEFAULT_SPOOL_THRESHOLD,
+    timings: Optional[dict] = None,
+) -> str:
+    """
+    Creates the bundle for a notebook and writes it to a file in `spool_dir`.
+    Neither the rendered notebook nor the bundle is held in memory as a whole.
+
+    This runs either in a bundle worker process or on a thread of the
+    extension's executor, so it only takes and returns picklable values.
+
+    :param app_mode: one of "static", "jupyter-static" or "jupyter-voila".
+    :param os_path: the absolute path to the notebook.
+    :param python: the interpreter used to render static notebooks.
+    :param environment: the inspected environment, as a dictionary.
+    :param extra_files: extra files to include, relative to the notebook.
+    :param hide_all_input: whether to hide all input cells.
+    :param hide_tagged_input: whether to hide input cells tagged `hide_input`.
+    :param spool_dir: the directory the bundle file is written to.
+    :param timeout: seconds before the build is abandoned, 0 for no limit.
+    Only enforced in worker processes on platforms with SIGALRM.
+    :param spool_threshold: bytes of rendered HTML held in memory before it
+    spills to `spool_dir`.
+    :param timings: if given, `worker_seconds`, the time taken, and for static
+    notebooks `render_seconds` and `rendered_bytes` are set on it.
+    :return: the path of the bundle file. The caller is responsible for removing it.
+    """
+    use_alarm = timeout and hasattr(signal, "SIGALRM") and threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    started = time.monotonic()
+    fd, path = tempfile.mkstemp(prefix="rsc_bundle", suffix=".tar.gz", dir=spool_dir)
+    try:
+        with os.fdopen(fd, "wb") as spooled:
+            if app_mode == "static":
+                write_html_bundle(
+                    spooled, os_path, python, hide_all_input, hide_tagged_input, spool_dir, spool_threshold, timings
+                )
+            elif app_mode == "jupyter-static":
+                write_source_bundle(
+                    spooled, os_path, Environment(**environment), extra_files, hide_all_input, hide_tagged_input
+                )
+            elif app_mode == "jupyter-voila":
+                write_voila_bundle(spooled, os_path, Environment(**environment), extra_files)
+            else:
+                raise BundleBuildError("Invalid app_mode: %s" % app_mode)
+        if timings is not None:
+            timings["worker_seconds"] = round(time.monotonic() - started, 3)
+        return path
+    except _BuildTimeout:
+        os.unlink(path)
+        raise BundleBuildError("Bundle creation took longer than %s seconds" % timeout)
+    except BaseException:
+        os.unlink(path)
+        raise
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+
+def _build_bundle_timed(*args, **kwargs) -> Tuple[str, dict]:
+    # timings can't be filled in across processes, so they are returned
+    timings = {}
+    path = build_bundle(*args, timings=timings, **kwargs)
+    return path, timings
+
+
+class BundleCache(object):
+    """
+    An on-disk cache of built bundles, keyed by `bundle_key`, so republishing
+    unchanged content doesn't rebuild it. Bundles are evicted least recently
+    used first once their total size exceeds `max_size`, except those still
+    being uploaded.
+
+    The cache also remembers which bundle was last uploaded to each app so an
+    unchanged republish can skip the upload too.
+    """
+
+    SUFFIX = ".tar.gz"
+
+    def __init__(self, directory: str, max_size: int):
+        """
+        :param directory: where cached bundles are kept. Created if missing.
+        :param max_size: the size budget in bytes.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._refs: Dict[str, int] = {}
+        self._uploads: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        existing = []
+        for entry in os.scandir(directory):
+            key = entry.name[: -len(self.SUFFIX)]
+            if entry.name.endswith(self.SUFFIX) and len(key) == 64:
+                stat = entry.stat()
+                existing.append((stat.st_mtime, key, stat.st_size))
+        for _, key, size in sorted(existing):
+            self._entries[key] = size
+        with self._lock:
+            self._evict()
+
+    def path(self, key: str) -> str:
+        return join(self.directory, key + self.SUFFIX)
+
+    def key_for(self, path: str) -> Optional[str]:
+        if dirname(path) != self.directory or not path.endswith(self.SUFFIX):
+            return None
+        return basename(path)[: -len(self.SUFFIX)]
+
+    def acquire(self, key: str) -> Optional[str]:
+        """
+        Looks up a bundle and marks it in use until `release` is called.
+
+        :return: the path of the cached bundle, or None.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._refs[key] = self._refs.get(key, 0) + 1
+            self._hits += 1
+        path = self.path(key)
+        # keeps the LRU order across restarts
+        os.utime(path)
+        return path
+
+    def add(self, key: str, path: str) -> str:
+        """
+        Moves a newly built bundle into the cache, marked in use.
+
+        :param path: the bundle file, which must be in the cache directory.
+        :return: the path of the cached bundle.
+        """
+        size = os.path.getsize(path)
+        with self._lock:
+            if key in self._entries:
+                # built concurrently by another deployment
+                os.unlink(path)
+            else:
+                os.replace(path, self.path(key))
+                self._entries[key] = size
+            self._entries.move_to_end(key)
+            self._refs[key] = self._refs.get(key, 0) + 1
+            self._evict()
+        return self.path(key)
+
+    def release(self, path: str) -> bool:
+        """
+        Marks a bundle returned by `acquire` or `add` as no longer in use.
+
+        :return: False if the path is not a cached bundle.
+        """
+        key = self.key_for(path)
+        with self._lock:
+            if key not in self._refs:
+                return False
+            self._refs[key] -= 1
+            if self._refs[key] == 0:
+                del self._refs[key]
+            self._evict()
+        return True
+
+    def _evict(self):
+        """
+        Removes bundles not in use, oldest first, until the cache fits in
+        `max_size`. Must be called with the lock held.
+        """
+        total = sum(self._entries.values())
+        for key in list(self._entries):
+            if total <= self.max_size:
+                break
+            if key in self._refs:
+                continue
+            try:
+                os.unlink(self.path(key))
+            except FileNotFoundError:
+                pass
+            total -= self._entries.pop(key)
+            self._evictions += 1
+
+    def remember_upload(self, server: str, app_id, path: str, bundle_id):
+        key = self.key_for(path)
+        if key is not None and bundle_id is not None:
+            with self._lock:
+                self._uploads[(server, str(app_id))] = (key, bundle_id)
+
+    def uploaded_bundle(self, server: str, app_id, path: str):
+        """
+        :return: the ID of the bundle with the same contents as `path` that was
+        last uploaded to the app, or None.
+        """
+        with self._lock:
+            key, bundle_id = self._uploads.get((server, str(app_id)), (None, None))
+        if key is None or key != self.key_for(path):
+            return None
+        return bundle_id
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "size": sum(self._entries.values()),
+                "bundles": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+
+class BundleBuilder(object):
+    """
+    Builds bundles in a pool of worker processes so nbconvert rendering and
+    tar/gzip compression don't hold the notebook server's GIL or inflate its
+    memory. Workers are started with the bundling modules already imported.
+
+    With `max_workers` set to 0, bundles are built in-process on the
+    extension's thread executor instead.
+    """
+
+    def __init__(
+        self,
+        executor,
+        max_workers: int,
+        memory_limit: int = 0,
+        timeout: float = 0,
+        spool_dir: str = None,
+        spool_threshold: int = DEFAULT_SPOOL_THRESHOLD,
+        cache: Optional[BundleCache] = None,
+    ):
+        """
+        :param executor: the BoundedExecutor used when there are no workers.
+        :param max_workers: the number of worker processes.
+        :param memory_limit: the address space limit of a worker in bytes, 0 for none.
+        :param timeout: seconds a single build may take, 0 for no limit.
+        :param spool_dir: where bundle files are written; the system temp dir by default.
+        :param spool_threshold: bytes of rendered output held in memory before spilling to `spool_dir`.
+        :param cache: where built bundles are kept for reuse, if anywhere.
+        """
+        self.executor = executor
+        self.max_workers = max_workers
+        self.memory_limit = memory_limit
+        self.timeout = timeout
+        self.spool_dir = spool_dir or tempfile.gettempdir()
+        self.spool_threshold = spool_threshold
+        self.cache = cache
+        self._pool = None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._recycled = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm_worker,
+                    initargs=(self.memory_limit,),
+                )
+            return self._pool
+
+    def _recycle_pool(self, pool: ProcessPoolExecutor):
+        """
+        Tears down a pool with a stuck or crashed worker. Builds still running
+        in it fail and the next build starts a fresh pool.
+        """
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+                self._recycled += 1
+        # noinspection PyProtectedMember
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False)
+
+    def start(self):
+        """
+        Starts the worker processes in the background so the first publish
+        doesn't wait for them.
+        """
+        if self.max_workers > 0:
+            pool = self._get_pool()
+            for _ in range(self.max_workers):
+                pool.submit(_ping)
+
+    async def build(
+        self,
+        app_mode: str,
+        os_path: str,
+        python: str,
+        environment: Optional[dict],
+        extra_files: List[str],
+        hide_all_input: bool = False,
+        hide_tagged_input: bool = False,
+        timings: Optional[dict] = None,
+    ) -> str:
+        """
+        Builds a bundle without blocking the event loop, or reuses a cached
+        bundle built from the same inputs.
+
+        :param timings: if given, where the build is broken down: whether the
+        bundle was `cached`, its `bytes` and the seconds spent on each step.
+        :return: the path of the bundle file, which the caller must pass to
+        `release` once it has been uploaded.
+        :raises BundleBuildError: if the build times out or a worker dies.
+        """
+        timings = {} if timings is None else timings
+        options = (app_mode, os_path, python, environment, extra_files, hide_all_input, hide_tagged_input)
+        key = None
+        if self.cache is not None:
+            started = time.monotonic()
+            key = await self._run(bundle_key, *options)
+            timings["key_seconds"] = round(time.monotonic() - started, 3)
+            path = self.cache.acquire(key) if key is not None else None
+            if path is not None:
+                timings["cached"] = True
+                timings["bytes"] = os.path.getsize(path)
+                return path
+
+        # cached bundles are built in the cache directory so adding them is a rename
+        spool_dir = self.cache.directory if key is not None else self.spool_dir
+        started = time.monotonic()
+        path, build_timings = await self._run(
+            _build_bundle_timed, *options, spool_dir, timeout=self.timeout, spool_threshold=self.spool_threshold
+        )
+        elapsed = time.monotonic() - started
+        timings.update(build_timings, cached=False, bytes=os.path.getsize(path))
+        # time spent waiting for a worker and passing results between processes
+        timings["queue_seconds"] = round(max(elapsed - build_timings["worker_seconds"], 0), 3)
+        BUNDLE_BUILD_DURATION.labels(app_mode).observe(elapsed)
+        BUNDLE_SIZE.labels(app_mode).observe(timings["bytes"])
+        if key is not None:
+            path = self.cache.add(key, path)
+        return path
+
+    def release(self, path: str):
+        """
+        Disposes of a bundle returned by `build`.
+        """
+        if self.cache is None or not self.cache.release(path):
+            os.unlink(path)
+
+    async def _run(self, fn, *args, **kwargs):
+        if self.max_workers <= 0:
+            kwargs.pop("timeout", None)
+            return await self.executor.run(fn, *args, **kwargs)
+
+        pool = self._get_pool()
+        self._active += 1
+        try:
+            future = asyncio.wrap_future(pool.submit(fn, *args, **kwargs))
+            hard_timeout = self.timeout + _HARD_TIMEOUT_GRACE if self.timeout else None
+            return await asyncio.wait_for(future, hard_timeout)
+        except asyncio.TimeoutError:
+            self._recycle_pool(pool)
+            raise BundleBuildError("Bundle creation took longer than %s seconds" % self.timeout)
+        except BrokenProcessPool:
+            self._recycle_pool(pool)
+            raise BundleBuildError("The bundle worker process exited unexpectedly (out of memory?)")
+        finally:
+            self._active -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "active": self._active,
+            "recycled": self._recycled,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
@@ -0,0 +1,457 @@
+import hashlib
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.client import BadStatusLine
+from ssl import SSLError
+from typing import Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from rsconnect.api import RSConnect, RSConnectException, RSConnectServer
+from rsconnect.http_support import CookieJar, HTTPResponse
+from rsconnect.models import AppModes
+
+from rsconnect_jupyter.metrics import CONNECT_ERRORS, UPLOAD_BYTES, UPLOAD_THROUGHPUT
+from rsconnect_jupyter.recording import TrafficRecorder, body_size
+
+# Errors that mean a kept-alive connection was closed by the server (or a
+# proxy) while it sat idle in the pool. Requests failing this way are retried
+# once on a fresh connection if they are idempotent.
+_STALE_CONNECTION_ERRORS = (ConnectionError, BadStatusLine)
+
+# Methods that are safe to send twice. Connect may have acted on a POST before
+# the connection dropped, and retrying it could create a second app, bundle
+# or deployment task.
+_IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+# Bytes read from a bundle file per write to the socket during an upload.
+UPLOAD_BLOCK_SIZE = 64 * 1024
+
+
+def _digest(value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return None
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def _connection_dropped(conn) -> bool:
+    """
+    :return: whether the server has closed a kept-alive connection. With no
+    request outstanding, the socket is only readable at EOF.
+    """
+    sock = getattr(conn, "sock", None)
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+def client_key(url: str, api_key: str, disable_tls_check: bool, cadata: Optional[str]) -> tuple:
+    """
+    The pool key for a set of server credentials. Secrets are hashed so the key
+    can be logged or reported without leaking them.
+    """
+    return url, _digest(api_key), bool(disable_tls_check), _digest(cadata)
+
+
+class PooledClient(RSConnect):
+    """
+    An RSConnect client whose connection is opened once and kept alive across
+    requests, rather than for the duration of a `with` block.
+    """
+
+    def __init__(self, server: RSConnectServer, recorder: Optional[TrafficRecorder] = None):
+        """
+        :param server: the server to connect to.
+        :param recorder: where to record requests, if anywhere.
+        """
+        super(PooledClient, self).__init__(server)
+        self.server = server
+        self.recorder = recorder
+        self.last_used = time.monotonic()
+        self.requests = 0
+        self._uploaded_bundle_id = None
+        self._last_response = None
+        self._recording = False
+        self.__enter__()
+
+    def use_cookies(self, cookie_jar: CookieJar):
+        """
+        Replaces the cookies sent with each request, e.g. with the session
+        cookies returned by an earlier deploy so polling reaches the same node.
+        """
+        self.server.cookie_jar = cookie_jar
+        self._cookies = cookie_jar
+        self._inject_cookies()
+
+    def cookies(self) -> dict:
+        return self._cookies.as_dict()
+
+    def handle_bad_response(self, response):
+        self.server.handle_bad_response(response)
+        return response
+
+    def app_upload(self, app_id, tarball):
+        """
+        Uploads a bundle by streaming it from the file in UPLOAD_BLOCK_SIZE
+        chunks, so memory use doesn't grow with the bundle.
+        """
+        headers = {}
+        if hasattr(tarball, "fileno"):
+            # Without a length, http.client falls back to a chunked upload,
+            # which not every proxy in front of Connect accepts.
+            size = os.fstat(tarball.fileno()).st_size - tarball.tell()
+            headers["Content-Length"] = str(size)
+        else:
+            size = len(tarball)
+        self._conn.blocksize = UPLOAD_BLOCK_SIZE
+        started = time.perf_counter()
+        response = self.request("POST", "applications/%s/upload" % app_id, body=tarball, headers=headers)
+        if isinstance(response, dict):
+            elapsed = time.perf_counter() - started
+            UPLOAD_BYTES.inc(size)
+            if elapsed > 0:
+                UPLOAD_THROUGHPUT.observe(size / elapsed)
+            self._uploaded_bundle_id = response["id"]
+        return response
+
+    def deploy(self, app_id, app_name, app_title, title_is_default, tarball, env_vars=None):
+        """
+        Uploads and deploys a bundle as `RSConnect.deploy` does, and also
+        returns the ID of the uploaded bundle as `bundle_id`.
+        """
+        self._uploaded_bundle_id = None
+        result = super(PooledClient, self).deploy(app_id, app_name, app_title, title_is_default, tarball, env_vars)
+        result["bundle_id"] = self._uploaded_bundle_id
+        return result
+
+    def redeploy(self, app_id, bundle_id, app_title, title_is_default) -> Optional[dict]:
+        """
+        Deploys a bundle that was already uploaded, if it is still the app's
+        current bundle.
+
+        :return: the same result as `deploy`, or None if the app has moved on
+        to another bundle.
+        """
+        app = self.handle_bad_response(self.app_get(app_id))
+        if app.get("bundle_id") != bundle_id:
+            return None
+        if app["title"] != app_title and not title_is_default:
+            self.handle_bad_response(self.app_update(app_id, {"title": app_title}))
+            app["title"] = app_title
+        task = self.handle_bad_response(self.app_deploy(app_id, bundle_id))
+        return {
+            "task_id": task["id"],
+            "app_id": app_id,
+            "app_guid": app["guid"],
+            "app_url": app["url"],
+            "title": app["title"],
+            "bundle_id": bundle_id,
+        }
+
+    def _tweak_response(self, response):
+        # the response as received, for the recorder
+        self._last_response = response
+        return super(PooledClient, self)._tweak_response(response)
+
+    def _do_request(
+        self, method, path, query_params, body, maximum_redirects, extra_headers=None, decode_response=True
+    ):
+        if self.recorder is None or self._recording:
+            # redirects come back through here, and are recorded as part of the first request
+            return self._do_pooled_request(
+                method, path, query_params, body, maximum_redirects, extra_headers, decode_response
+            )
+        self._recording = True
+        self._last_response = None
+        request_headers = dict(self._headers, **(extra_headers or {}))
+        request_bytes = body_size(body)
+        started = time.monotonic()
+        try:
+            response = self._do_pooled_request(
+                method, path, query_params, body, maximum_redirects, extra_headers, decode_response
+            )
+        finally:
+            self._recording = False
+        recorded = response if isinstance(response, HTTPResponse) else self._last_response
+        if recorded is not None:
+            self.recorder.record(self.server.url, method, request_headers, body, request_bytes, started, recorded)
+        return response
+
+    def _do_pooled_request(
+        self, method, path, query_params, body, maximum_redirects, extra_headers=None, decode_response=True
+    ):
+        idempotent = method.upper() in _IDEMPOTENT_METHODS
+        if not idempotent and _connection_dropped(self._conn):
+            # reconnect up front, as the request won't be retried
+            self._conn.close()
+        response = super(PooledClient, self)._do_request(
+            method, path, query_params, body, maximum_redirects, extra_headers, decode_response
+        )
+        if (
+            idempotent
+            and self.requests > 0
+            and isinstance(response, HTTPResponse)
+            and isinstance(response.exception, _STALE_CONNECTION_ERRORS)
+        ):
+            # http.client reconnects on the next request once the old socket is closed.
+            self._conn.close()
+            response = super(PooledClient, self)._do_request(
+                method, path, query_params, body, maximum_redirects, extra_headers, decode_response
+            )
+        self.requests += 1
+        if isinstance(response, HTTPResponse):
+            if response.exception is not None:
+                CONNECT_ERRORS.labels("connection").inc()
+            elif response.status >= 400:
+                CONNECT_ERRORS.labels(response.status).inc()
+        return response
+
+    def close(self):
+        self.__exit__()
+
+
+class ClientPool(object):
+    """
+    A process-wide cache of kept-alive PooledClients, keyed by server URL and
+    hashes of the credentials used with it.
+
+    Idle clients are closed after `idle_timeout` seconds; beyond `max_size`
+    idle clients, the least recently used are closed first. A client is only
+    ever used by one caller at a time.
+    """
+
+    def __init__(self, max_size: int = 16, idle_timeout: float = 60, recorder: Optional[TrafficRecorder] = None):
+        """
+        :param max_size: the maximum number of idle clients kept open.
+        :param idle_timeout: seconds an idle client is kept open.
+        :param recorder: where clients record their requests, if anywhere.
+        It is closed with the pool.
+        """
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.recorder = recorder
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @contextmanager
+    def client(
+        self,
+        url: str,
+        api_key: str,
+        disable_tls_check: bool = False,
+        cadata: Optional[str] = None,
+        cookies: Optional[dict] = None,
+    ) -> Iterator[PooledClient]:
+        """
+        Checks out a client for the given server, creating one if none is idle,
+        and returns it to the pool afterwards. Clients that raised are closed
+        rather than reused.
+
+        :param cookies: cookies to send, as returned by `PooledClient.cookies`.
+        """
+        key = client_key(url, api_key, disable_tls_check, cadata)
+        client = self._checkout(key)
+        if client is None:
+            client = PooledClient(RSConnectServer(url, api_key, disable_tls_check, cadata), self.recorder)
+        if cookies:
+            client.use_cookies(CookieJar.from_dict(cookies))
+        try:
+            yield client
+        except BaseException:
+            client.close()
+            raise
+        self._checkin(key, client)
+
+    def _checkout(self, key) -> Optional[PooledClient]:
+        with self._lock:
+            self._prune()
+            clients = self._idle.get(key)
+            if not clients:
+                self._misses += 1
+                return None
+            client = clients.pop()
+            if not clients:
+                del self._idle[key]
+            self._hits += 1
+            return client
+
+    def _checkin(self, key, client: PooledClient):
+        # cookies belong to the checkout, e.g. a deployment's session, not to later requests
+        client.use_cookies(CookieJar())
+        client.last_used = time.monotonic()
+        with self._lock:
+            self._idle.setdefault(key, []).append(client)
+            self._idle.move_to_end(key)
+            self._prune()
+
+    def _prune(self):
+        """
+        Closes expired clients, then the least recently used ones while over
+        `max_size`. Must be called with the lock held.
+        """
+        expiry = time.monotonic() - self.idle_timeout
+        for key in list(self._idle):
+            clients = self._idle[key]
+            while clients and clients[0].last_used < expiry:
+                clients.pop(0).close()
+                self._evictions += 1
+            if not clients:
+                del self._idle[key]
+
+        size = sum(len(clients) for clients in self._idle.values())
+        while size > self.max_size:
+            key, clients = next(iter(self._idle.items()))
+            clients.pop(0).close()
+            self._evictions += 1
+            size -= 1
+            if not clients:
+                del self._idle[key]
+
+    def prune(self):
+        with self._lock:
+            self._prune()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "idle": sum(len(clients) for clients in self._idle.values()),
+                "servers": len(self._idle),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            for clients in self._idle.values():
+                for client in clients:
+                    client.close()
+            self._idle.clear()
+        if self.recorder is not None:
+            self.recorder.close()
+
+
+def server_check_list(url: str) -> List[str]:
+    """
+    The URLs to try for a server address, adding https and http schemes when
+    the address has none.
+    """
+    if "//" not in url:
+        items = ["https://%s", "http://%s"]
+    elif url.startswith("//"):
+        items = ["https:%s", "http:%s"]
+    else:
+        items = ["%s"]
+    return [item % url for item in items]
+
+
+class ApiKeyError(RSConnectException):
+    pass
+
+
+def verify_server(
+    pool: ClientPool, url: str, api_key: str, disable_tls_check: bool, cadata: Optional[str]
+) -> Tuple[str, str]:
+    """
+    Finds the URL at which Posit Connect answers for the given server address
+    and checks the API key against it, over the same connection.
+
+    :return: the canonical URL and the name of the user the key belongs to.
+    :raises SSLError: if the server could only be reached with TLS errors.
+    :raises ApiKeyError: if the server was found but the key was not accepted.
+    :raises RSConnectException: if no variant of the address reaches Connect.
+    """
+    failures = []
+    for candidate in server_check_list(url):
+        if not urlparse(candidate).netloc:
+            failures.append('    %s - failed to verify as Posit Connect (Invalid server URL: "%s").' % (candidate, url))
+            continue
+        try:
+            with pool.client(candidate, api_key, disable_tls_check, cadata) as client:
+                result = client.server_settings()
+                if isinstance(result, HTTPResponse) and isinstance(result.exception, SSLError):
+                    raise result.exception
+                client.handle_bad_response(result)
+                return candidate, verify_api_key(client)
+        except ApiKeyError:
+            raise
+        except RSConnectException as exc:
+            failures.append("    %s - failed to verify as Posit Connect (%s)." % (candidate, str(exc)))
+
+    # In case the user may need https instead of http...
+    if len(failures) == 1 and url.startswith("http://"):
+        failures.append('    Do you need to use "https://%s"?' % url[7:])
+    raise RSConnectException("\n".join(failures))
+
+
+def verify_api_key(client: PooledClient) -> str:
+    """
+    Checks that the client's API key is valid.
+
+    :return: the name of the user the key belongs to.
+    :raises ApiKeyError: if it isn't.
+    """
+    result = client.me()
+    if isinstance(result, HTTPResponse):
+        if result.json_data and "code" in result.json_data and result.json_data["code"] == 30:
+            raise ApiKeyError("The specified API key is not valid.")
+        raise ApiKeyError("Could not verify the API key: %s %s" % (result.status, result.reason))
+    return result["username"]
+
+
+class VerificationCache(object):
+    """
+    Remembers successful server verifications for `ttl` seconds, keyed like
+    the client pool, so validating the same server and key again is instant.
+    """
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str, api_key: str, disable_tls_check: bool, cadata: Optional[str]) -> Optional[dict]:
+        key = client_key(url, api_key, disable_tls_check, cadata)
+        with self._lock:
+            expires, result = self._entries.get(key, (0, None))
+            if expires <= time.monotonic():
+                self._entries.pop(key, None)
+                return None
+            return result
+
+    def put(self, url: str, api_key: str, disable_tls_check: bool, cadata: Optional[str], result: dict):
+        if self.ttl <= 0:
+            return
+        key = client_key(url, api_key, disable_tls_check, cadata)
+        now = time.monotonic()
+        with self._lock:
+            for stale in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                del self._entries[stale]
+            self._entries[key] = (now + self.ttl, result)
+
+
+def _abbreviate_app(app: dict, config: dict) -> dict:
+    return {
+        "id": app["id"],
+        "name": app["name"],
+        "title": app["title"],
+        "app_mode": AppModes.get_by_ordinal(app["app_mode"]).name(),
+        "url": app["url"],
+        "config_url": config["config_url"],
+    }
+
+
+def _is_notebook_app(app: dict) -> bool:
+    # apps that were created but never deployed have no mode yet
+    return AppModes.get_by_ordinal(app["app_mode"], True) in (AppModes.STATIC, AppModes.JUPYTER_NOTEBOOK)
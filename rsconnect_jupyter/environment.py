@@ -0,0 +1,261 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from collections import OrderedDict
+from os.path import basename, dirname, isabs, join
+from typing import Dict, List, Optional
+
+from jupyter_client.kernelspec import KernelSpec, NoSuchKernel
+
+# Files in the notebook directory that `rsconnect.environment` reads instead
+# of asking the package manager.
+ENVIRONMENT_FILES = ["requirements.txt", "environment.yml"]
+
+
+# The fields of `rsconnect.environment.Environment`, each a string or null.
+ENVIRONMENT_FIELDS = ["conda", "contents", "error", "filename", "locale", "package_manager", "pip", "python", "source"]
+
+
+class EnvironmentInspectionError(Exception):
+    pass
+
+
+def validate_environment(environment) -> dict:
+    """
+    Checks that an environment inspected by the browser, through the kernel,
+    looks like the output of `rsconnect.environment`.
+
+    :return: the environment's known fields.
+    :raises ValueError: if it doesn't.
+    """
+    if not isinstance(environment, dict):
+        raise ValueError("The environment must be an object")
+    for field in ENVIRONMENT_FIELDS:
+        value = environment.get(field)
+        if value is not None and not isinstance(value, str):
+            raise ValueError("The environment's %s must be a string" % field)
+    if environment.get("filename") not in ENVIRONMENT_FILES:
+        raise ValueError("The environment's filename must be one of %s" % ", ".join(ENVIRONMENT_FILES))
+    if environment.get("package_manager") not in ("pip", "conda"):
+        raise ValueError("The environment's package_manager must be pip or conda")
+    if environment.get("contents") is None:
+        raise ValueError("The environment has no contents")
+    return {field: environment.get(field) for field in ENVIRONMENT_FIELDS}
+
+
+def kernel_spec(
+    kernel_manager, kernel_spec_manager, kernel_id: Optional[str], kernel_name: Optional[str]
+) -> Optional[KernelSpec]:
+    """
+    Finds the kernelspec of a notebook's kernel.
+
+    :param kernel_id: the ID of the running kernel, if any.
+    :param kernel_name: the kernelspec name from the notebook's metadata, used
+    when the kernel isn't running.
+    :return: the kernelspec, or None if it can't be found.
+    """
+    if kernel_id:
+        try:
+            return kernel_manager.get_kernel(kernel_id).kernel_spec
+        except (KeyError, NoSuchKernel):
+            pass
+    if kernel_name:
+        try:
+            return kernel_spec_manager.get_kernel_spec(kernel_name)
+        except NoSuchKernel:
+            pass
+    return None
+
+
+def kernel_env(spec: Optional[KernelSpec]) -> Dict[str, str]:
+    """
+    :return: the environment variables the kernelspec sets for the kernel,
+    such as PATH, PYTHONPATH or CONDA_PREFIX, on top of the server's.
+    """
+    if spec is None or not spec.env:
+        return {}
+    return {str(name): str(value) for name, value in spec.env.items()}
+
+
+def kernel_python(spec: Optional[KernelSpec]) -> Optional[str]:
+    """
+    Finds the interpreter a notebook's kernel runs on from its kernelspec, the
+    same way jupyter_client does when it starts the kernel.
+
+    :return: the path of the interpreter, or None if the kernel isn't a local
+    Python kernel.
+    """
+    if spec is None or not spec.argv or (spec.language or "").lower() != "python":
+        return None
+
+    python = spec.argv[0]
+    if python in ("python", "python%i" % sys.version_info[0], "python%i.%i" % sys.version_info[:2]):
+        return sys.executable
+    if not isabs(python):
+        # the kernel is started with its kernelspec's PATH, if it sets one
+        python = shutil.which(python, path=kernel_env(spec).get("PATH"))
+    # e.g. kernels started through `conda run` or a container runtime
+    if not python or not basename(python).lower().startswith("python"):
+        return None
+    return python
+
+
+def inspect_environment(
+    python: str,
+    directory: str,
+    conda_mode: bool,
+    force_generate: bool,
+    timeout: float,
+    env: Optional[Dict[str, str]] = None,
+) -> dict:
+    """
+    Runs `python -m rsconnect.environment` for the notebook's directory.
+
+    :param python: the kernel's interpreter.
+    :param directory: the notebook's directory.
+    :param conda_mode: whether to describe the environment with conda.
+    :param force_generate: whether to ignore an existing requirements.txt.
+    :param timeout: seconds to wait for the inspection, 0 for no limit.
+    :param env: environment variables the kernel sets, as from `kernel_env`,
+    so the packages found are the ones the kernel imports.
+    :return: the inspected environment, as a dictionary.
+    :raises EnvironmentInspectionError: if the inspection fails or times out.
+    """
+    cmd = [python, "-m", "rsconnect.environment"]
+    if conda_mode or force_generate:
+        cmd.append("-" + ("c" if conda_mode else "") + ("f" if force_generate else ""))
+    cmd.append(directory)
+    try:
+        process = subprocess.run(
+            cmd,
+            cwd=directory,
+            env=dict(os.environ, **(env or {})),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=timeout or None,
+        )
+    except subprocess.TimeoutExpired:
+        raise EnvironmentInspectionError("Inspecting the Python environment took longer than %s seconds" % timeout)
+    except OSError as exc:
+        raise EnvironmentInspectionError("Could not run %s: %s" % (python, exc))
+
+    try:
+        environment = json.loads(process.stdout.decode("utf-8"))
+    except ValueError:
+        raise EnvironmentInspectionError(process.stderr.decode("utf-8", "replace").strip() or "no output")
+    if environment.get("error"):
+        raise EnvironmentInspectionError(environment["error"])
+    return environment
+
+
+def _site_dirs(python: str, env: Optional[Dict[str, str]] = None) -> List[str]:
+    """
+    The directories packages for an interpreter are installed in, found from
+    the interpreter's location and the kernel's PYTHONPATH rather than by
+    running it. A package install, upgrade or removal adds or removes an entry
+    in one of them.
+    """
+    prefix = dirname(dirname(python))
+    patterns = [
+        join(prefix, "lib", "python*", "site-packages"),
+        join(prefix, "lib64", "python*", "site-packages"),
+        join(prefix, "Lib", "site-packages"),
+        join(dirname(python), "Lib", "site-packages"),
+        join(os.path.expanduser("~"), ".local", "lib", "python*", "site-packages"),
+        join(prefix, "conda-meta"),
+    ]
+    patterns.extend(glob.escape(path) for path in (env or {}).get("PYTHONPATH", "").split(os.pathsep) if path)
+    return sorted({path for pattern in patterns for path in glob.glob(pattern) if os.path.isdir(path)})
+
+
+def _stat(path: str) -> Optional[list]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _file_digest(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def environment_fingerprint(
+    python: str, directory: str, conda_mode: bool = False, env: Optional[Dict[str, str]] = None
+) -> str:
+    """
+    A hash of everything the result of `python -m rsconnect.environment` run
+    in `directory` depends on: the interpreter, the environment variables the
+    kernel sets, its installed packages and any requirements.txt or
+    environment.yml.
+
+    :param python: the path of the interpreter.
+    :param directory: the directory the inspection runs in.
+    :param conda_mode: whether the inspection runs with `-c`.
+    :param env: environment variables the kernel sets, as from `kernel_env`.
+    :return: the hex digest.
+    """
+    fingerprint = {
+        "python": python,
+        "interpreter": _stat(python),
+        "conda_mode": bool(conda_mode),
+        "env": env or {},
+        "site_dirs": {path: _stat(path) for path in _site_dirs(python, env)},
+        "files": {name: _file_digest(join(directory, name)) for name in ENVIRONMENT_FILES},
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class EnvironmentCache(object):
+    """
+    Inspected environments, keyed by `environment_fingerprint`, so publishing
+    again doesn't rerun `pip freeze` when nothing it depends on has changed.
+    Beyond `max_size` entries the least recently used are dropped.
+    """
+
+    def __init__(self, max_size: int = 64):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, fingerprint: str) -> Optional[dict]:
+        with self._lock:
+            environment = self._entries.get(fingerprint)
+            if environment is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(fingerprint)
+            self._hits += 1
+            return environment
+
+    def put(self, fingerprint: str, environment: dict):
+        """
+        Stores a successful inspection. Results with an error are not cached.
+        """
+        if environment.get("error"):
+            return
+        with self._lock:
+            self._entries[fingerprint] = environment
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+            }
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class ExecutorBusy(Exception):
+    """
+    Raised when a call is submitted to a BoundedExecutor that already has its
+    maximum number of running and queued calls.
+    """
+
+
+class BoundedExecutor(object):
+    """
+    A thread pool for blocking calls (Connect API requests, bundle builds) that
+    must not run on the Tornado IOLoop.
+
+    Unlike a bare ThreadPoolExecutor, the queue in front of the workers is
+    bounded: once `max_workers + max_pending` calls are outstanding, further
+    submissions are rejected with ExecutorBusy rather than piling up behind a
+    slow Connect server.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, thread_name_prefix: str = "rsconnect_jupyter"):
+        """
+        :param max_workers: the number of worker threads.
+        :param max_pending: the number of calls that may wait for a free worker.
+        :param thread_name_prefix: prefix for the worker thread names.
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Schedules `fn(*args, **kwargs)` on a worker thread.
+
+        :param fn: the blocking callable to run.
+        :return: a concurrent.futures.Future for the result.
+        :raises ExecutorBusy: if the executor is saturated.
+        """
+        with self._lock:
+            if self._active + self._pending >= self.max_workers + self.max_pending:
+                self._rejected += 1
+                raise ExecutorBusy(
+                    "%d calls are already running or queued (limit %d)"
+                    % (self._active + self._pending, self.max_workers + self.max_pending)
+                )
+            self._pending += 1
+
+        def invoke():
+            with self._lock:
+                self._pending -= 1
+                self._active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+
+        try:
+            return self._executor.submit(invoke)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Runs `fn(*args, **kwargs)` on a worker thread and awaits its result
+        without blocking the event loop.
+        """
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Reports how busy the executor is.
+
+        :return: a dictionary of worker/queue limits and current counts.
+        """
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "active": self._active,
+                "pending": self._pending,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
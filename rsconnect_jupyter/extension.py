@@ -0,0 +1,303 @@
+import os
+import threading
+from typing import TYPE_CHECKING, Callable, Dict
+
+from jupyter_core.paths import jupyter_runtime_dir
+from tornado.ioloop import PeriodicCallback
+from traitlets import Bool, Float, Integer, Unicode
+from traitlets.config import LoggingConfigurable
+
+from rsconnect_jupyter.environment import EnvironmentCache
+from rsconnect_jupyter.executor import BoundedExecutor
+from rsconnect_jupyter.jobs import JobManager
+from rsconnect_jupyter.watchdog import LoopWatchdog
+
+if TYPE_CHECKING:
+    from rsconnect_jupyter.bundles import BundleBuilder
+    from rsconnect_jupyter.clients import ClientPool, VerificationCache
+    from rsconnect_jupyter.search import AppSearchCache
+
+
+class RSConnectJupyter(LoggingConfigurable):
+    """
+    Server-side state for the rsconnect_jupyter extension.
+
+    One instance is created by `load_jupyter_server_extension` and stored in
+    the Tornado application settings, where `EndpointHandler` picks it up.
+    Options may be set in `jupyter_notebook_config.py`, e.g.
+
+        c.RSConnectJupyter.max_workers = 8
+
+    The components that talk to Posit Connect and build bundles import
+    rsconnect-python, which is slow to import, so they are created on first
+    use (or by `start` in the background) to keep it out of server startup.
+    """
+
+    max_workers = Integer(
+        4,
+        config=True,
+        help="Number of threads used for blocking calls to Posit Connect and bundle creation.",
+    )
+
+    max_pending = Integer(
+        16,
+        config=True,
+        help="Number of blocking calls that may queue for a free thread before requests are rejected.",
+    )
+
+    bundle_workers = Integer(
+        2,
+        config=True,
+        help="Number of worker processes that build bundles. 0 builds bundles in the notebook server process.",
+    )
+
+    bundle_prewarm = Bool(
+        True,
+        config=True,
+        help="Start the bundle worker processes when the extension loads rather than on first publish.",
+    )
+
+    preload = Bool(
+        True,
+        config=True,
+        help="Import the publishing code in the background once the server has started rather than on first use.",
+    )
+
+    bundle_memory_limit = Integer(
+        0,
+        config=True,
+        help="Address space limit, in bytes, of each bundle worker process. 0 disables the limit.",
+    )
+
+    bundle_timeout = Float(
+        1800,
+        config=True,
+        help="Seconds a single bundle build may take before it is abandoned. 0 disables the limit.",
+    )
+
+    bundle_spool_dir = Unicode(
+        "",
+        config=True,
+        help="Directory where built bundles are written before upload. Defaults to the system temp directory.",
+    )
+
+    bundle_spool_threshold = Integer(
+        8 * 1024 * 1024,
+        config=True,
+        help="Bytes of rendered notebook output held in memory during a build before it spills to bundle_spool_dir.",
+    )
+
+    bundle_cache_size = Integer(
+        256 * 1024 * 1024,
+        config=True,
+        help="Bytes of built bundles kept for reuse when unchanged content is republished. 0 disables the cache.",
+    )
+
+    bundle_cache_dir = Unicode(
+        "",
+        config=True,
+        help="Directory where built bundles are kept for reuse. Defaults to a directory in the Jupyter runtime dir.",
+    )
+
+    environment_cache_size = Integer(
+        64,
+        config=True,
+        help="Number of inspected Python environments remembered between publishes. 0 disables the cache.",
+    )
+
+    environment_timeout = Float(
+        300,
+        config=True,
+        help="Seconds inspecting a notebook's Python environment may take. 0 disables the limit.",
+    )
+
+    client_pool_size = Integer(
+        16,
+        config=True,
+        help="Maximum number of idle kept-alive connections to Posit Connect servers.",
+    )
+
+    client_idle_timeout = Float(
+        30,
+        config=True,
+        help="Seconds an idle connection to a Posit Connect server is kept open.",
+    )
+
+    verify_cache_ttl = Float(
+        300,
+        config=True,
+        help="Seconds a successful server and API key verification is remembered. 0 disables the cache.",
+    )
+
+    app_search_ttl = Float(
+        60,
+        config=True,
+        help="Seconds a user's list of content on a server is reused for searches before it is refreshed.",
+    )
+
+    job_retention = Float(
+        3600,
+        config=True,
+        help="Seconds the outcome of a finished deployment is kept for the browser to collect.",
+    )
+
+    loop_watchdog = Bool(
+        False,
+        config=True,
+        help="Log the action and stack of calls that block the notebook server's IOLoop for over loop_lag_threshold.",
+    )
+
+    loop_lag_interval = Float(
+        0.1,
+        config=True,
+        help="Seconds between the loop watchdog's measurements of IOLoop lag.",
+    )
+
+    loop_lag_threshold = Float(
+        0.5,
+        config=True,
+        help="Seconds the IOLoop may be blocked before the loop watchdog reports it.",
+    )
+
+    record_connect_traffic = Unicode(
+        "",
+        config=True,
+        help="File to append requests to Posit Connect to, with secrets redacted, for mock_connect.py --replay.",
+    )
+
+    def __init__(self, **kwargs):
+        super(RSConnectJupyter, self).__init__(**kwargs)
+        self.executor = BoundedExecutor(self.max_workers, self.max_pending)
+        self.environments = EnvironmentCache(self.environment_cache_size)
+        self.jobs = JobManager(self.job_retention)
+        self._components: Dict[str, object] = {}
+        self._components_lock = threading.Lock()
+        self._pruner = None
+        self.watchdog = None
+        if self.loop_watchdog:
+            self.watchdog = LoopWatchdog(self.loop_lag_interval, self.loop_lag_threshold, self.log)
+
+    def _component(self, name: str, create: Callable[[], object]):
+        with self._components_lock:
+            if name not in self._components:
+                self._components[name] = create()
+            return self._components[name]
+
+    def _create_bundle_builder(self) -> "BundleBuilder":
+        from rsconnect_jupyter.bundles import BundleBuilder, BundleCache
+
+        bundle_cache = None
+        if self.bundle_cache_size > 0:
+            bundle_cache = BundleCache(
+                self.bundle_cache_dir or os.path.join(jupyter_runtime_dir(), "rsconnect_jupyter_bundles"),
+                self.bundle_cache_size,
+            )
+        return BundleBuilder(
+            self.executor,
+            self.bundle_workers,
+            memory_limit=self.bundle_memory_limit,
+            timeout=self.bundle_timeout,
+            spool_dir=self.bundle_spool_dir or None,
+            spool_threshold=self.bundle_spool_threshold,
+            cache=bundle_cache,
+        )
+
+    def _create_clients(self) -> "ClientPool":
+        from rsconnect_jupyter.clients import ClientPool
+        from rsconnect_jupyter.recording import TrafficRecorder
+
+        recorder = None
+        if self.record_connect_traffic:
+            recorder = TrafficRecorder(self.record_connect_traffic)
+        return ClientPool(self.client_pool_size, self.client_idle_timeout, recorder)
+
+    def _create_verified(self) -> "VerificationCache":
+        from rsconnect_jupyter.clients import VerificationCache
+
+        return VerificationCache(self.verify_cache_ttl)
+
+    def _create_app_search(self) -> "AppSearchCache":
+        from rsconnect_jupyter.search import AppSearchCache
+
+        return AppSearchCache(self.app_search_ttl)
+
+    @property
+    def bundle_builder(self) -> "BundleBuilder":
+        return self._component("bundle_builder", self._create_bundle_builder)
+
+    @property
+    def clients(self) -> "ClientPool":
+        return self._component("clients", self._create_clients)
+
+    @property
+    def verified(self) -> "VerificationCache":
+        return self._component("verified", self._create_verified)
+
+    @property
+    def app_search(self) -> "AppSearchCache":
+        return self._component("app_search", self._create_app_search)
+
+    def start(self):
+        if self.preload or self.bundle_prewarm:
+            # on its own thread, so the server starts accepting requests meanwhile
+            # without the warm-up taking an executor slot from them
+            threading.Thread(target=self._warm_up, name="rsconnect-jupyter-warm-up", daemon=True).start()
+        # close connections that went idle even if no further requests arrive
+        self._pruner = PeriodicCallback(self._prune_clients, self.client_idle_timeout * 1000)
+        self._pruner.start()
+        if self.watchdog is not None:
+            self.watchdog.start()
+
+    def _warm_up(self):
+        try:
+            if self.preload:
+                self.clients
+                self.verified
+                self.app_search
+                import rsconnect.bundle  # noqa: F401
+            if self.bundle_prewarm:
+                self.bundle_builder.start()
+        except Exception:
+            self.log.exception("Failed to preload rsconnect_jupyter")
+
+    def _prune_clients(self):
+        clients = self._components.get("clients")
+        if clients is not None:
+            clients.prune()
+
+    def status(self) -> dict:
+        # components that haven't been used yet are reported as None rather than created
+        components = dict(self._components)
+
+        def stats(name):
+            component = components.get(name)
+            return component.stats() if component is not None else None
+
+        return {
+            "executor": self.executor.stats(),
+            "bundle_builder": stats("bundle_builder"),
+            "clients": stats("clients"),
+            "environments": self.environments.stats(),
+            "app_search": stats("app_search"),
+            "jobs": self.jobs.stats(),
+            "watchdog": self.watchdog.stats() if self.watchdog is not None else None,
+        }
+
+    def shutdown(self):
+        """
+        Stops the background threads and worker processes and closes the
+        connections and files held open. Safe to call more than once.
+        """
+        if self._pruner is not None:
+            self._pruner.stop()
+            self._pruner = None
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        with self._components_lock:
+            clients = self._components.pop("clients", None)
+            bundle_builder = self._components.pop("bundle_builder", None)
+        if clients is not None:
+            clients.close()
+        if bundle_builder is not None:
+            bundle_builder.shutdown()
+        self.executor.shutdown(wait=False)
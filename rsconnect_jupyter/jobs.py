@@ -0,0 +1,358 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from rsconnect.exception import RSConnectException
+from tornado.locks import Condition
+
+from rsconnect_jupyter.executor import ExecutorBusy
+from rsconnect_jupyter.metrics import DEPLOYS_IN_PROGRESS
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Bounds, in seconds, of the interval between Connect task polls. The interval
+# grows while the task produces no new output and drops back to the minimum
+# as soon as it does.
+TASK_POLL_MIN_INTERVAL = 0.5
+TASK_POLL_MAX_INTERVAL = 5.0
+TASK_POLL_BACKOFF = 1.5
+
+# Seconds a background job waits before retrying when the executor is saturated.
+BUSY_RETRY_INTERVAL = 0.5
+
+
+class SharedBundle(object):
+    """
+    The bundle for one or more deployments of the same notebook with the same
+    options, e.g. to several servers. It is built once, by whichever job needs
+    it first, and released when the last of its `users` is done with it.
+    """
+
+    def __init__(self, users: int = 1):
+        self.users = users
+        self.timings: dict = {}
+        self._build: Optional[asyncio.Future] = None
+
+    async def acquire(self, extension, params: dict) -> str:
+        """
+        :return: the path of the bundle, built from `params` if nobody has yet.
+        """
+        if self._build is None:
+            self._build = asyncio.ensure_future(
+                extension.bundle_builder.build(
+                    params["app_mode"],
+                    params["os_path"],
+                    params["python"],
+                    params.get("environment"),
+                    params.get("files", []),
+                    hide_all_input=params.get("hide_all_input", False),
+                    hide_tagged_input=params.get("hide_tagged_input", False),
+                    timings=self.timings,
+                )
+            )
+        # one job giving up mustn't cancel the build for the others
+        return await asyncio.shield(self._build)
+
+    def release(self, extension):
+        self.users -= 1
+        if self.users == 0:
+            extension.bundle_builder.release(self._build.result())
+
+
+class DeployJob(object):
+    """
+    A deployment that runs in the background, independently of the HTTP
+    request (and the browser tab) that started it:
+
+        build bundle -> upload and deploy -> wait for the Connect task -> app config
+
+    The browser only observes the job through its ID. Each job polls Connect
+    once, however many browser tabs are watching it; watchers wait on
+    `wait_for_change` instead.
+    """
+
+    def __init__(self, params: dict, bundle: Optional[SharedBundle] = None):
+        """
+        :param params: the deployment parameters: server_address, api_key,
+        disable_tls_check, cadata, app_id, notebook_name, notebook_title,
+        app_mode, os_path, python, environment, files, hide_all_input and
+        hide_tagged_input, and optionally environment_seconds, the time the
+        browser spent inspecting the environment.
+        :param bundle: the bundle shared with other jobs deploying the same
+        content, if any.
+        """
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.bundle = bundle or SharedBundle()
+        self.state = PENDING
+        self.phase = None
+        self.log: List[str] = []
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        # seconds, bytes and other details of each phase, in the order they ran
+        self.timings: Dict[str, dict] = {}
+        if params.get("environment_seconds") is not None:
+            self.timings["environment"] = {"seconds": params["environment_seconds"]}
+        self._changed = Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.state in (SUCCEEDED, FAILED)
+
+    def to_dict(self, cursor: int = 0) -> dict:
+        """
+        The job's state for the browser. Only the log lines after `cursor`
+        are included; the returned `cursor` is the one to send next time.
+        """
+        return {
+            "job_id": self.id,
+            "state": self.state,
+            "phase": self.phase,
+            "lines": self.log[cursor:],
+            "cursor": len(self.log),
+            "result": self.result,
+            "error": self.error,
+            "timings": self.timings,
+        }
+
+    def append_log(self, lines: List[str]):
+        if lines:
+            self.log.extend(lines)
+            self._changed.notify_all()
+
+    def set_phase(self, phase: str):
+        self.phase = phase
+        self._changed.notify_all()
+
+    @contextmanager
+    def timed(self, phase: str):
+        """
+        Records how long the body takes under `phase` in `timings`. Yields the
+        phase's entry for other details, e.g. bytes transferred.
+        """
+        timing = self.timings.setdefault(phase, {})
+        started = time.monotonic()
+        try:
+            yield timing
+        finally:
+            timing["seconds"] = round(time.monotonic() - started, 3)
+
+    async def wait_for_change(self, cursor: int, timeout: float) -> bool:
+        """
+        Waits until the log grows past `cursor` or the job finishes.
+
+        :param cursor: the number of log lines the caller has already seen.
+        :param timeout: the maximum number of seconds to wait.
+        :return: False if the wait timed out with nothing new.
+        """
+        if self.done or len(self.log) > cursor:
+            return True
+        return await self._changed.wait(timeout=timedelta(seconds=timeout))
+
+    async def run(self, extension):
+        """
+        Runs the deployment pipeline to completion, recording the outcome on
+        the job rather than raising.
+
+        :param extension: the RSConnectJupyter instance providing the executor,
+        bundle builder and Connect clients.
+        """
+        self.state = RUNNING
+        DEPLOYS_IN_PROGRESS.inc()
+        started = time.monotonic()
+        try:
+            self.result = await self._deploy(extension)
+            self.state = SUCCEEDED
+        except RSConnectException as exc:
+            self.error = exc.message
+            self.state = FAILED
+        except Exception as exc:
+            extension.log.exception("Deployment %s failed", self.id)
+            self.error = str(exc)
+            self.state = FAILED
+        finally:
+            DEPLOYS_IN_PROGRESS.dec()
+            self.timings["total"] = {"seconds": round(time.monotonic() - started, 3)}
+            self.finished = time.time()
+            self._log_timings(extension)
+            self._changed.notify_all()
+
+    def _log_timings(self, extension):
+        # one line per deployment, for log aggregators to pick apart
+        record = {
+            "job_id": self.id,
+            "state": self.state,
+            "server": self.params["server_address"],
+            "app_mode": self.params["app_mode"],
+            "app_id": (self.result or {}).get("app_id", self.params.get("app_id")),
+            "timings": self.timings,
+        }
+        extension.log.info("rsconnect_jupyter deployment timings: %s", json.dumps(record, sort_keys=True))
+
+    async def _run_blocking(self, extension, fn, *args):
+        # Unlike a request, a background job can afford to wait for a thread.
+        while True:
+            try:
+                return await extension.executor.run(fn, *args)
+            except ExecutorBusy:
+                await asyncio.sleep(BUSY_RETRY_INTERVAL)
+
+    def _client(self, extension, cookies=None):
+        params = self.params
+        return extension.clients.client(
+            params["server_address"],
+            params["api_key"],
+            params["disable_tls_check"],
+            params.get("cadata"),
+            cookies=cookies,
+        )
+
+    async def _deploy(self, extension) -> dict:
+        params = self.params
+
+        self.set_phase("build")
+        with self.timed("build") as timing:
+            try:
+                bundle_path = await self.bundle.acquire(extension, params)
+            except Exception as exc:
+                extension.log.exception("Bundle creation failed")
+                raise RSConnectException("Bundle creation failed: %s" % exc)
+            # shared with the other deployments of the bundle, which only waited for it
+            timing.update(self.bundle.timings)
+
+        self.set_phase("deploy")
+        with self.timed("upload") as timing:
+            try:
+                deployed = await self._run_blocking(extension, self._upload, extension, bundle_path)
+            finally:
+                self.bundle.release(extension)
+            timing["bytes"] = deployed.pop("uploaded_bytes")
+
+        self.set_phase("wait")
+        with self.timed("task"):
+            await self._wait_for_task(extension, deployed["task_id"], deployed["cookies"])
+
+        self.set_phase("config")
+        with self.timed("config"):
+            deployed["config"] = await self._run_blocking(extension, self._app_config, extension, deployed["app_id"])
+        # the app may be new or retitled
+        extension.app_search.invalidate(params["server_address"])
+        return deployed
+
+    def _upload(self, extension, bundle_path: str) -> dict:
+        params = self.params
+        app_id = params.get("app_id")
+        title = params["notebook_title"]
+        cache = extension.bundle_builder.cache
+        with self._client(extension) as api_client:
+            result = None
+            if cache is not None and app_id is not None:
+                # the app may already have exactly this bundle from an earlier publish
+                bundle_id = cache.uploaded_bundle(params["server_address"], app_id, bundle_path)
+                if bundle_id is not None:
+                    result = api_client.redeploy(app_id, bundle_id, title, title is not None)
+            if result is None:
+                with open(bundle_path, "rb") as bundle:
+                    result = api_client.deploy(app_id, params["notebook_name"], title, title is not None, bundle)
+                result["uploaded_bytes"] = os.path.getsize(bundle_path)
+            else:
+                result["uploaded_bytes"] = 0
+            if cache is not None:
+                cache.remember_upload(params["server_address"], result["app_id"], bundle_path, result["bundle_id"])
+            result["cookies"] = api_client.cookies()
+        return result
+
+    def _task_get(self, extension, task_id, first_status, cookies: dict) -> dict:
+        with self._client(extension, cookies=cookies) as api_client:
+            return api_client.handle_bad_response(api_client.task_get(task_id, first_status))
+
+    def _app_config(self, extension, app_id) -> dict:
+        with self._client(extension) as api_client:
+            return api_client.handle_bad_response(api_client.app_config(app_id))
+
+    async def _wait_for_task(self, extension, task_id, cookies: dict):
+        last_status = None
+        interval = TASK_POLL_MIN_INTERVAL
+        while True:
+            task = await self._run_blocking(extension, self._task_get, extension, task_id, last_status, cookies)
+            self.append_log(task["status"])
+            last_status = task["last_status"]
+            if task["finished"]:
+                if task["code"] != 0:
+                    raise RSConnectException("Failed to deploy successfully: %s" % task["error"])
+                return
+            if task["status"]:
+                interval = TASK_POLL_MIN_INTERVAL
+            else:
+                interval = min(interval * TASK_POLL_BACKOFF, TASK_POLL_MAX_INTERVAL)
+            await asyncio.sleep(interval)
+
+
+class JobManager(object):
+    """
+    Tracks background jobs by ID. Finished jobs are kept for `retention`
+    seconds so a browser that reconnects can still read their outcome.
+
+    The latest job for each notebook and server is also remembered, so a
+    browser tab that was closed or reloaded during a deployment can find out
+    where the notebook was published and save it in the notebook's metadata.
+    """
+
+    def __init__(self, retention: float = 3600):
+        self.retention = retention
+        self._jobs: Dict[str, DeployJob] = {}
+        self._tasks: Dict[str, asyncio.Future] = {}
+        # job IDs by notebook path and server address
+        self._latest: Dict[Tuple[str, str], str] = {}
+
+    def submit(self, job: DeployJob, runner) -> DeployJob:
+        """
+        Schedules a job on the running event loop.
+
+        :param job: the job to track.
+        :param runner: the coroutine that runs the job.
+        """
+        self.prune()
+        self._jobs[job.id] = job
+        if job.params.get("os_path") and job.params.get("server_address"):
+            self._latest[(job.params["os_path"], job.params["server_address"])] = job.id
+        task = asyncio.ensure_future(runner)
+        self._tasks[job.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.id, None))
+        return job
+
+    def get(self, job_id: str) -> Optional[DeployJob]:
+        return self._jobs.get(job_id)
+
+    def for_notebook(self, os_path: str) -> List[DeployJob]:
+        """
+        :return: the latest job deploying the notebook at `os_path` to each
+        server, running or not.
+        """
+        self.prune()
+        return [self._jobs[job_id] for (path, _), job_id in self._latest.items() if path == os_path]
+
+    def prune(self):
+        expiry = time.time() - self.retention
+        for job_id, job in list(self._jobs.items()):
+            if job.done and job.finished < expiry:
+                del self._jobs[job_id]
+        for key, job_id in list(self._latest.items()):
+            if job_id not in self._jobs:
+                del self._latest[key]
+
+    def stats(self) -> dict:
+        states = {PENDING: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+        for job in self._jobs.values():
+            states[job.state] += 1
+        return states
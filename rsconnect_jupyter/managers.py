@@ -1,10 +1,11 @@
 from inspect import isawaitable
-from typing import Union, Awaitable
+from typing import TYPE_CHECKING, Union, Awaitable
 
-from jupyter_server.services.contents.manager import ContentsManager
+if TYPE_CHECKING:
+    from jupyter_server.services.contents.manager import ContentsManager
 
 
-async def get_model(manager: ContentsManager, path: str) -> dict:
+async def get_model(manager: "ContentsManager", path: str) -> dict:
     """
     Gets the model via the ContentsManager.
 
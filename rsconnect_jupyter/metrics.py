@@ -0,0 +1,79 @@
+"""
+Prometheus metrics for the server extension.
+
+They are kept in their own registry, served by `MetricsHandler` at
+`rsconnect_jupyter/metrics`, which is also added to the default registry so
+they appear on the notebook server's own `/metrics` endpoint.
+"""
+import prometheus_client
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+
+REGISTRY = CollectorRegistry(auto_describe=True)
+
+_MEGABYTE = 1024 * 1024
+
+ACTION_DURATION = Histogram(
+    "rsconnect_jupyter_action_duration_seconds",
+    "Time taken by rsconnect_jupyter API actions",
+    ["action", "status_code"],
+    registry=REGISTRY,
+)
+
+BUNDLE_BUILD_DURATION = Histogram(
+    "rsconnect_jupyter_bundle_build_duration_seconds",
+    "Time taken to build bundles, excluding bundles reused from the cache",
+    ["app_mode"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float("inf")),
+    registry=REGISTRY,
+)
+
+BUNDLE_SIZE = Histogram(
+    "rsconnect_jupyter_bundle_size_bytes",
+    "Size of built bundles",
+    ["app_mode"],
+    buckets=tuple(size * _MEGABYTE for size in (0.0625, 0.25, 1, 4, 16, 64, 256, 1024)) + (float("inf"),),
+    registry=REGISTRY,
+)
+
+UPLOAD_BYTES = Counter(
+    "rsconnect_jupyter_upload_bytes",
+    "Bytes of bundles uploaded to Posit Connect",
+    registry=REGISTRY,
+)
+
+UPLOAD_THROUGHPUT = Histogram(
+    "rsconnect_jupyter_upload_throughput_bytes_per_second",
+    "Rate at which bundles were uploaded to Posit Connect",
+    buckets=tuple(rate * _MEGABYTE for rate in (0.125, 0.5, 1, 2, 5, 10, 25, 50, 100, 250)) + (float("inf"),),
+    registry=REGISTRY,
+)
+
+CONNECT_ERRORS = Counter(
+    "rsconnect_jupyter_connect_errors",
+    "Failed requests to Posit Connect, by HTTP status code, or 'connection' if no response was received",
+    ["status_code"],
+    registry=REGISTRY,
+)
+
+DEPLOYS_IN_PROGRESS = Gauge(
+    "rsconnect_jupyter_deploys_in_progress",
+    "Deployments currently being built, uploaded or deployed",
+    registry=REGISTRY,
+)
+
+IOLOOP_LAG = Histogram(
+    "rsconnect_jupyter_ioloop_lag_seconds",
+    "How late the notebook server's IOLoop ran the loop watchdog's periodic callback",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf")),
+    registry=REGISTRY,
+)
+
+IOLOOP_STALL_DURATION = Histogram(
+    "rsconnect_jupyter_ioloop_stall_duration_seconds",
+    "Times the IOLoop was blocked for longer than loop_lag_threshold, by the action that was running",
+    ["action"],
+    buckets=(0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float("inf")),
+    registry=REGISTRY,
+)
+
+prometheus_client.REGISTRY.register(REGISTRY)
@@ -0,0 +1,174 @@
+"""
+Recording of the extension's traffic with Posit Connect.
+
+With `c.RSConnectJupyter.record_connect_traffic` set to a file path, every
+request the extension makes to Connect is appended to that file as a line of
+JSON: what was requested, how long Connect took, and what it answered. API
+keys, cookies, passwords, tokens and email addresses are redacted, and
+bundle contents are not recorded at all, only their size, so a recording can
+be shared. `mock_connect.py --replay` serves a recording back with the same
+latencies, to reproduce a slow deployment without access to the server.
+"""
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+RECORDING_FORMAT = "rsconnect_jupyter-connect-recording"
+RECORDING_VERSION = 1
+
+REDACTED = "[REDACTED]"
+
+# Names of headers, query parameters and JSON fields whose values are redacted.
+SECRET_NAMES = re.compile(r"key|token|secret|password|passwd|authorization|cookie|credential|email", re.IGNORECASE)
+
+# Longest response body recorded when it isn't JSON, such as an error page.
+TEXT_LIMIT = 64 * 1024
+
+
+def redact(value: Any) -> Any:
+    """
+    :return: a copy of a decoded JSON value with the values of secret fields
+    replaced.
+    """
+    if isinstance(value, dict):
+        return {key: REDACTED if SECRET_NAMES.search(key) else redact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+def redact_headers(headers) -> dict:
+    return {name: REDACTED if SECRET_NAMES.search(name) else value for name, value in headers}
+
+
+def redact_uri(uri: str) -> str:
+    path, _, query = uri.partition("?")
+    if not query:
+        return path
+    params = [(name, REDACTED if SECRET_NAMES.search(name) else value) for name, value in parse_qsl(query, True)]
+    return "%s?%s" % (path, urlencode(params))
+
+
+def body_size(body) -> int:
+    """
+    :return: the size of a request body as passed to http.client, which
+    for a file is what remains from its current position.
+    """
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    if hasattr(body, "fileno"):
+        return os.fstat(body.fileno()).st_size - body.tell()
+    return 0
+
+
+def _request_body(body) -> Any:
+    # only JSON is kept; bundles are binary and may be large or confidential
+    if isinstance(body, (bytes, bytearray)):
+        try:
+            body = body.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+    if not isinstance(body, str):
+        return None
+    try:
+        return redact(json.loads(body))
+    except ValueError:
+        return None
+
+
+def _response_fields(status: int, reason: str, headers, body) -> dict:
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", "replace")
+    headers = list(headers)
+    content_type = dict((name.lower(), value) for name, value in headers).get("content-type") or ""
+    entry = {
+        "status": status,
+        "reason": reason,
+        "response_headers": redact_headers(headers),
+        "response_bytes": len(body.encode("utf-8")) if body else 0,
+    }
+    if content_type.startswith("application/json") and body:
+        try:
+            entry["response_body"] = redact(json.loads(body))
+            return entry
+        except ValueError:
+            pass
+    entry["response_text"] = (body or "")[:TEXT_LIMIT]
+    return entry
+
+
+class TrafficRecorder(object):
+    """
+    Appends exchanges with Connect to a recording file, one JSON object per
+    line after a header line. Safe to use from several threads.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._file = open(path, "a", encoding="utf-8")
+        self._write(
+            {
+                "format": RECORDING_FORMAT,
+                "version": RECORDING_VERSION,
+                "started": datetime.now(timezone.utc).isoformat(),
+            }
+        )
+
+    def _write(self, entry: dict):
+        line = json.dumps(entry, sort_keys=True)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def record(
+        self, server_url: str, method: str, request_headers: dict, body, request_bytes: int, started: float, response
+    ):
+        """
+        Records one request.
+
+        :param server_url: the URL of the Connect server; its path is removed
+        from the recorded URI, so recordings from servers behind a path
+        prefix replay at the root.
+        :param body: the request body, as passed to http.client.
+        :param request_bytes: the size of the body, measured before it was sent.
+        :param started: the time.monotonic() at which the request was sent.
+        :param response: the rsconnect HTTPResponse for the request.
+        """
+        seconds = time.monotonic() - started
+        parsed = urlparse(server_url)
+        uri = response.full_uri
+        prefix = parsed.path.rstrip("/")
+        if prefix and uri.startswith(prefix + "/"):
+            uri = uri[len(prefix) :]
+        entry = {
+            "at": round(started - self._started, 6),
+            "seconds": round(seconds, 6),
+            "server": "%s://%s" % (parsed.scheme, parsed.netloc.rpartition("@")[2]),
+            "method": method,
+            "uri": redact_uri(uri),
+            "request_headers": redact_headers(request_headers.items()),
+            "request_bytes": request_bytes,
+            "request_body": _request_body(body),
+        }
+        if response.exception is not None:
+            entry["error"] = "%s: %s" % (type(response.exception).__name__, response.exception)
+        else:
+            raw = getattr(response, "_response", None)
+            headers = raw.getheaders() if raw is not None else []
+            entry.update(_response_fields(response.status, response.reason, headers, response.response_body))
+        self._write(entry)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
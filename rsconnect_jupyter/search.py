@@ -0,0 +1,270 @@
+import bisect
+import threading
+import time
+from typing import Dict, List, Set
+
+from rsconnect.exception import RSConnectException
+
+from rsconnect_jupyter.clients import PooledClient, _abbreviate_app, _is_notebook_app, client_key
+
+# Apps requested from Connect per page while refreshing a catalog.
+CATALOG_PAGE_SIZE = 500
+
+# The most content items a catalog is built from. Users who can edit more than
+# this are searched with Connect's own title filter instead, so the first
+# search never has to page through a whole large server.
+CATALOG_MAX_APPS = 5000
+
+# Seconds between full refreshes of a catalog, which pick up deleted apps.
+# In between, refreshes only fetch apps updated since the last one.
+FULL_REFRESH_INTERVAL = 900
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class TitleIndex(object):
+    """
+    Finds apps by title: prefix matches first, in title order, then the
+    remaining titles containing the query. Prefixes are found by bisecting the
+    sorted titles and substrings through a trigram index.
+    """
+
+    def __init__(self, apps: Dict[int, dict]):
+        self._sorted = sorted(((app["title"] or app["name"] or "").lower(), app_id) for app_id, app in apps.items())
+        self._titles = {app_id: title for title, app_id in self._sorted}
+        self._trigrams: Dict[str, Set[int]] = {}
+        for title, app_id in self._sorted:
+            for trigram in _trigrams(title):
+                self._trigrams.setdefault(trigram, set()).add(app_id)
+
+    def search(self, query: str) -> List[int]:
+        """
+        :return: the IDs of the matching apps, best matches first.
+        """
+        query = query.lower()
+        start = bisect.bisect_left(self._sorted, (query,))
+        prefixed = []
+        for title, app_id in self._sorted[start:]:
+            if not title.startswith(query):
+                break
+            prefixed.append(app_id)
+
+        if len(query) < 3:
+            candidates = self._titles
+        else:
+            trigram_sets = sorted((self._trigrams.get(t, set()) for t in _trigrams(query)), key=len)
+            candidates = set.intersection(*trigram_sets)
+        seen = set(prefixed)
+        contained = [
+            app_id for title, app_id in self._sorted if app_id in candidates and app_id not in seen and query in title
+        ]
+        return prefixed + contained
+
+
+def _summary(app: dict) -> dict:
+    return {
+        "id": app["id"],
+        "name": app["name"],
+        "title": app["title"],
+        "app_mode": app["app_mode"],
+        "url": app["url"],
+    }
+
+
+class AppCatalog(object):
+    """
+    The notebook apps one user can edit on one server, with the title index
+    used to search them.
+    """
+
+    def __init__(self):
+        self.apps: Dict[int, dict] = {}
+        self.config_urls: Dict[int, str] = {}
+        self.index = TitleIndex({})
+        self.newest = ""
+        self.refreshed = 0.0
+        self.full_refreshed = 0.0
+        self.stale = True
+        # whether all of the user's apps are in `apps`, or too many to keep
+        self.complete = True
+        # whether Connect has returned apps most recently updated first
+        self.ordered = True
+        self.lock = threading.Lock()
+
+    def refresh(self, client: PooledClient, full: bool):
+        """
+        Fetches the user's apps, most recently updated first. Unless `full`,
+        stops at the first page with nothing updated since the previous
+        refresh.
+
+        Stopping early relies on Connect sorting by `updated_time`. If a page
+        comes back in another order, the refresh is redone in full, and so
+        are all later ones. If the user can edit more than CATALOG_MAX_APPS
+        items, no apps are kept and the catalog is marked incomplete.
+        """
+        full = full or not self.ordered
+        apps = {} if full else dict(self.apps)
+        newest = self.newest
+        previous = None
+        start = 0
+        while True:
+            page = client.handle_bad_response(
+                client.app_search(
+                    {
+                        "filter": "min_role:editor",
+                        "count": CATALOG_PAGE_SIZE,
+                        "start": start,
+                        "sort": "updated_time",
+                        "order": "desc",
+                    }
+                )
+            )
+            if page["total"] > CATALOG_MAX_APPS:
+                self._set_apps({}, newest, full=True)
+                self.complete = False
+                return
+            updated = False
+            for app in page["applications"]:
+                updated_time = app.get("updated_time") or ""
+                if previous is not None and updated_time > previous:
+                    self.ordered = False
+                    if not full:
+                        return self.refresh(client, full=True)
+                previous = updated_time
+                newest = max(newest, updated_time)
+                summary = _summary(app) if _is_notebook_app(app) else None
+                # timestamps may be coarse, so apps updated at the same time as
+                # the newest one seen before are compared instead
+                if full or updated_time > self.newest or apps.get(app["id"]) != summary:
+                    updated = True
+                if summary is not None:
+                    apps[app["id"]] = summary
+                else:
+                    apps.pop(app["id"], None)
+            start += len(page["applications"])
+            if not page["applications"] or start >= page["total"] or not updated:
+                break
+        self._set_apps(apps, newest, full)
+        self.complete = True
+
+    def _set_apps(self, apps: Dict[int, dict], newest: str, full: bool):
+        self.apps = apps
+        self.newest = newest
+        self.index = TitleIndex(apps)
+        self.refreshed = time.monotonic()
+        if full:
+            self.full_refreshed = self.refreshed
+        self.stale = False
+
+    def search_connect(self, client: PooledClient, query: str) -> List[int]:
+        """
+        Searches with Connect's own `search` filter instead of the title
+        index, for an incomplete catalog, so matches are in Connect's order
+        rather than prefix matches first. The apps found are added to `apps`.
+
+        :return: the IDs of the matching notebook apps, up to a page of them.
+        """
+        page = client.handle_bad_response(
+            client.app_search({"filter": "min_role:editor", "search": query, "count": CATALOG_PAGE_SIZE})
+        )
+        matches = []
+        for app in page["applications"]:
+            if _is_notebook_app(app):
+                self.apps[app["id"]] = _summary(app)
+                matches.append(app["id"])
+        return matches
+
+    def config_url(self, client: PooledClient, app_id: int) -> str:
+        if app_id not in self.config_urls:
+            config = client.handle_bad_response(client.app_config(app_id))
+            self.config_urls[app_id] = config["config_url"]
+        return self.config_urls[app_id]
+
+
+class AppSearchCache(object):
+    """
+    App catalogs per server and API key (and so per user), so searching for a
+    deployment location doesn't fetch the user's content from Connect every
+    time the dialog opens.
+    """
+
+    def __init__(self, ttl: float = 60):
+        """
+        :param ttl: seconds a catalog is used before it is refreshed.
+        """
+        self.ttl = ttl
+        self._catalogs: Dict[tuple, AppCatalog] = {}
+        self._lock = threading.Lock()
+
+    def _catalog(self, key: tuple) -> AppCatalog:
+        with self._lock:
+            return self._catalogs.setdefault(key, AppCatalog())
+
+    def search(
+        self,
+        client: PooledClient,
+        app_id,
+        app_title: str,
+        start: int = 0,
+        count: int = 5,
+    ) -> dict:
+        """
+        Searches the user's notebook apps by title, refreshing the catalog
+        first if it is out of date. The app with `app_id`, if any, is listed
+        first so the current deployment location is always offered.
+
+        :return: a page of results: `applications`, each trimmed to ID, name,
+        title, mode, URL and config URL, their `count`, the `start` offset and
+        the `total` number of matches.
+        """
+        server = client.server
+        catalog = self._catalog(client_key(server.url, server.api_key, server.insecure, server.ca_data))
+        with catalog.lock:
+            now = time.monotonic()
+            # an incomplete catalog is only checked for having become small enough to keep
+            ttl = self.ttl if catalog.complete else FULL_REFRESH_INTERVAL
+            if catalog.stale or now - catalog.refreshed > ttl:
+                catalog.refresh(client, full=now - catalog.full_refreshed > FULL_REFRESH_INTERVAL)
+
+            if catalog.complete:
+                matches = catalog.index.search(app_title or "")
+            else:
+                matches = catalog.search_connect(client, app_title or "")
+            if app_id:
+                app_id = int(app_id)
+                if app_id in matches:
+                    matches.remove(app_id)
+                if app_id not in catalog.apps:
+                    try:
+                        app = client.handle_bad_response(client.app_get(app_id))
+                        if _is_notebook_app(app):
+                            catalog.apps[app_id] = _summary(app)
+                    except RSConnectException:
+                        pass
+                if app_id in catalog.apps:
+                    matches.insert(0, app_id)
+
+            page = []
+            for match in matches[start : start + count]:
+                app = catalog.apps[match]
+                page.append(_abbreviate_app(app, {"config_url": catalog.config_url(client, match)}))
+        return {"applications": page, "count": len(page), "start": start, "total": len(matches)}
+
+    def invalidate(self, server_url: str):
+        """
+        Marks every catalog for a server as out of date, e.g. after a deploy
+        to it created or retitled an app.
+        """
+        with self._lock:
+            for key, catalog in self._catalogs.items():
+                if key[0] == server_url:
+                    catalog.stale = True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "catalogs": len(self._catalogs),
+                "apps": sum(len(catalog.apps) for catalog in self._catalogs.values()),
+            }
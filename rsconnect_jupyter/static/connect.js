@@ -36,10 +36,8 @@ define([
       return callback(result);
     }
   }
-  // this will be filled in by `init()`
+  // these will be filled in lazily
   var notify = null;
-
-  // this will be filled in lazily
   var config = null;
   var rsconnectVersionInfo = null;
 
@@ -57,15 +55,24 @@ define([
 
   function maybeCreateConfig() {
     if (!config) {
+      notify = Jupyter.notification_area.widget('rsconnect_jupyter');
       config = new RSConnect(debug);
       window.RSConnect = config;
-      config.getVersionInfo()
-        .then(function (info) {
+    }
+  }
+
+  // Fetches the saved servers and the version info together, warning once
+  // if the server extension and nbextension versions differ.
+  function loadConfig() {
+    return config.load()
+      .then(function (info) {
+        var firstLoad = !rsconnectVersionInfo;
+        rsconnectVersionInfo = info;
+        window.rsconnectVersionInfo = info;
+        if (firstLoad) {
           console.log('rsconnect-jupyter nbextension version:', info.js_version);
           console.log('rsconnect-jupyter serverextension version:', info.rsconnect_jupyter_server_extension);
           console.log('rsconnect-python version:', info.rsconnect_python_version);
-          rsconnectVersionInfo = info;
-          window.rsconnectVersionInfo = info;
           if (info.js_version !== info.rsconnect_jupyter_server_extension) {
             console.error('Version Mismatch: rsconnect-jupyter has been installed incorrectly.');
             setTimeout(function () {
@@ -86,60 +93,9 @@ define([
               });
             }, 1000);
           }
-        });
-    }
-  }
-
-  function init() {
-    // construct notification widget
-    notify = Jupyter.notification_area.widget('rsconnect_jupyter');
-
-    // create an action that can be invoked from many places (e.g. command
-    // palette, button click, keyboard shortcut, etc.)
-
-    // avoid 'accessing "actions" on the global IPython/Jupyter is not recommended' warning
-    // https://github.com/jupyter/notebook/issues/2401
-    var actions = Jupyter.notebook.keyboard_manager.actions;
-
-    var actionName = actions.register(
-      {
-        icon: 'fa-cloud-upload',
-        help: 'Publish to Posit Connect',
-        help_index: 'zz',
-        handler: debounce(1000, onPublishClicked)
-      },
-      'publish',
-      'rsconnect_jupyter'
-    );
-
-    // add a button that invokes the action
-    Jupyter.toolbar.add_buttons_group([actionName]);
-
-    // re-style the toolbar button to have a custom icon
-    var $button = $('button[data-jupyter-action="' + actionName + '"]');
-    $button.addClass('dropbtn');
-
-    var container = $button.parent();
-    $button.remove();
-
-    var $menuContainer = $('<div class="rsc-dropdown"></div>');
-    var $menu = $('<div id="rsc-menu" class="rsc-dropdown-content"></div>');
-
-    var publishItem = $('<a href="#" id="publish-to-connect">Publish to Posit Connect</a>');
-    publishItem.click(onPublishClicked);
-    $menu.append(publishItem);
-
-    var manifestItem = $('<a href="#" id="create-manifest">Create Manifest for git Publishing</a>');
-    manifestItem.click(onCreateManifestClicked);
-    $menu.append(manifestItem);
-
-    $menuContainer.append($button);
-    $menuContainer.append($menu);
-    container.append($menuContainer);
-
-    $button.find('i')
-      .addClass('rsc-icon');
-    $button.click(onMenuClicked);
+        }
+        return info;
+      });
   }
 
   /***********************************************************************
@@ -159,19 +115,6 @@ define([
     }
   };
 
-  function debounce(delay, fn) {
-    var timeoutId = null;
-    return function () {
-      var self = this;
-      if (timeoutId === null) {
-        fn.apply(self, arguments);
-      }
-      timeoutId = setTimeout(function () {
-        timeoutId = null;
-      }, delay);
-    };
-  }
-
   /**
     * addValidationMarkup adds validation hints to an element
     * @param {Boolean} valid when true, validation hints are not added
@@ -844,6 +787,8 @@ define([
     }
 
     var selectedEntryId = serverId;
+    // further servers to publish the same content to, chosen by ctrl-clicking
+    var extraEntryIds = [];
 
     var entry = config.servers[selectedEntryId];
     var previousAppMode = entry && entry.appMode;
@@ -893,8 +838,11 @@ define([
             .removeServer(id)
             .then(function () {
               $a.remove();
+              extraEntryIds = extraEntryIds.filter(function (extraId) {
+                return extraId !== id;
+              });
               // if active server is removed, disable publish button
-              if ($a.hasClass('active')) {
+              if (id === selectedEntryId) {
                 btnPublish.addClass('disabled');
                 selectedEntryId = null;
                 updateCheckboxStates();
@@ -918,8 +866,19 @@ define([
         .append(btnRemove);
 
       if (!selectedDeployLocation) {
-        a.on('click', function () {
+        a.on('click', function (e) {
           var $this = $(this);
+          if ((e.ctrlKey || e.metaKey) && selectedEntryId && id !== selectedEntryId) {
+            $this.toggleClass('active');
+            if ($this.hasClass('active')) {
+              extraEntryIds.push(id);
+            } else {
+              extraEntryIds.splice(extraEntryIds.indexOf(id), 1);
+            }
+            txtTitle.trigger('input');
+            return;
+          }
+          extraEntryIds = [];
           $this
             .toggleClass('active')
             .siblings()
@@ -1051,6 +1010,7 @@ define([
         '    <div class="form-group">',
         '        <a href="#" id="rsc-add-server" class="pull-right">Add server...</a>',
         '        <label>Publish to</label>',
+        '        <small class="rsc-text-light">(ctrl-click to add more servers)</small>',
         '        <div id="rsc-select-server" class="list-group">',
         '        </div>',
         '    </div>',
@@ -1250,7 +1210,7 @@ define([
             config.servers[selectedEntryId] &&
             config.servers[selectedEntryId].notebookTitle;
 
-          if (!lastPublishedTitle || txtTitle.val() === lastPublishedTitle) {
+          if (extraEntryIds.length > 0 || !lastPublishedTitle || txtTitle.val() === lastPublishedTitle) {
             btnPublish.text('Publish');
           } else {
             btnPublish.text('Next');
@@ -1513,6 +1473,51 @@ define([
             togglePublishButton(true);
           }
 
+          var normalizedFiles = [];
+          if (notebookDirectory.length !== 0) {
+            files.forEach(function (file) {
+              normalizedFiles.push(
+                file.slice(notebookDirectory.length + 1)
+              );
+            });
+          } else {
+            normalizedFiles = files;
+          }
+
+          function publishToServers() {
+            config
+              .publishContentToServers(
+                [selectedEntryId].concat(extraEntryIds),
+                txtTitle.val(),
+                appMode,
+                normalizedFiles,
+                condaMode,
+                forceGenerate
+              )
+              .always(function () {
+                togglePublishButton(true);
+              })
+              .fail(handleFailure)
+              .then(function (outcomes) {
+                var failed = outcomes.filter(function (outcome) {
+                  return outcome.error;
+                });
+                if (failed.length === 0) {
+                  notify.set_message(' Successfully published content to ' + outcomes.length + ' servers', 15 * 1000);
+                  publishModal.modal('hide');
+                } else {
+                  // keep the dialog open so the log shows what went wrong where
+                  addValidationMarkup(
+                    false,
+                    $deploy_err,
+                    'Publishing failed on ' + failed.map(function (outcome) {
+                      return config.servers[outcome.serverId].serverName;
+                    }).join(', ') + '. See the log above for details.'
+                  );
+                }
+              });
+          }
+
           function publish() {
             // assume the user is re-deploying to the same location
             var appId = config.servers[selectedEntryId].appId;
@@ -1530,17 +1535,6 @@ define([
               appId = parseInt(selectedDeployLocation, 10);
             }
 
-            var normalizedFiles = [];
-            if (notebookDirectory.length !== 0) {
-              files.forEach(function (file) {
-                normalizedFiles.push(
-                  file.slice(notebookDirectory.length + 1)
-                );
-              });
-            } else {
-              normalizedFiles = files;
-            }
-
             config
               .publishContent(
                 selectedEntryId,
@@ -1578,7 +1572,10 @@ define([
               });
           }
 
-          if (selectedEntryId !== null && validTitle) {
+          if (selectedEntryId !== null && validTitle && extraEntryIds.length > 0) {
+            togglePublishButton(false);
+            publishToServers();
+          } else if (selectedEntryId !== null && validTitle) {
             togglePublishButton(false);
 
             var currentNotebookTitle =
@@ -1757,19 +1754,45 @@ define([
       .find('#new-location')
       .text('New location with title "' + title + '"');
 
-    var radios = searchResults.map(function (app) {
-      return mkRadio(
-        app.id,
-        app.title || app.name,
-        app.config_url,
-        app.app_mode
-      );
-    });
+    function mkRadios(page) {
+      return page.applications.map(function (app) {
+        return mkRadio(
+          app.id,
+          app.title || app.name,
+          app.config_url,
+          app.app_mode
+        );
+      });
+    }
+
+    var radios = mkRadios(searchResults);
     if (radios.length > 0) {
       radios.unshift(divider);
     }
     radios.unshift(newLocationRadio);
 
+    // further pages of results are fetched on request
+    var shown = searchResults.start + searchResults.count;
+    var moreLink = $('<a href="#"></a>').text('Show more');
+    var more = $('<p></p>').append(moreLink);
+    moreLink.on('click', function (e) {
+      e.preventDefault();
+      moreLink.addClass('disabled');
+      config
+        .appSearch(serverId, title, appId, shown)
+        .then(function (page) {
+          more.before(mkRadios(page));
+          shown = page.start + page.count;
+          more.toggle(page.count > 0 && shown < page.total);
+        })
+        .always(function () {
+          moreLink.removeClass('disabled');
+        });
+    });
+    if (shown < searchResults.total) {
+      radios.push(more);
+    }
+
     var selectedAppMode = appMode;
 
     var searchDialog = Dialog.modal({
@@ -1827,16 +1850,6 @@ define([
     });
   }
 
-  function onMenuClicked() {
-    // pop up publishing choices
-    var $menu = $('#rsc-menu');
-    $menu.toggleClass('show', !$menu.hasClass('show'));
-  }
-
-  function closeMenu() {
-    $('#rsc-menu').toggleClass('show', false);
-  }
-
   function onPublishClicked() {
     // This function will be passed (env, event) in the first two
     // positional slots. We're not using them.
@@ -1844,12 +1857,11 @@ define([
     // lazily load the config when clicked since Jupyter's init
     // function is racy w.r.t. loading of notebook metadata
     maybeCreateConfig();
-    closeMenu();
 
     // save before publishing so the server can pick up changes
     Jupyter.notebook
       .save_notebook()
-      .then(config.fetchConfig())
+      .then(loadConfig)
       .then(function () {
         if (Object.keys(config.servers).length === 0) {
           showAddServerDialog(config).then(showSelectServerDialog);
@@ -1888,8 +1900,7 @@ define([
     // lazily load the config when clicked since Jupyter's init
     // function is racy w.r.t. loading of notebook metadata
     maybeCreateConfig();
-
-    closeMenu();
+    loadConfig();
 
     var dialog = Dialog.modal({
       // pass the existing keyboard manager so all shortcuts are disabled while
@@ -2130,6 +2141,7 @@ define([
   }
 
   return {
-    init: init
+    publish: onPublishClicked,
+    createManifest: onCreateManifestClicked
   };
 });
@@ -1,12 +1,158 @@
 /* global define,requirejs */
 
 define([
-  './connect',
   'jquery',
-  'base/js/events',
+  'base/js/dialog',
   'base/js/namespace',
   'base/js/promises'
-], function(connect, $, events, Jupyter, promises) {
+], function($, Dialog, Jupyter, promises) {
+  var MODULE_PREFIX = 'nbextensions/rsconnect_jupyter/';
+
+  // resolves with the `connect` module once it has been loaded
+  var loadingConnect = null;
+
+  /**
+   * loadConnect loads the publishing dialogs on first use, so opening a
+   * notebook only costs this file. A built extension ships them as a single
+   * minified bundle whose name includes its content hash (see
+   * tools/build-frontend.js), which browsers can cache indefinitely; without
+   * one, or if it fails to load, the separate source files are loaded instead.
+   * @returns {*} resolves with the `connect` module
+   */
+  function loadConnect() {
+    if (loadingConnect === null) {
+      loadingConnect = $.Deferred();
+      // bundle.json names the bundle of the installed version, so it must not
+      // come from the browser cache after an upgrade
+      $.ajax({
+        url: Jupyter.notebook.base_url + MODULE_PREFIX + 'bundle.json',
+        dataType: 'json',
+        cache: false
+      })
+        .then(loadBundle, function() {
+          return $.Deferred().resolve();
+        })
+        .then(function() {
+          requirejs([MODULE_PREFIX + 'connect'], loadingConnect.resolve, function(err) {
+            // allow another attempt on the next click
+            var failed = loadingConnect;
+            loadingConnect = null;
+            failed.reject(err);
+          });
+        });
+    }
+    return loadingConnect.promise();
+  }
+
+  /**
+   * loadBundle loads the minified bundle, which defines the modules it
+   * contains under their usual names.
+   * @param bundle {Object} the contents of bundle.json
+   * @returns {*} resolves once the bundle has loaded or failed to load
+   */
+  function loadBundle(bundle) {
+    var loaded = $.Deferred();
+    var name = MODULE_PREFIX + bundle.publish;
+    requirejs([name], loaded.resolve, function() {
+      // fall back to the source files, e.g. for a bundle left over from an older version
+      requirejs.undef(name);
+      loaded.resolve();
+    });
+    return loaded.promise();
+  }
+
+  function debounce(delay, fn) {
+    var timeoutId = null;
+    return function() {
+      var self = this;
+      if (timeoutId === null) {
+        fn.apply(self, arguments);
+      }
+      timeoutId = setTimeout(function() {
+        timeoutId = null;
+      }, delay);
+    };
+  }
+
+  function onMenuClicked() {
+    // pop up publishing choices
+    var $menu = $('#rsc-menu');
+    $menu.toggleClass('show', !$menu.hasClass('show'));
+  }
+
+  function closeMenu() {
+    $('#rsc-menu').toggleClass('show', false);
+  }
+
+  function withConnect(action) {
+    return function() {
+      closeMenu();
+      loadConnect()
+        .then(function(connect) {
+          connect[action]();
+        })
+        .fail(function(err) {
+          Dialog.modal({
+            title: 'rsconnect_jupyter',
+            body: 'Failed to load the publishing dialog. Error: ' + err,
+            buttons: { Ok: { class: 'btn-primary' } }
+          });
+        });
+    };
+  }
+
+  function init() {
+    var onPublishClicked = withConnect('publish');
+    var onCreateManifestClicked = withConnect('createManifest');
+
+    // create an action that can be invoked from many places (e.g. command
+    // palette, button click, keyboard shortcut, etc.)
+
+    // avoid 'accessing "actions" on the global IPython/Jupyter is not recommended' warning
+    // https://github.com/jupyter/notebook/issues/2401
+    var actions = Jupyter.notebook.keyboard_manager.actions;
+
+    var actionName = actions.register(
+      {
+        icon: 'fa-cloud-upload',
+        help: 'Publish to Posit Connect',
+        help_index: 'zz',
+        handler: debounce(1000, onPublishClicked)
+      },
+      'publish',
+      'rsconnect_jupyter'
+    );
+
+    // add a button that invokes the action
+    Jupyter.toolbar.add_buttons_group([actionName]);
+
+    // re-style the toolbar button to have a custom icon
+    var $button = $('button[data-jupyter-action="' + actionName + '"]');
+    $button.addClass('dropbtn');
+
+    var container = $button.parent();
+    $button.remove();
+
+    var $menuContainer = $('<div class="rsc-dropdown"></div>');
+    var $menu = $('<div id="rsc-menu" class="rsc-dropdown-content"></div>');
+
+    var publishItem = $('<a href="#" id="publish-to-connect">Publish to Posit Connect</a>');
+    publishItem.click(onPublishClicked);
+    $menu.append(publishItem);
+
+    var manifestItem = $('<a href="#" id="create-manifest">Create Manifest for git Publishing</a>');
+    manifestItem.click(onCreateManifestClicked);
+    $menu.append(manifestItem);
+
+    $menuContainer.append($button);
+    $menuContainer.append($menu);
+    container.append($menuContainer);
+
+    $button.find('i')
+      .addClass('rsc-icon');
+    $button.click(onMenuClicked);
+  }
+
   function load_ipython_extension() {
     promises.app_initialized.then(function(app) {
       if (app === 'NotebookApp') {
@@ -19,7 +165,7 @@ define([
           })
           .appendTo('head');
 
-        connect.init();
+        init();
       }
     });
   }
@@ -17,6 +17,190 @@ define([
             console.error.apply(null, args);
         }
     };
+
+    // Deployment log lines kept in the publish dialog; older lines are dropped.
+    var MAX_LOG_LINES = 1000;
+
+    // Existing content items listed per page when choosing where to publish.
+    var SEARCH_PAGE_SIZE = 20;
+
+    // Deployment phases in the order they run, as reported in a job's `timings`.
+    var TIMING_PHASES = [
+        'environment',
+        'build',
+        'upload',
+        'task',
+        'config',
+        'total'
+    ];
+
+    // The time taken by each phase of a deployment is added to the log in debug mode.
+    var SHOW_TIMINGS = Boolean(window.localStorage) &&
+        window.localStorage.getItem('__RSCONNECT_JUPYTER_DEBUG_MODE__') === 'enabled';
+
+    /**
+     * appendLog adds lines to the end of the log, keeping only the most
+     * recent MAX_LOG_LINES so long builds don't slow down rendering.
+     * @param $log {jQuery} the log element
+     * @param lines {Array} the new log lines
+     */
+    function appendLog($log, lines) {
+        if (lines.length === 0) {
+            return;
+        }
+        var logElem = $log.get(0);
+        var oldScroll = logElem.scrollTop;
+        var oldMaxScroll = logElem.scrollHeight - logElem.clientHeight;
+
+        var fragment = document.createDocumentFragment();
+        lines.slice(-MAX_LOG_LINES).forEach(function (line) {
+            fragment.appendChild(document.createTextNode(line + '\n'));
+        });
+        logElem.appendChild(fragment);
+        while (logElem.childNodes.length > MAX_LOG_LINES) {
+            logElem.removeChild(logElem.firstChild);
+        }
+
+        if (oldScroll >= oldMaxScroll - 1) {
+            // scroll to new bottom position
+            $log.scrollTop(logElem.scrollHeight);
+        }
+    }
+
+    function formatBytes(bytes) {
+        if (bytes < 1024 * 1024) {
+            return (bytes / 1024).toFixed(1) + ' KB';
+        }
+        return (bytes / 1024 / 1024).toFixed(1) + ' MB';
+    }
+
+    /**
+     * formatTimings describes how long each phase of a deployment took.
+     * @param timings {Object} the job's `timings`
+     * @returns {String} a single log line
+     */
+    function formatTimings(timings) {
+        var parts = TIMING_PHASES
+            .filter(function (phase) {
+                return phase in timings;
+            })
+            .map(function (phase) {
+                var timing = timings[phase];
+                var details = [];
+                if (timing.cached) {
+                    details.push('cached');
+                }
+                if (typeof timing.render_seconds === 'number') {
+                    details.push('render ' + timing.render_seconds.toFixed(2) + 's');
+                }
+                if (typeof timing.bytes === 'number') {
+                    details.push(formatBytes(timing.bytes));
+                }
+                var part = phase + ' ' + timing.seconds.toFixed(2) + 's';
+                return details.length > 0 ? part + ' (' + details.join(', ') + ')' : part;
+            });
+        return 'Timings: ' + parts.join(', ');
+    }
+
+    function jobOutcome(current) {
+        if (current.state === 'failed') {
+            var msg = current.error || 'Failed to deploy successfully';
+            return $.Deferred().reject({ responseJSON: { message: msg } });
+        }
+        debug.info('deployment finished after', current.cursor, 'log lines');
+        return $.Deferred().resolve({
+            appId: current.result.app_id,
+            config: current.result.config,
+            timings: current.timings
+        });
+    }
+
+    function isFinished(current) {
+        return current.state === 'succeeded' || current.state === 'failed';
+    }
+
+    /**
+     * pollJob follows a deployment by requesting its state every second.
+     * Used when the browser can't keep an event stream open.
+     * @param job {Object} the job as returned by `deploy` or `job_get`
+     * @param cursor {Number|null} the number of log lines already shown, or null to start with `job`
+     * @param onLines {Function} called with each batch of new log lines
+     * @returns {*} resolves with the deployed app ID and its config
+     */
+    function pollJob(job, cursor, onLines) {
+        function inner(current) {
+            // only the lines after the cursor we sent are returned
+            onLines(current.lines);
+            cursor = current.cursor;
+            if (isFinished(current)) {
+                return jobOutcome(current);
+            }
+            var next = $.Deferred();
+            setTimeout(function () {
+                Utils.ajax({
+                    url: Jupyter.notebook.base_url + 'rsconnect_jupyter/job_get',
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    data: JSON.stringify({
+                        job_id: job.job_id,
+                        cursor: cursor
+                    })
+                })
+                    .then(inner)
+                    .then(next.resolve, next.reject);
+            }, 1000);
+            return next;
+        }
+
+        if (typeof cursor !== 'number') {
+            return inner(job);
+        }
+        return inner($.extend({}, job, {
+            lines: [],
+            cursor: cursor,
+            state: 'running'
+        }));
+    }
+
+    /**
+     * watchJob follows a deployment running on the server until it
+     * finishes. The server pushes log lines as they arrive and keeps
+     * going if this tab is closed.
+     * @param job {Object} the job as returned by `deploy`
+     * @param onLines {Function} called with each batch of new log lines
+     * @returns {*} resolves with the deployed app ID and its config
+     */
+    function watchJob(job, onLines) {
+        if (!window.EventSource) {
+            return pollJob(job, null, onLines);
+        }
+
+        var result = $.Deferred();
+        var cursor = 0;
+        var source = new window.EventSource(
+            Jupyter.notebook.base_url + 'rsconnect_jupyter/job_events/' + job.job_id
+        );
+
+        source.addEventListener('job', function (message) {
+            var current = JSON.parse(message.data);
+            onLines(current.lines);
+            cursor = current.cursor;
+            if (isFinished(current)) {
+                source.close();
+                jobOutcome(current).then(result.resolve, result.reject);
+            }
+        });
+        source.onerror = function () {
+            // EventSource retries dropped connections by itself; it only
+            // gives up when the stream can't be opened at all.
+            if (source.readyState === window.EventSource.CLOSED) {
+                debug.info('event stream unavailable, polling deployment instead');
+                pollJob(job, cursor, onLines).then(result.resolve, result.reject);
+            }
+        };
+        return result;
+    }
+
     function RSConnect() {
         /* sample value of `Jupyter.notebook.metadata`:
            { version: 1,
@@ -32,6 +216,11 @@ define([
         this.servers = {};
         this.apiKeys = {};
         this.certificates = {};
+        // IDs of deployments started elsewhere that this page is following
+        this.resumedJobs = {};
+        // the notebook's app and Connect's Python settings, as loaded with the dialog
+        this.savedApp = null;
+        this.pythonSettings = {};
 
         // TODO more rigorous checking?
         var metadata = JSON.parse(JSON.stringify(Jupyter.notebook.metadata));
@@ -58,12 +247,18 @@ define([
         this.verifyServer = this.verifyServer.bind(this);
         this.addServer = this.addServer.bind(this);
         this.fetchConfig = this.fetchConfig.bind(this);
+        this.applyConfig = this.applyConfig.bind(this);
         this.saveConfig = this.saveConfig.bind(this);
         this.getApiKey = this.getApiKey.bind(this);
         this.getApp = this.getApp.bind(this);
+        this.findServerId = this.findServerId.bind(this);
+        this.resumeJobs = this.resumeJobs.bind(this);
+        this.applySavedApp = this.applySavedApp.bind(this);
         this.removeServer = this.removeServer.bind(this);
         this.inspectEnvironment = this.inspectEnvironment.bind(this);
+        this.inspectEnvironmentInKernel = this.inspectEnvironmentInKernel.bind(this);
         this.publishContent = this.publishContent.bind(this);
+        this.publishContentToServers = this.publishContentToServers.bind(this);
         this.getNotebookTitle = this.getNotebookTitle.bind(this);
     }
 
@@ -155,6 +350,9 @@ define([
             var self = this;
             var entry = this.servers[serverId];
 
+            if (this.savedApp && this.savedApp.serverId === serverId && this.savedApp.appId === appId) {
+                return $.Deferred().resolve(this.savedApp.app);
+            }
             return Utils.ajax({
                 url: Jupyter.notebook.base_url + 'rsconnect_jupyter/app_get',
                 method: 'POST',
@@ -193,42 +391,45 @@ define([
         },
 
         fetchConfig: function () {
-            var self = this;
             return Utils.ajax({
                 url: Jupyter.notebook.base_url + 'api/config/rsconnect_jupyter',
                 method: 'GET'
-            }).then(function (data) {
-                if (!self.servers) {
-                    self.servers = {};
-                }
-                var didDelete = false;
-                for (var serverId in data) {
-                    if (!data[serverId].apiKey) {
-                        var deleted = data[serverId];
-                        delete data[serverId];
-                        debug.info('deleted server because it had no API key: ' + JSON.stringify(deleted));
-                        didDelete = true;
-                    } else {
-                        // Split out API keys so they're not saved into the notebook metadata.
-                        var entry = data[serverId];
-                        self.apiKeys[entry.server] = entry.apiKey;
-                        delete entry.apiKey;
-                        self.certificates[entry.server] = entry.cadata;
-                        delete entry.cadata;
-
-                        if (!self.servers[serverId]) {
-                            self.servers[serverId] = entry;
-                        }
+            }).then(this.applyConfig);
+        },
+
+        applyConfig: function (data) {
+            var self = this;
+            if (!self.servers) {
+                self.servers = {};
+            }
+            var didDelete = false;
+            for (var serverId in data) {
+                if (!data[serverId].apiKey) {
+                    var deleted = data[serverId];
+                    delete data[serverId];
+                    debug.info('deleted server because it had no API key: ' + JSON.stringify(deleted));
+                    didDelete = true;
+                } else {
+                    // Split out API keys so they're not saved into the notebook metadata.
+                    var entry = data[serverId];
+                    self.apiKeys[entry.server] = entry.apiKey;
+                    delete entry.apiKey;
+                    self.certificates[entry.server] = entry.cadata;
+                    delete entry.cadata;
+
+                    if (!self.servers[serverId]) {
+                        self.servers[serverId] = entry;
                     }
                 }
-                if (didDelete) {
-                    self.saveConfig().then(self.saveNotebookMetadata);
-                }
-                debug.info('fetched config:', data);
-            });
+            }
+            if (didDelete) {
+                self.saveConfig().then(self.saveNotebookMetadata);
+            }
+            debug.info('fetched config:', data);
         },
 
         updateServer: function (id, appId, notebookTitle, appMode, configUrl) {
+            this.savedApp = null;
             this.servers[id].appId = appId;
             this.servers[id].notebookTitle = notebookTitle;
             this.servers[id].appMode = appMode;
@@ -236,6 +437,58 @@ define([
             return this.saveNotebookMetadata();
         },
 
+        findServerId: function (server) {
+            for (var serverId in this.servers) {
+                if (this.servers[serverId].server === server) {
+                    return serverId;
+                }
+            }
+            return null;
+        },
+
+        /**
+         * resumeJobs records where the notebook was published by deployments
+         * that finished while no page was watching them, e.g. because the tab
+         * was closed or reloaded, and follows those that are still running.
+         * @param jobs {Array} the latest deployment to each server, from `notebook_jobs`
+         * @returns {*} resolves once finished deployments are saved in the notebook metadata
+         */
+        resumeJobs: function (jobs) {
+            var self = this;
+            var saves = jobs.map(function (job) {
+                var serverId = self.findServerId(job.server_address);
+                if (serverId === null || job.state === 'failed' || self.resumedJobs[job.job_id]) {
+                    return $.Deferred().resolve();
+                }
+
+                function record(result) {
+                    var entry = self.servers[serverId];
+                    if (!entry || (entry.appId === result.appId && entry.configUrl === result.config.config_url)) {
+                        return $.Deferred().resolve();
+                    }
+                    debug.info('recording deployment', job.job_id, 'to app', result.appId);
+                    return self.updateServer(
+                        serverId,
+                        result.appId,
+                        job.notebook_title,
+                        job.app_mode,
+                        result.config.config_url
+                    );
+                }
+
+                if (job.state === 'succeeded') {
+                    return jobOutcome(job).then(record);
+                }
+                debug.info('following deployment', job.job_id, 'started before this page loaded');
+                self.resumedJobs[job.job_id] = true;
+                watchJob(job, function () {}).then(record).always(function () {
+                    delete self.resumedJobs[job.job_id];
+                });
+                return $.Deferred().resolve();
+            });
+            return $.when.apply($, saves);
+        },
+
         removeServer: function (id) {
             delete this.servers[id];
             return this.saveConfig().then(this.saveNotebookMetadata);
@@ -266,59 +519,145 @@ define([
         },
 
         inspectEnvironment: function (condaMode, forceGenerate) {
-            return this.getRunningPythonPath().then(function (pythonPath) {
-                try {
-                    var flags = '';
-                    if (condaMode || forceGenerate) {
-                        flags = '-' + (condaMode ? 'c' : '') + (forceGenerate ? 'f' : '');
+            var self = this;
+            var kernel = Jupyter.notebook.kernel;
+            var kernelspec = Jupyter.notebook.metadata.kernelspec;
+            var data = {
+                notebook_path: Utils.encode_uri_components(Jupyter.notebook.notebook_path),
+                kernel_id: kernel ? kernel.id : null,
+                kernel_name: kernelspec ? kernelspec.name : null,
+                conda_mode: Boolean(condaMode),
+                force_generate: Boolean(forceGenerate)
+            };
+
+            // The server runs the inspection itself, so it doesn't wait for
+            // cells running in the kernel.
+            return Utils.ajax({
+                url: Jupyter.notebook.base_url + 'rsconnect_jupyter/inspect_environment',
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                data: JSON.stringify(data)
+            }).then(
+                function (result) {
+                    if (result.environment) {
+                        debug.info('environment:', result.environment);
+                        return result.environment;
                     }
-                    var cmd = [
-                        '!"',
-                        pythonPath,
-                        '" -m rsconnect.environment ' +
-                        flags + ' ""'
-                    ].join('');
-                    console.log('executing: ' + cmd);
-                } catch (e) {
-                    return $.Deferred().reject(e);
+                    // the server can't run the kernel's interpreter, e.g. a remote kernel
+                    return self.inspectEnvironmentInKernel(condaMode, forceGenerate);
+                },
+                function (xhr) {
+                    var message = xhr.responseJSON && xhr.responseJSON.message;
+                    return $.Deferred().reject(message || xhr);
                 }
+            );
+        },
 
-                var result = $.Deferred();
-                var content = '';
-
-                function count(ch, s) {
-                    return s.split(ch).length - 1;
+        inspectEnvironmentInKernel: function (condaMode, forceGenerate) {
+            var self = this;
+            return this.getRunningPythonPath().then(function (pythonPath) {
+                if (forceGenerate) {
+                    return self.runEnvironmentInspection(pythonPath, condaMode, forceGenerate);
                 }
 
-                function handle_output(message) {
-                    content += message.content.text;
-
-                    if (count('{', content) === count('}', content)) {
-                        try {
-                            debug.info('environment:', content);
-                            var parsedContent = JSON.parse(content);
-                            if (parsedContent.error) {
-                                debug.error('environment error:', parsedContent);
-                                result.reject(parsedContent);
-                            } else {
-                                result.resolve(parsedContent);
-                            }
-                        } catch (err) {
-                            debug.info('environment error:', err);
-                            result.reject(content);
+                // reuse the last inspection if the environment hasn't changed since
+                var kernel = Jupyter.notebook.kernel;
+                var kernelspec = Jupyter.notebook.metadata.kernelspec;
+                var data = {
+                    notebook_path: Utils.encode_uri_components(Jupyter.notebook.notebook_path),
+                    kernel_id: kernel ? kernel.id : null,
+                    kernel_name: kernelspec ? kernelspec.name : null,
+                    python: pythonPath,
+                    conda_mode: Boolean(condaMode)
+                };
+                return Utils.ajax({
+                    url: Jupyter.notebook.base_url + 'rsconnect_jupyter/environment_lookup',
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    data: JSON.stringify(data)
+                }).then(
+                    function (cached) {
+                        if (cached.environment) {
+                            debug.info('environment (cached):', cached.environment);
+                            return cached.environment;
                         }
+                        return self
+                            .runEnvironmentInspection(pythonPath, condaMode, false)
+                            .then(function (environment) {
+                                Utils.ajax({
+                                    url: Jupyter.notebook.base_url + 'rsconnect_jupyter/environment_store',
+                                    method: 'POST',
+                                    headers: { 'Content-Type': 'application/json' },
+                                    data: JSON.stringify($.extend({}, data, {
+                                        environment: environment
+                                    }))
+                                });
+                                return environment;
+                            });
+                    },
+                    function () {
+                        return self.runEnvironmentInspection(pythonPath, condaMode, false);
                     }
+                );
+            });
+        },
+
+        runEnvironmentInspection: function (pythonPath, condaMode, forceGenerate) {
+            try {
+                var flags = '';
+                if (condaMode || forceGenerate) {
+                    flags = '-' + (condaMode ? 'c' : '') + (forceGenerate ? 'f' : '');
                 }
+                var cmd = [
+                    '!"',
+                    pythonPath,
+                    '" -m rsconnect.environment ' +
+                    flags + ' ""'
+                ].join('');
+                console.log('executing: ' + cmd);
+            } catch (e) {
+                return $.Deferred().reject(e);
+            }
+
+            var result = $.Deferred();
+            var content = '';
+            var depth = 0;
+
+            function count(ch, s) {
+                return s.split(ch).length - 1;
+            }
+
+            function handle_output(message) {
+                var text = message.content.text;
+                content += text;
+                // only count braces in the new output
+                depth += count('{', text) - count('}', text);
 
-                var callbacks = {
-                    iopub: {
-                        output: handle_output
+                if (depth === 0) {
+                    try {
+                        debug.info('environment:', content);
+                        var parsedContent = JSON.parse(content);
+                        if (parsedContent.error) {
+                            debug.error('environment error:', parsedContent);
+                            result.reject(parsedContent);
+                        } else {
+                            result.resolve(parsedContent);
+                        }
+                    } catch (err) {
+                        debug.info('environment error:', err);
+                        result.reject(content);
                     }
-                };
+                }
+            }
 
-                Jupyter.notebook.kernel.execute(cmd, callbacks);
-                return result;
-            });
+            var callbacks = {
+                iopub: {
+                    output: handle_output
+                }
+            };
+
+            Jupyter.notebook.kernel.execute(cmd, callbacks);
+            return result;
         },
 
         writeManifest: function (notebookTitle, environment) {
@@ -364,78 +703,7 @@ define([
             var $log = $('#rsc-log').attr('hidden', null);
             $log.text('Deploying...\n');
 
-            function getLogs(deployResult) {
-                function inner(lastStatus) {
-                    lastStatus = lastStatus || null;
-                    return Utils.ajax({
-                        url: Jupyter.notebook.base_url + 'rsconnect_jupyter/get_log',
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        data: JSON.stringify({
-                            server_address: entry.server,
-                            api_key: self.getApiKey(entry.server),
-                            task_id: deployResult['task_id'],
-                            last_status: lastStatus,
-                            cookies: deployResult.cookies || [],
-                            disable_tls_check: entry.disableTLSCheck || false,
-                            cadata: self.getCAData(entry.server)
-
-                        })
-                    }).then(function (result) {
-                        if (result['last_status'] !== lastStatus) {
-                            lastStatus = result['lastStatus'];
-                            var output = result['status'].join('\n');
-
-                            var logElem = $log.get(0);
-                            var oldScroll = logElem.scrollTop;
-                            var oldMaxScroll = logElem.scrollHeight - logElem.clientHeight;
-                            $log.text(output);
-
-                            if (oldScroll >= oldMaxScroll - 1) {
-                                // scroll to new bottom position
-                                $log.scrollTop(logElem.scrollHeight);
-                            }
-                        }
-                        if (result['finished']) {
-                            if (result['code'] !== 0) {
-                                var msg = 'Failed to deploy successfully: ' + result['error'];
-                                return $.Deferred().reject({ responseJSON: { message: msg } });
-                            }
-                            debug.info('logs:', result['status'].join('\n'));
-                            return $.Deferred().resolve(deployResult['app_id']);
-                        }
-                        var next = $.Deferred();
-                        setTimeout(function () {
-                            return inner(lastStatus).then(next.resolve);
-                        }, 1000);
-                        return next;
-                    });
-                }
-
-                return inner();
-            }
-
-            function appConfig(receivedAppId) {
-                return Utils.ajax({
-                    url: Jupyter.notebook.base_url + 'rsconnect_jupyter/app_config',
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    data: JSON.stringify({
-                        server_address: entry.server,
-                        api_key: self.getApiKey(entry.server),
-                        app_id: receivedAppId,
-                        disable_tls_check: entry.disableTLSCheck || false,
-                        cadata: self.getCAData(entry.server)
-                    })
-                }).then(function (config) {
-                    return {
-                        appId: receivedAppId,
-                        config: config
-                    };
-                });
-            }
-
-            function deploy(environment) {
+            function deploy(environment, environmentSeconds) {
                 var data = {
                     notebook_path: notebookPath,
                     notebook_title: notebookTitle,
@@ -449,7 +717,8 @@ define([
                     disable_tls_check: entry.disableTLSCheck || false,
                     cadata: self.getCAData(entry.server),
                     hide_all_input: entry.hide_all_input,
-                    hide_tagged_input: entry.hide_tagged_input
+                    hide_tagged_input: entry.hide_tagged_input,
+                    environment_seconds: environmentSeconds
                 };
 
                 var xhr = Utils.ajax({
@@ -457,9 +726,16 @@ define([
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     data: JSON.stringify(data)
-                })
-                    .then(getLogs)
-                    .then(appConfig);
+                }).then(function (job) {
+                    return watchJob(job, function (lines) {
+                        appendLog($log, lines);
+                    }).then(function (result) {
+                        if (SHOW_TIMINGS && result.timings) {
+                            appendLog($log, [formatTimings(result.timings)]);
+                        }
+                        return result;
+                    });
+                });
 
                 // update server with title and appId and set recently selected
                 // server
@@ -478,13 +754,131 @@ define([
             }
 
             if (appMode === 'jupyter-static' || appMode === 'jupyter-voila') {
-                return this.inspectEnvironment(condaMode, forceGenerate).then(deploy);
+                var inspectionStarted = Date.now();
+                return this.inspectEnvironment(condaMode, forceGenerate).then(function (environment) {
+                    return deploy(environment, (Date.now() - inspectionStarted) / 1000);
+                });
             } else {
-                return deploy(null);
+                return deploy(null, null);
             }
         },
 
-        appSearch: function (serverId, notebookTitle, appId) {
+        /**
+         * publishContentToServers deploys the notebook to several servers at once. The
+         * bundle is built once on the notebook server, then deployed to each server
+         * concurrently, each to the location it was last published to there (or a new one).
+         * @param serverIds {Array<string>} the server identifiers; the first one's
+         *        hide input options apply to all
+         * @param notebookTitle {string} Title of the notebook to be passed as name/title
+         * @param appMode {'static'|'jupyter-static'|'jupyter-voila'} App mode to deploy.
+         * @param files {Array<String>} paths to files to deploy.
+         * @param condaMode {boolean} whether or not to use conda to build an `environment.yml`.
+         * @param forceGenerate {boolean} whether to force `requirements.txt` to be generated even if one exists.
+         * @returns {*} resolves, once every deployment has finished, with one
+         *          `{serverId, appId, config}` or `{serverId, error}` per server
+         */
+        publishContentToServers: function (serverIds, notebookTitle, appMode, files, condaMode, forceGenerate) {
+            var self = this;
+            var primary = this.servers[serverIds[0]];
+
+            var $log = $('#rsc-log').attr('hidden', null);
+            $log.text('Deploying to ' + serverIds.length + ' servers...\n');
+
+            function deploy(environment, environmentSeconds) {
+                var targets = serverIds.map(function (serverId) {
+                    var entry = self.servers[serverId];
+                    return {
+                        server_address: entry.server,
+                        api_key: self.getApiKey(entry.server),
+                        disable_tls_check: entry.disableTLSCheck || false,
+                        cadata: self.getCAData(entry.server),
+                        app_id: entry.notebookTitle === notebookTitle ? entry.appId : null
+                    };
+                });
+
+                return Utils.ajax({
+                    url: Jupyter.notebook.base_url + 'rsconnect_jupyter/deploy_many',
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    data: JSON.stringify({
+                        notebook_path: Utils.encode_uri_components(Jupyter.notebook.notebook_path),
+                        notebook_title: notebookTitle,
+                        notebook_name: self.getNotebookName(notebookTitle),
+                        app_mode: appMode,
+                        environment: environment,
+                        files: files,
+                        hide_all_input: primary.hide_all_input,
+                        hide_tagged_input: primary.hide_tagged_input,
+                        environment_seconds: environmentSeconds,
+                        targets: targets
+                    })
+                }).then(function (response) {
+                    var outcomes = response.jobs.map(function (job, index) {
+                        var serverId = serverIds[index];
+                        var prefix = '[' + self.servers[serverId].serverName + '] ';
+                        var outcome = $.Deferred();
+
+                        // one server failing doesn't stop the others
+                        watchJob(job, function (lines) {
+                            appendLog($log, lines.map(function (line) {
+                                return prefix + line;
+                            }));
+                        }).then(
+                            function (result) {
+                                appendLog($log, [prefix + 'Published to ' + result.config.config_url]);
+                                if (SHOW_TIMINGS && result.timings) {
+                                    appendLog($log, [prefix + formatTimings(result.timings)]);
+                                }
+                                self.updateServer(
+                                    serverId,
+                                    result.appId,
+                                    notebookTitle,
+                                    appMode,
+                                    result.config.config_url
+                                );
+                                outcome.resolve({
+                                    serverId: serverId,
+                                    appId: result.appId,
+                                    config: result.config
+                                });
+                            },
+                            function (xhr) {
+                                var error = (xhr.responseJSON && xhr.responseJSON.message) || 'Failed to deploy';
+                                appendLog($log, [prefix + 'Failed: ' + error]);
+                                outcome.resolve({
+                                    serverId: serverId,
+                                    error: error
+                                });
+                            }
+                        );
+                        return outcome;
+                    });
+                    return $.when.apply($, outcomes).then(function () {
+                        self.previousServerId = serverIds[0];
+                        return [].slice.call(arguments);
+                    });
+                });
+            }
+
+            if (appMode === 'jupyter-static' || appMode === 'jupyter-voila') {
+                var inspectionStarted = Date.now();
+                return this.inspectEnvironment(condaMode, forceGenerate).then(function (environment) {
+                    return deploy(environment, (Date.now() - inspectionStarted) / 1000);
+                });
+            } else {
+                return deploy(null, null);
+            }
+        },
+
+        /**
+         * appSearch finds existing content to publish over, one page at a time.
+         * @param serverId {String} the server to search
+         * @param notebookTitle {String} the title to search for
+         * @param appId {Number} the current deployment location, listed first
+         * @param start {Number} the offset of the page, 0 by default
+         * @returns {*} resolves with `applications` and the `total` number of matches
+         */
+        appSearch: function (serverId, notebookTitle, appId, start) {
             var self = this;
             var entry = this.servers[serverId];
 
@@ -495,6 +889,8 @@ define([
                 data: JSON.stringify({
                     notebook_title: notebookTitle,
                     app_id: appId,
+                    start: start || 0,
+                    count: SEARCH_PAGE_SIZE,
                     server_address: entry.server,
                     api_key: self.getApiKey(entry.server),
                     disable_tls_check: entry.disableTLSCheck || false,
@@ -541,9 +937,145 @@ define([
                 });
         },
 
-        getPythonSettings: function () {
+        /**
+         * batch runs several server extension actions in one request.
+         * @param actions {Array} `{action: ..., data: {...}}` objects
+         * @param shared {Object} fields, such as credentials, sent once and used by every action
+         * @returns {*} resolves with one `{status, result}` or `{status, message}` per action
+         */
+        batch: function (actions, shared) {
+            return Utils.ajax({
+                url: Jupyter.notebook.base_url + 'rsconnect_jupyter/batch',
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                data: JSON.stringify($.extend({}, shared, { actions: actions }))
+            });
+        },
+
+        /**
+         * load fetches the saved servers, the version info, the notebook's
+         * latest deployments and, if the notebook was published before, its
+         * app and that server's Python settings in one request, falling back
+         * to separate requests if the server extension predates `batch`.
+         * @returns {*} resolves with the version info
+         */
+        load: function () {
+            var self = this;
+
+            function separately() {
+                return self.fetchConfig().then(function () {
+                    return self.getVersionInfo();
+                });
+            }
+
+            var actions = [
+                { action: 'config' },
+                { action: 'plugin_version' },
+                { action: 'js_version' },
+                {
+                    action: 'notebook_jobs',
+                    data: { notebook_path: Utils.encode_uri_components(Jupyter.notebook.notebook_path) }
+                }
+            ];
+            // the servers without API keys were dropped from the metadata
+            // copy, so look up where the notebook was published in the original
+            var metadata = Jupyter.notebook.metadata.rsconnect;
+            var previousServerId = metadata && metadata.servers && metadata.previousServerId;
+            var saved = previousServerId && metadata.servers[previousServerId];
+            if (saved) {
+                // the server extension fills in the credentials saved for server_id
+                actions.push({ action: 'get_python_settings', data: { server_id: previousServerId } });
+                if (saved.appId) {
+                    var savedApp = { server_id: previousServerId, app_id: saved.appId };
+                    actions.push({ action: 'app_get', data: savedApp }, { action: 'app_config', data: savedApp });
+                }
+            }
+            return this.batch(actions).then(
+                function (results) {
+                    var succeeded = Array.isArray(results) && results.slice(0, 3).every(function (result) {
+                        return result.status === 200;
+                    });
+                    if (!succeeded) {
+                        return separately();
+                    }
+                    self.applyConfig(results[0].result);
+                    var versionInfo = results[1].result;
+                    versionInfo.js_version = results[2].result.version;
+                    if (saved) {
+                        self.applySavedApp(previousServerId, saved, results[4], results[5], results[6]);
+                    }
+                    if (results[3].status !== 200) {
+                        return versionInfo;
+                    }
+                    return self.resumeJobs(results[3].result.jobs).then(function () {
+                        return versionInfo;
+                    });
+                },
+                separately
+            );
+        },
+
+        /**
+         * applySavedApp restores where the notebook was published, from its
+         * metadata, if that server is still saved and the app still exists.
+         * @param serverId {String} the notebook's previous server
+         * @param saved {Object} the notebook metadata for that server
+         * @param pythonSettings {Object} the batched `get_python_settings` result
+         * @param app {Object} the batched `app_get` result, if the notebook has an app
+         * @param appConfig {Object} the batched `app_config` result, if the notebook has an app
+         */
+        applySavedApp: function (serverId, saved, pythonSettings, app, appConfig) {
+            this.savedApp = null;
+            var entry = this.servers[serverId];
+            if (!entry) {
+                return;
+            }
+            if (pythonSettings.status === 200) {
+                this.pythonSettings[serverId] = pythonSettings.result;
+            }
+            if (!app || app.status !== 200 || app.result.error) {
+                return;
+            }
+            this.savedApp = { serverId: serverId, appId: saved.appId, app: app.result };
+            if (!entry.appId) {
+                entry.appId = saved.appId;
+                entry.notebookTitle = saved.notebookTitle;
+                entry.appMode = saved.appMode;
+            }
+            if (entry.appId === saved.appId && appConfig.status === 200) {
+                entry.configUrl = appConfig.result.config_url;
+            }
+            if (this.previousServerId === null) {
+                this.previousServerId = serverId;
+            }
+        },
+
+        /**
+         * getPythonSettings fetches the Python versions Connect has, using
+         * those loaded with the dialog if there are any.
+         * @param serverId {String} the server to ask
+         * @returns {*} resolves with Connect's Python settings
+         */
+        getPythonSettings: function (serverId) {
+            var self = this;
+            var entry = this.servers[serverId];
+
+            if (serverId in this.pythonSettings) {
+                return $.Deferred().resolve(this.pythonSettings[serverId]);
+            }
             return Utils.ajax({
-                url: Jupyter.notebook.base_url + 'rsconnect_jupyter/get_python_settings'
+                url: Jupyter.notebook.base_url + 'rsconnect_jupyter/get_python_settings',
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                data: JSON.stringify({
+                    server_address: entry.server,
+                    api_key: self.getApiKey(entry.server),
+                    disable_tls_check: entry.disableTLSCheck || false,
+                    cadata: self.getCAData(entry.server)
+                })
+            }).then(function (settings) {
+                self.pythonSettings[serverId] = settings;
+                return settings;
             });
         }
     };
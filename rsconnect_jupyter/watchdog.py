@@ -0,0 +1,152 @@
+import logging
+import sys
+import threading
+import time
+import traceback
+from types import FrameType
+from typing import Dict, Optional
+
+from tornado.ioloop import IOLoop
+
+from rsconnect_jupyter.metrics import IOLOOP_LAG, IOLOOP_STALL_DURATION
+
+# The EndpointHandler method that runs every action; its `action` local names
+# the action that is blocking the IOLoop.
+ACTION_FRAME = "call_action"
+
+# Reported for stalls outside rsconnect_jupyter's actions, and for stalls
+# that ended before the watchdog thread could sample them.
+UNKNOWN_ACTION = "unknown"
+
+# The innermost frames of a sampled stack that are logged.
+STACK_LIMIT = 40
+
+
+def blocking_action(frame: Optional[FrameType]) -> str:
+    """
+    :return: the action running in `frame` or its callers, the innermost
+    one for a batch.
+    """
+    while frame is not None:
+        if frame.f_code.co_name == ACTION_FRAME:
+            action = frame.f_locals.get("action")
+            if isinstance(action, str):
+                return action
+        frame = frame.f_back
+    return UNKNOWN_ACTION
+
+
+class LoopWatchdog(object):
+    """
+    Detects when something blocks the notebook server's IOLoop.
+
+    A callback on the IOLoop runs every `interval` seconds and records how
+    late it ran. A watchdog thread looks at when the callback last ran; once
+    the IOLoop has been blocked for more than `threshold` seconds it samples
+    the IOLoop thread's stack and logs it, with the action that was running,
+    so the blocking call can be found even if it never returns. When the
+    IOLoop recovers, the stall is counted against that action.
+    """
+
+    def __init__(self, interval: float, threshold: float, log: Optional[logging.Logger] = None):
+        """
+        :param interval: seconds between lag measurements.
+        :param threshold: seconds of lag that count as a stall.
+        :param log: where stalls are logged.
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.log = log or logging.getLogger(__name__)
+        self._io_loop: Optional[IOLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = 0.0
+        self._timeout = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # (heartbeat, action) of the stall the watchdog thread last sampled
+        self._sampled = (None, UNKNOWN_ACTION)
+        self._lock = threading.Lock()
+        self._samples = 0
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        self._stalls: Dict[str, dict] = {}
+
+    def start(self):
+        """
+        Starts watching the current IOLoop. Must be called on the IOLoop's thread.
+        """
+        self._io_loop = IOLoop.current()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._timeout = self._io_loop.call_later(self.interval, self._tick)
+        self._thread = threading.Thread(target=self._watch, name="rsconnect_jupyter-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._timeout is not None:
+            self._io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _tick(self):
+        now = time.monotonic()
+        lag = max(now - self._heartbeat - self.interval, 0.0)
+        previous = self._heartbeat
+        self._heartbeat = now
+        self._timeout = self._io_loop.call_later(self.interval, self._tick)
+
+        IOLOOP_LAG.observe(lag)
+        with self._lock:
+            self._samples += 1
+            self._last_lag = lag
+            self._max_lag = max(self._max_lag, lag)
+        if lag > self.threshold:
+            heartbeat, action = self._sampled
+            if heartbeat != previous:
+                action = UNKNOWN_ACTION
+            self._record_stall(action, lag)
+
+    def _record_stall(self, action: str, seconds: float):
+        IOLOOP_STALL_DURATION.labels(action).observe(seconds)
+        with self._lock:
+            stalls = self._stalls.setdefault(action, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stalls["count"] += 1
+            stalls["seconds"] += seconds
+            stalls["max_seconds"] = max(stalls["max_seconds"], seconds)
+        self.log.warning("rsconnect_jupyter: the IOLoop was blocked for %.3fs by %s", seconds, action)
+
+    def _watch(self):
+        # check often enough to catch stalls not much longer than the threshold
+        period = min(self.interval, self.threshold / 2)
+        while not self._stopped.wait(period):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked > self.threshold and self._sampled[0] != heartbeat:
+                self._sample(heartbeat, blocked)
+
+    def _sample(self, heartbeat: float, blocked: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        action = blocking_action(frame)
+        self._sampled = (heartbeat, action)
+        stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT)) if frame is not None else ""
+        del frame
+        self.log.warning(
+            "rsconnect_jupyter: the IOLoop has been blocked for more than %.3fs by %s, in:\n%s",
+            blocked,
+            action,
+            stack,
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "interval": self.interval,
+                "threshold": self.threshold,
+                "samples": self._samples,
+                "last_lag": self._last_lag,
+                "max_lag": self._max_lag,
+                "stalls": {action: dict(stalls) for action, stalls in self._stalls.items()},
+            }
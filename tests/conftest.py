@@ -0,0 +1,61 @@
+import asyncio
+import threading
+
+import pytest
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+
+import mock_connect
+from rsconnect_jupyter.extension import RSConnectJupyter
+
+
+@pytest.fixture(scope="session")
+def connect_server():
+    """
+    A mock_connect instance served on an ephemeral local port. Tornado serves
+    it rather than werkzeug so that HTTP/1.1 keep-alive works as it does with
+    a real Connect server, and bundle uploads are streamed to disk.
+    """
+    sockets = bind_sockets(0, "127.0.0.1")
+    port = sockets[0].getsockname()[1]
+    started = threading.Event()
+    loops = []
+
+    def serve():
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        server = HTTPServer(mock_connect.tornado_app())
+        server.add_sockets(sockets)
+        loops.append(IOLoop.current())
+        started.set()
+        IOLoop.current().start()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    started.wait()
+    yield "http://127.0.0.1:%d/" % port
+    loops[0].add_callback(loops[0].stop)
+
+
+@pytest.fixture
+def api_key():
+    return next(iter(mock_connect.api_keys))
+
+
+@pytest.fixture
+def make_extension():
+    """
+    Creates RSConnectJupyter instances that build bundles in-process and
+    don't cache them unless the test configures otherwise, and shuts them
+    down after the test.
+    """
+    extensions = []
+
+    def make(**config):
+        extension = RSConnectJupyter(**dict({"bundle_workers": 0, "bundle_cache_size": 0}, **config))
+        extensions.append(extension)
+        return extension
+
+    yield make
+    for extension in extensions:
+        extension.shutdown()
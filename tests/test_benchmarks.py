@@ -0,0 +1,63 @@
+import copy
+
+import pytest
+
+from benchmarks.deploy import QUICK_MATRIX, compare, main, percentile, run_benchmark
+from benchmarks.load import ACTIONS, run_load_test, saturation
+
+
+def test_percentile():
+    assert percentile([3.0], 99) == 3.0
+    assert percentile([4.0, 1.0, 3.0, 2.0], 50) == 2.5
+    assert percentile([1.0, 2.0, 3.0, 4.0, 5.0], 90) == 4.6
+
+
+def test_quick_benchmark_reports_and_compares():
+    results = run_benchmark(QUICK_MATRIX, iterations=2, warmup=0)
+    (case,) = results["cases"]
+    assert "error" not in case, case.get("error")
+    assert case["name"] == "jupyter-static/small/text/files-none"
+    assert 0 < case["latency"]["p50"] <= case["latency"]["max"]
+    assert set(case["phases"]) >= {"environment", "build", "upload", "task", "config", "total"}
+    assert case["peak_rss_bytes"] > 0
+    assert case["throughput"]["deploys_per_second"] > 0
+    assert compare(results, results, 0.25) == []
+
+    faster = copy.deepcopy(results)
+    faster["cases"][0]["latency"]["p50"] /= 2
+    (regression,) = compare(results, faster, 0.25)
+    assert regression.startswith("jupyter-static/small/text/files-none: p50 latency")
+
+
+def test_load_test_reports_each_level():
+    levels = run_load_test([1, 2], poll_interval=0.05, bundle_workers=0)
+    assert [level["users"] for level in levels] == [1, 2]
+    for level in levels:
+        assert level["failed_publishes"] == 0
+        assert level["error_rate"] == 0.0
+        assert level["loop_lag"]["max"] >= 0
+        assert set(level["actions"]) == set(ACTIONS)
+        assert level["actions"]["deploy"]["status_codes"] == {"200": level["users"]}
+
+
+def test_saturation():
+    def level(users, rate, error_rate=0.0, lag=0.001):
+        return {
+            "users": users,
+            "publishes_per_second": rate,
+            "error_rate": error_rate,
+            "loop_lag": {"p99": lag},
+        }
+
+    assert saturation([level(1, 1.0), level(2, 1.9)], 0.01, 0.1, 0.1) is None
+    assert saturation([level(1, 1.0), level(2, 1.05)], 0.01, 0.1, 0.1)["users"] == 2
+    assert saturation([level(1, 1.0), level(2, 2.0, error_rate=0.5)], 0.01, 0.1, 0.1)["users"] == 2
+    saturated = saturation([level(1, 1.0, lag=0.5)], 0.01, 0.1, 0.1)
+    assert saturated == {"users": 1, "reasons": ["IOLoop lag p99 was 500 ms"]}
+
+
+def test_missing_baseline_fails(tmp_path, capsys):
+    with pytest.raises(SystemExit) as exc_info:
+        main(["--quick", "--baseline", str(tmp_path / "baseline.json")])
+    assert exc_info.value.code != 0
+    assert "no baseline" in capsys.readouterr().err
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import os
+import sys
+import tarfile
+
+import nbformat
+import pytest
+
+from rsconnect_jupyter.bundles import BundleBuilder, BundleBuildError, BundleCache, build_bundle, bundle_key
+from rsconnect_jupyter.executor import BoundedExecutor
+
+ENVIRONMENT = {
+    "conda": None,
+    "contents": "six==1.16.0\n",
+    "error": None,
+    "filename": "requirements.txt",
+    "locale": "en_US.UTF-8",
+    "package_manager": "pip",
+    "pip": "23.0",
+    "python": "3.8.10",
+    "source": "file",
+}
+
+
+@pytest.fixture
+def notebook(tmp_path):
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_code_cell("print('hello')"))
+    path = tmp_path / "hello.ipynb"
+    nbformat.write(nb, str(path))
+    (tmp_path / "data.csv").write_text("a,b\n1,2\n")
+    return str(path)
+
+
+@pytest.fixture
+def executor():
+    executor = BoundedExecutor(max_workers=1, max_pending=1)
+    yield executor
+    executor.shutdown()
+
+
+def read_manifest(path):
+    with tarfile.open(path, "r:gz") as tar:
+        return json.loads(tar.extractfile("manifest.json").read().decode("utf-8")), tar.getnames()
+
+
+def test_build_bundle_writes_spooled_file(notebook, tmp_path):
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    path = build_bundle(
+        "jupyter-static", notebook, sys.executable, ENVIRONMENT, ["data.csv"], False, False, str(spool_dir)
+    )
+    assert os.path.dirname(path) == str(spool_dir)
+    manifest, names = read_manifest(path)
+    assert manifest["metadata"]["appmode"] == "jupyter-static"
+    assert sorted(names) == ["data.csv", "hello.ipynb", "manifest.json", "requirements.txt"]
+
+
+def test_build_bundle_renders_static_html(notebook, tmp_path):
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    # a tiny threshold spills the rendered HTML to disk before it is bundled
+    timings = {}
+    path = build_bundle(
+        "static", notebook, sys.executable, None, [], True, False, str(spool_dir), spool_threshold=1024, timings=timings
+    )
+    manifest, names = read_manifest(path)
+    assert manifest["metadata"]["primary_html"] == "hello.html"
+    assert sorted(names) == ["hello.html", "manifest.json"]
+    with tarfile.open(path, "r:gz") as tar:
+        assert b"hello" in tar.extractfile("hello.html").read()
+    assert os.listdir(str(spool_dir)) == [os.path.basename(path)]
+    assert timings["rendered_bytes"] > 1024
+    assert 0 < timings["render_seconds"] <= timings["worker_seconds"]
+
+
+def test_build_bundle_rejects_unknown_app_mode(notebook, tmp_path):
+    with pytest.raises(BundleBuildError):
+        build_bundle("shiny", notebook, sys.executable, None, [], False, False, str(tmp_path))
+    # the partially written bundle is removed
+    assert sorted(os.listdir(str(tmp_path))) == ["data.csv", "hello.ipynb"]
+
+
+def test_builder_without_workers_uses_executor(notebook, tmp_path, executor):
+    builder = BundleBuilder(executor, 0, spool_dir=str(tmp_path))
+    path = asyncio.run(builder.build("jupyter-static", notebook, sys.executable, ENVIRONMENT, []))
+    assert executor.stats()["completed"] == 1
+    manifest, _ = read_manifest(path)
+    assert manifest["metadata"]["entrypoint"] == "hello.ipynb"
+
+
+def test_builder_with_worker_process(notebook, tmp_path, executor):
+    builder = BundleBuilder(executor, 1, timeout=60, spool_dir=str(tmp_path))
+    try:
+        path = asyncio.run(builder.build("jupyter-static", notebook, sys.executable, ENVIRONMENT, ["data.csv"]))
+    finally:
+        builder.shutdown()
+    assert executor.stats()["completed"] == 0
+    _, names = read_manifest(path)
+    assert "data.csv" in names
+
+
+def test_build_bundle_is_reproducible(notebook, tmp_path):
+    paths = [
+        build_bundle("jupyter-static", notebook, sys.executable, ENVIRONMENT, ["data.csv"], False, False, str(tmp_path))
+        for _ in range(2)
+    ]
+    with open(paths[0], "rb") as first, open(paths[1], "rb") as second:
+        assert first.read() == second.read()
+    _, names = read_manifest(paths[0])
+    assert names == ["manifest.json", "data.csv", "hello.ipynb", "requirements.txt"]
+
+
+def test_builder_reuses_cached_bundle(notebook, tmp_path, executor):
+    cache = BundleCache(str(tmp_path / "cache"), 1024 * 1024)
+    builder = BundleBuilder(executor, 0, cache=cache)
+    first = asyncio.run(builder.build("jupyter-static", notebook, sys.executable, ENVIRONMENT, []))
+    builder.release(first)
+    second = asyncio.run(builder.build("jupyter-static", notebook, sys.executable, ENVIRONMENT, []))
+    builder.release(second)
+    assert first == second
+    assert cache.stats()["hits"] == 1
+
+    # changing the notebook changes the key
+    with open(notebook, "a") as f:
+        f.write("\n")
+    third = asyncio.run(builder.build("jupyter-static", notebook, sys.executable, ENVIRONMENT, []))
+    assert third != first
+    assert os.path.exists(third)
+
+
+def add_entry(cache, key, size):
+    path = os.path.join(cache.directory, "spool")
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    return cache.add(key, path)
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = BundleCache(str(tmp_path), 250)
+    keys = [str(n) * 64 for n in range(3)]
+    for key in keys[:2]:
+        cache.release(add_entry(cache, key, 100))
+    cache.release(cache.acquire(keys[0]))
+    cache.release(add_entry(cache, keys[2], 100))
+
+    assert cache.acquire(keys[1]) is None
+    assert cache.acquire(keys[0]) is not None
+    assert cache.stats()["evictions"] == 1
+    # the cache survives a restart
+    assert BundleCache(str(tmp_path), 250).stats()["bundles"] == 2
+
+
+def test_cache_keeps_bundles_in_use(tmp_path):
+    cache = BundleCache(str(tmp_path), 50)
+    path = add_entry(cache, "a" * 64, 100)
+    assert os.path.exists(path)
+    cache.release(path)
+    assert not os.path.exists(path)
+
+
+def test_voila_bundle_does_not_depend_on_working_directory(notebook, tmp_path, monkeypatch):
+    elsewhere = tmp_path / "elsewhere"
+    elsewhere.mkdir()
+    monkeypatch.chdir(elsewhere)
+    path = build_bundle(
+        "jupyter-voila", notebook, sys.executable, ENVIRONMENT, ["data.csv"], False, False, str(tmp_path)
+    )
+
+    assert os.getcwd() == str(elsewhere)
+    manifest, names = read_manifest(path)
+    assert manifest["metadata"]["appmode"] == "jupyter-voila"
+    assert sorted(names) == ["data.csv", "hello.ipynb", "manifest.json", "requirements.txt"]
+
+
+def test_voila_key_covers_voila_json(notebook, tmp_path):
+    def key(app_mode):
+        return bundle_key(app_mode, notebook, sys.executable, ENVIRONMENT, ["data.csv"], False, False)
+
+    without = key("jupyter-voila")
+    (tmp_path / "voila.json").write_text('{"VoilaConfiguration": {"theme": "dark"}}')
+    path = build_bundle(
+        "jupyter-voila", notebook, sys.executable, ENVIRONMENT, ["data.csv"], False, False, str(tmp_path)
+    )
+    assert "voila.json" in read_manifest(path)[1]
+    dark = key("jupyter-voila")
+    assert dark != without
+
+    (tmp_path / "voila.json").write_text('{"VoilaConfiguration": {"theme": "light"}}')
+    assert key("jupyter-voila") != dark
+    # other app modes don't bundle it
+    static_key = key("jupyter-static")
+    (tmp_path / "voila.json").write_text("{}")
+    assert key("jupyter-static") == static_key
+
+
+def test_voila_bundle_keeps_nested_files_named_like_generated_ones(notebook, tmp_path):
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "requirements.txt").write_text("pinned==1.0\n")
+    path = build_bundle(
+        "jupyter-voila", notebook, sys.executable, ENVIRONMENT, ["data/requirements.txt"], False, False, str(tmp_path)
+    )
+    manifest, names = read_manifest(path)
+    assert sorted(names) == ["data/requirements.txt", "hello.ipynb", "manifest.json", "requirements.txt"]
+    with tarfile.open(path, "r:gz") as tar:
+        assert tar.extractfile("data/requirements.txt").read() == b"pinned==1.0\n"
+        assert tar.extractfile("requirements.txt").read() == b"six==1.16.0\n"
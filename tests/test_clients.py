@@ -0,0 +1,226 @@
+import http.client
+import inspect
+import socket
+import threading
+import time
+
+import pytest
+from rsconnect.api import RSConnectException, RSConnectServer
+from rsconnect.http_support import CookieJar, HTTPServer
+
+from rsconnect_jupyter.clients import (
+    ApiKeyError,
+    ClientPool,
+    PooledClient,
+    VerificationCache,
+    client_key,
+    server_check_list,
+    verify_api_key,
+    verify_server,
+)
+
+
+@pytest.fixture
+def pool():
+    pool = ClientPool(max_size=2, idle_timeout=60)
+    yield pool
+    pool.close()
+
+
+def test_client_key_hashes_secrets():
+    key = client_key("https://connect.example.com/", "secret", 1, "-----BEGIN CERTIFICATE-----")
+    assert key[0] == "https://connect.example.com/"
+    assert "secret" not in key
+    assert key[2] is True
+    assert client_key("https://connect.example.com/", "secret", False, None)[3] is None
+
+
+def test_server_check_list():
+    assert server_check_list("connect.example.com") == ["https://connect.example.com", "http://connect.example.com"]
+    assert server_check_list("//connect.example.com") == ["https://connect.example.com", "http://connect.example.com"]
+    assert server_check_list("http://connect.example.com") == ["http://connect.example.com"]
+
+
+def test_rsconnect_internals_are_unchanged(connect_server, api_key):
+    # PooledClient overrides or uses these private parts of rsconnect-python's
+    # HTTPServer; a new rsconnect-python release must keep them as they are.
+    parameters = list(inspect.signature(HTTPServer._do_request).parameters)
+    assert parameters == [
+        "self",
+        "method",
+        "path",
+        "query_params",
+        "body",
+        "maximum_redirects",
+        "extra_headers",
+        "decode_response",
+    ]
+    assert list(inspect.signature(HTTPServer._tweak_response).parameters) == ["self", "response"]
+    assert list(inspect.signature(HTTPServer._inject_cookies).parameters) == ["self"]
+
+    client = PooledClient(RSConnectServer(connect_server, api_key))
+    try:
+        assert isinstance(client._headers, dict)
+        assert isinstance(client._cookies, CookieJar)
+        assert isinstance(client._conn, http.client.HTTPConnection)
+        assert client._conn.blocksize > 0
+    finally:
+        client.close()
+
+
+def test_clients_are_reused(pool, connect_server, api_key):
+    with pool.client(connect_server, api_key) as first:
+        assert first.me()["username"] == "admin"
+    with pool.client(connect_server, api_key) as second:
+        assert second.me()["username"] == "admin"
+    assert first is second
+    stats = pool.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["idle"] == 1
+
+
+def test_cookies_are_not_kept_after_checkin(pool, connect_server, api_key):
+    session = {"keys": ["session"], "content": {"session": "abc"}}
+    with pool.client(connect_server, api_key, cookies=session) as first:
+        assert first.cookies() == session
+        assert first._headers["Cookie"] == "session=abc"
+    with pool.client(connect_server, api_key) as second:
+        assert second is first
+        assert second.cookies() == {"keys": [], "content": {}}
+        assert "Cookie" not in second._headers
+
+
+def test_failed_clients_are_discarded(pool, connect_server, api_key):
+    with pytest.raises(ValueError):
+        with pool.client(connect_server, api_key):
+            raise ValueError()
+    assert pool.stats()["idle"] == 0
+
+
+def test_least_recently_used_clients_are_evicted(pool, connect_server, api_key):
+    with pool.client(connect_server, api_key, cadata="a"), pool.client(connect_server, api_key, cadata="b"):
+        with pool.client(connect_server, api_key, cadata="c"):
+            pass
+    stats = pool.stats()
+    assert stats["idle"] == 2
+    assert stats["evictions"] == 1
+
+
+def test_idle_clients_expire(connect_server, api_key):
+    pool = ClientPool(max_size=2, idle_timeout=0)
+    with pool.client(connect_server, api_key):
+        pass
+    pool.prune()
+    assert pool.stats()["idle"] == 0
+    assert pool.stats()["evictions"] == 1
+
+
+def test_stale_connections_are_retried(pool, connect_server, api_key):
+    with pool.client(connect_server, api_key) as client:
+        client.me()
+        # simulate the server dropping the kept-alive connection
+        client._conn.sock.shutdown(socket.SHUT_RDWR)
+        assert client.me()["username"] == "admin"
+
+
+def test_dropped_connections_are_reopened_before_posts(pool, connect_server, api_key):
+    with pool.client(connect_server, api_key) as client:
+        client.me()
+        client._conn.sock.shutdown(socket.SHUT_RDWR)
+        assert client.app_create("reopened")["name"] == "reopened"
+
+
+class DroppingServer(object):
+    """
+    Answers the first request on each connection and closes the connection
+    on reading the second, as a server that fails mid-request would.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self._listener = socket.socket()
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen(4)
+        self.url = "http://127.0.0.1:%d/" % self._listener.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._listener.accept()
+            except OSError:
+                return
+            with conn, conn.makefile("rb") as stream:
+                for answered in range(2):
+                    request_line = stream.readline().decode("latin-1").strip()
+                    if not request_line:
+                        break
+                    self.requests.append(request_line)
+                    length = 0
+                    for line in iter(stream.readline, b"\r\n"):
+                        name, _, value = line.decode("latin-1").partition(":")
+                        if name.lower() == "content-length":
+                            length = int(value)
+                    stream.read(length)
+                    if answered == 0:
+                        body = b'{"username": "admin"}'
+                        conn.sendall(
+                            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s"
+                            % (len(body), body)
+                        )
+
+    def close(self):
+        self._listener.close()
+
+
+@pytest.fixture
+def dropping_server():
+    server = DroppingServer()
+    yield server
+    server.close()
+
+
+def test_posts_are_not_retried(pool, dropping_server):
+    with pytest.raises(RSConnectException):
+        with pool.client(dropping_server.url, "key") as client:
+            client.me()
+            client.handle_bad_response(client.app_create("once"))
+    assert [line.split()[0] for line in dropping_server.requests] == ["GET", "POST"]
+
+
+def test_gets_are_retried(pool, dropping_server):
+    with pool.client(dropping_server.url, "key") as client:
+        client.me()
+        assert client.me()["username"] == "admin"
+    assert [line.split()[0] for line in dropping_server.requests] == ["GET", "GET", "GET"]
+
+
+def test_verify_server(pool, connect_server, api_key):
+    canonical, username = verify_server(pool, connect_server, api_key, False, None)
+    assert canonical == connect_server
+    assert username == "admin"
+    # both checks share one connection
+    assert pool.stats()["misses"] == 1
+
+    with pytest.raises(ApiKeyError):
+        verify_server(pool, connect_server, "not-a-key", False, None)
+    with pytest.raises(RSConnectException):
+        verify_server(pool, "http://127.0.0.1:1/", api_key, False, None)
+
+
+def test_verification_cache_expires():
+    cache = VerificationCache(ttl=0.05)
+    cache.put("https://connect.example.com/", "secret", False, None, {"server_address": "x"})
+    assert cache.get("https://connect.example.com/", "secret", False, None) == {"server_address": "x"}
+    assert cache.get("https://connect.example.com/", "other", False, None) is None
+    time.sleep(0.1)
+    assert cache.get("https://connect.example.com/", "secret", False, None) is None
+
+
+def test_verify_api_key(pool, connect_server, api_key):
+    with pool.client(connect_server, api_key) as client:
+        assert verify_api_key(client) == "admin"
+    with pytest.raises(RSConnectException):
+        with pool.client(connect_server, "not-a-key") as client:
+            verify_api_key(client)
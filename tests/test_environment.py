@@ -0,0 +1,121 @@
+import os
+import sys
+
+import pytest
+from jupyter_client.kernelspec import KernelSpec, NoSuchKernel
+
+from rsconnect_jupyter.environment import (
+    EnvironmentCache,
+    EnvironmentInspectionError,
+    environment_fingerprint,
+    inspect_environment,
+    kernel_env,
+    kernel_python,
+    kernel_spec,
+)
+
+
+class KernelSpecs(object):
+    def __init__(self, **specs):
+        self.specs = specs
+
+    def get_kernel_spec(self, name):
+        if name not in self.specs:
+            raise NoSuchKernel(name)
+        return self.specs[name]
+
+
+def test_fingerprint_is_stable(tmp_path):
+    assert environment_fingerprint(sys.executable, str(tmp_path)) == environment_fingerprint(
+        sys.executable, str(tmp_path)
+    )
+
+
+def test_fingerprint_changes_with_requirements(tmp_path):
+    before = environment_fingerprint(sys.executable, str(tmp_path))
+    (tmp_path / "requirements.txt").write_text("six\n")
+    after = environment_fingerprint(sys.executable, str(tmp_path))
+    assert before != after
+    assert environment_fingerprint(sys.executable, str(tmp_path), conda_mode=True) != after
+
+
+def test_fingerprint_changes_when_packages_change(tmp_path):
+    site_packages = tmp_path / "venv" / "lib" / "python3.8" / "site-packages"
+    site_packages.mkdir(parents=True)
+    python = tmp_path / "venv" / "bin" / "python"
+    python.parent.mkdir()
+    python.write_text("")
+
+    before = environment_fingerprint(str(python), str(tmp_path))
+    (site_packages / "six-1.16.0.dist-info").mkdir()
+    os.utime(str(site_packages), ns=(0, 0))
+    assert environment_fingerprint(str(python), str(tmp_path)) != before
+
+
+def test_cache_skips_errors_and_evicts():
+    cache = EnvironmentCache(max_size=1)
+    cache.put("a", {"error": "pip failed"})
+    assert cache.get("a") is None
+
+    cache.put("a", {"contents": "six\n"})
+    cache.put("b", {"contents": "numpy\n"})
+    assert cache.get("a") is None
+    assert cache.get("b") == {"contents": "numpy\n"}
+    assert cache.stats()["hits"] == 1
+
+
+def test_kernel_python_from_kernelspec(tmp_path):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "python3.9").write_text("")
+    (bin_dir / "python3.9").chmod(0o755)
+    specs = KernelSpecs(
+        python3=KernelSpec(argv=["python", "-m", "ipykernel_launcher"], language="python"),
+        venv=KernelSpec(argv=["/opt/venv/bin/python3.9", "-m", "ipykernel_launcher"], language="python"),
+        path=KernelSpec(argv=["python3.9", "-m", "ipykernel_launcher"], language="python", env={"PATH": str(bin_dir)}),
+        conda=KernelSpec(argv=["conda", "run", "-n", "base", "python"], language="python"),
+        ir=KernelSpec(argv=["R", "--slave"], language="R"),
+    )
+
+    def python(name):
+        return kernel_python(kernel_spec(None, specs, None, name))
+
+    assert python("python3") == sys.executable
+    assert python("venv") == "/opt/venv/bin/python3.9"
+    assert python("path") == str(bin_dir / "python3.9")
+    assert python("conda") is None
+    assert python("ir") is None
+    assert python("missing") is None
+
+
+def test_inspection_uses_kernel_env(tmp_path):
+    # a package only the kernel can import, through its kernelspec's PYTHONPATH
+    packages = tmp_path / "packages"
+    (packages / "kernelonly-1.0.dist-info").mkdir(parents=True)
+    (packages / "kernelonly-1.0.dist-info" / "METADATA").write_text(
+        "Metadata-Version: 2.1\nName: kernelonly\nVersion: 1.0\n"
+    )
+    env = kernel_env(KernelSpec(argv=["python"], language="python", env={"PYTHONPATH": str(packages)}))
+    assert env == {"PYTHONPATH": str(packages)}
+    assert kernel_env(KernelSpec(argv=["python"], language="python")) == {}
+
+    environment = inspect_environment(sys.executable, str(tmp_path), False, True, 120, env)
+    assert "kernelonly==1.0" in environment["contents"]
+
+    before = environment_fingerprint(sys.executable, str(tmp_path), env=env)
+    assert before != environment_fingerprint(sys.executable, str(tmp_path))
+    (packages / "other-1.0.dist-info").mkdir()
+    os.utime(str(packages), ns=(0, 0))
+    assert environment_fingerprint(sys.executable, str(tmp_path), env=env) != before
+
+
+def test_inspect_environment_reads_requirements(tmp_path):
+    (tmp_path / "requirements.txt").write_text("six==1.16.0\n")
+    environment = inspect_environment(sys.executable, str(tmp_path), False, False, 60)
+    assert environment["source"] == "file"
+    assert environment["contents"].strip() == "six==1.16.0"
+
+
+def test_inspect_environment_reports_failures(tmp_path):
+    with pytest.raises(EnvironmentInspectionError):
+        inspect_environment(str(tmp_path / "missing-python"), str(tmp_path), False, False, 60)
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+import pytest
+
+from rsconnect_jupyter.executor import BoundedExecutor, ExecutorBusy
+
+
+@pytest.fixture
+def executor():
+    executor = BoundedExecutor(max_workers=1, max_pending=1)
+    yield executor
+    executor.shutdown()
+
+
+def test_run_returns_result(executor):
+    assert asyncio.run(executor.run(sum, [1, 2, 3])) == 6
+    stats = executor.stats()
+    assert stats["completed"] == 1
+    assert stats["active"] == 0
+    assert stats["pending"] == 0
+
+
+def test_run_propagates_exceptions(executor):
+    def fail():
+        raise ValueError("nope")
+
+    with pytest.raises(ValueError):
+        asyncio.run(executor.run(fail))
+
+
+def test_submit_rejects_when_saturated(executor):
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    running = executor.submit(block)
+    started.wait(5)
+    queued = executor.submit(block)
+
+    stats = executor.stats()
+    assert stats["active"] == 1
+    assert stats["pending"] == 1
+
+    with pytest.raises(ExecutorBusy):
+        executor.submit(block)
+    assert executor.stats()["rejected"] == 1
+
+    release.set()
+    running.result(5)
+    queued.result(5)
+    assert executor.stats()["completed"] == 2
@@ -0,0 +1,83 @@
+import json
+import subprocess
+import sys
+import threading
+
+# Modules that are slow to import and so must not be loaded while the notebook
+# server starts; rsconnect.api pulls in click, requests and friends.
+DEFERRED_MODULES = [
+    "jupyter_server",
+    "rsconnect.api",
+    "rsconnect.bundle",
+    "rsconnect_jupyter.bundles",
+    "rsconnect_jupyter.clients",
+    "rsconnect_jupyter.search",
+]
+
+# Generous, so only an accidental eager import of something heavy trips it.
+IMPORT_TIME_BUDGET = 1.0
+
+STARTUP = """
+import json, sys, time
+import notebook.notebookapp
+started = time.perf_counter()
+import rsconnect_jupyter
+extension = rsconnect_jupyter.RSConnectJupyter()
+elapsed = time.perf_counter() - started
+extension.shutdown()
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def run_startup():
+    output = subprocess.check_output([sys.executable, "-c", STARTUP])
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def test_loading_extension_defers_heavy_imports():
+    modules = run_startup()["modules"]
+    loaded = [name for name in DEFERRED_MODULES if name in modules]
+    assert loaded == []
+
+
+def test_import_time():
+    elapsed = min(run_startup()["elapsed"] for _ in range(3))
+    assert elapsed < IMPORT_TIME_BUDGET, "importing rsconnect_jupyter took %.3fs" % elapsed
+
+
+def test_components_are_created_on_first_use(make_extension):
+    extension = make_extension()
+    assert extension._components == {}
+    assert extension.clients is extension.clients
+    assert list(extension._components) == ["clients"]
+
+
+def test_status_does_not_create_components(make_extension):
+    extension = make_extension()
+    status = extension.status()
+    assert extension._components == {}
+    assert status["clients"] is None
+    assert status["bundle_builder"] is None
+    assert status["app_search"] is None
+
+    extension.clients
+    assert extension.status()["clients"] == extension.clients.stats()
+
+
+def test_warm_up_leaves_executor_free(make_extension, monkeypatch):
+    extension = make_extension(max_workers=1, max_pending=0)
+    warming_up = threading.Event()
+    release = threading.Event()
+
+    def warm_up():
+        warming_up.set()
+        release.wait(30)
+
+    monkeypatch.setattr(extension, "_warm_up", warm_up)
+    try:
+        extension.start()
+        assert warming_up.wait(30)
+        assert extension.executor.stats()["active"] == 0
+        assert extension.executor.submit(lambda: 42).result(30) == 42
+    finally:
+        release.set()
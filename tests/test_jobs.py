@@ -0,0 +1,236 @@
+import asyncio
+import json
+import os
+import sys
+
+import nbformat
+import pytest
+
+import mock_connect
+from rsconnect_jupyter.jobs import FAILED, SUCCEEDED, DeployJob, JobManager, SharedBundle
+from rsconnect_jupyter.metrics import REGISTRY
+
+
+@pytest.fixture
+def extension(make_extension, tmp_path):
+    return make_extension(
+        bundle_spool_dir=str(tmp_path), bundle_cache_dir=str(tmp_path / "cache"), bundle_cache_size=64 * 1024 * 1024
+    )
+
+
+@pytest.fixture
+def deploy_params(tmp_path, connect_server, api_key):
+    nb = nbformat.v4.new_notebook()
+    nb.cells.append(nbformat.v4.new_code_cell("1 + 1"))
+    path = tmp_path / "job.ipynb"
+    nbformat.write(nb, str(path))
+    return {
+        "server_address": connect_server,
+        "api_key": api_key,
+        "disable_tls_check": False,
+        "cadata": None,
+        "app_id": None,
+        "notebook_name": "job",
+        "notebook_title": "Job",
+        "app_mode": "jupyter-static",
+        "os_path": str(path),
+        "python": sys.executable,
+        "environment": {
+            "conda": None,
+            "contents": "",
+            "error": None,
+            "filename": "requirements.txt",
+            "locale": "en_US.UTF-8",
+            "package_manager": "pip",
+            "pip": "23.0",
+            "python": "3.8.10",
+            "source": "file",
+        },
+        "files": [],
+    }
+
+
+def run_job(extension, job):
+    async def go():
+        extension.jobs.submit(job, job.run(extension))
+        while not job.done:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(go())
+
+
+def metric(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_deploy_job_runs_to_completion(extension, deploy_params, tmp_path):
+    builds = metric("rsconnect_jupyter_bundle_size_bytes_count", app_mode="jupyter-static")
+    uploaded = metric("rsconnect_jupyter_upload_bytes_total")
+    job = DeployJob(deploy_params)
+    run_job(extension, job)
+
+    assert job.state == SUCCEEDED, job.error
+    assert job.phase == "config"
+    assert job.log == ["Building static content", "Deploying static content"]
+    assert job.result["config"]["config_url"].endswith("/content/apps/%s" % job.result["app_id"])
+    assert "api_key" not in job.to_dict()
+    assert extension.jobs.get(job.id) is job
+    # the bundle is kept in the cache rather than left in the spool dir
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["cache", "job.ipynb"]
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+    bundle_size = (tmp_path / "cache" / os.listdir(str(tmp_path / "cache"))[0]).stat().st_size
+    assert metric("rsconnect_jupyter_bundle_size_bytes_count", app_mode="jupyter-static") == builds + 1
+    assert metric("rsconnect_jupyter_upload_bytes_total") == uploaded + bundle_size
+    assert metric("rsconnect_jupyter_deploys_in_progress") == 0
+
+    timings = job.to_dict()["timings"]
+    assert list(timings) == ["build", "upload", "task", "config", "total"]
+    assert timings["build"]["cached"] is False
+    assert timings["build"]["bytes"] == timings["upload"]["bytes"] == bundle_size
+    assert all(timing["seconds"] >= 0 for timing in timings.values())
+
+
+def test_republishing_unchanged_content_skips_upload(extension, deploy_params):
+    deploy_params["notebook_name"] = "republished"
+    first = DeployJob(deploy_params)
+    run_job(extension, first)
+    assert first.state == SUCCEEDED, first.error
+    uploads = mock_connect.store.bundle_count()
+
+    second = DeployJob(dict(deploy_params, app_id=first.result["app_id"]))
+    run_job(extension, second)
+    assert second.state == SUCCEEDED, second.error
+    assert second.result["bundle_id"] == first.result["bundle_id"]
+    assert mock_connect.store.bundle_count() == uploads
+    assert extension.bundle_builder.cache.stats()["hits"] == 1
+    assert second.timings["build"]["cached"] is True
+    assert second.timings["upload"]["bytes"] == 0
+
+
+def test_republishing_static_notebook_renders_again(extension, deploy_params):
+    # executing the notebook may give different output each time
+    deploy_params.update(notebook_name="static", app_mode="static", environment=None)
+    first = DeployJob(deploy_params)
+    run_job(extension, first)
+    assert first.state == SUCCEEDED, first.error
+    uploads = mock_connect.store.bundle_count()
+
+    second = DeployJob(dict(deploy_params, app_id=first.result["app_id"]))
+    run_job(extension, second)
+    assert second.state == SUCCEEDED, second.error
+    assert second.result["bundle_id"] != first.result["bundle_id"]
+    assert mock_connect.store.bundle_count() == uploads + 1
+    assert second.timings["build"]["cached"] is False
+    assert second.timings["upload"]["bytes"] > 0
+
+
+def test_latest_job_is_kept_for_each_notebook_and_server(extension, deploy_params):
+    first = DeployJob(dict(deploy_params, notebook_name="latest"))
+    run_job(extension, first)
+    # still pending on another server
+    elsewhere = DeployJob(dict(deploy_params, server_address="http://127.0.0.1:1/"))
+
+    async def submit():
+        extension.jobs.submit(elsewhere, asyncio.sleep(0))
+
+    asyncio.run(submit())
+    assert extension.jobs.for_notebook(deploy_params["os_path"]) == [first, elsewhere]
+
+    second = DeployJob(dict(deploy_params, app_id=first.result["app_id"]))
+    run_job(extension, second)
+    assert extension.jobs.for_notebook(deploy_params["os_path"]) == [second, elsewhere]
+    assert extension.jobs.for_notebook("/elsewhere.ipynb") == []
+
+
+def test_recorded_deployment_replays(make_extension, tmp_path, deploy_params, api_key):
+    recording = str(tmp_path / "connect.jsonl")
+    recorder = make_extension(bundle_spool_dir=str(tmp_path), record_connect_traffic=recording)
+    recorded = DeployJob(dict(deploy_params, notebook_name="recorded"))
+    run_job(recorder, recorded)
+    assert recorded.state == SUCCEEDED, recorded.error
+
+    with open(recording) as f:
+        text = f.read()
+    assert api_key not in text
+    entries = [json.loads(line) for line in text.splitlines()[1:]]
+    upload = next(entry for entry in entries if entry["uri"].endswith("/upload"))
+    assert upload["request_bytes"] > 0
+    assert upload["request_body"] is None
+    assert upload["request_headers"]["Authorization"] == "[REDACTED]"
+    assert upload["response_body"]["id"] == recorded.result["bundle_id"]
+
+    # against the recording, the same deployment gets the same answers
+    mock_connect.use_replay(recording, speed=0)
+    replayer = make_extension(bundle_spool_dir=str(tmp_path))
+    replayed = DeployJob(dict(deploy_params, notebook_name="recorded"))
+    try:
+        run_job(replayer, replayed)
+    finally:
+        mock_connect.use_replay(None)
+    assert replayed.state == SUCCEEDED, replayed.error
+    assert replayed.result == recorded.result
+    assert replayed.log == recorded.log
+
+
+def test_deploy_job_records_failure(extension, deploy_params):
+    job = DeployJob(dict(deploy_params, app_id=999999, environment_seconds=1.5))
+    run_job(extension, job)
+
+    assert job.state == FAILED
+    assert job.result is None
+    assert job.error
+    assert job.timings["environment"] == {"seconds": 1.5}
+    assert "total" in job.timings
+
+
+def test_shared_bundle_is_built_once(make_extension, tmp_path, deploy_params):
+    extension = make_extension(bundle_spool_dir=str(tmp_path))
+    builds = []
+    build = extension.bundle_builder.build
+
+    async def counting_build(*args, **kwargs):
+        builds.append(args)
+        return await build(*args, **kwargs)
+
+    extension.bundle_builder.build = counting_build
+    bundle = SharedBundle(2)
+    good = DeployJob(dict(deploy_params, notebook_name="shared"), bundle)
+    bad = DeployJob(dict(deploy_params, app_id=999999), bundle)
+
+    async def go():
+        extension.jobs.submit(good, good.run(extension))
+        extension.jobs.submit(bad, bad.run(extension))
+        while not (good.done and bad.done):
+            await asyncio.sleep(0.01)
+
+    asyncio.run(go())
+
+    assert len(builds) == 1
+    assert good.state == SUCCEEDED, good.error
+    assert bad.state == FAILED
+    # the bundle is removed once both jobs are done with it
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["job.ipynb"]
+
+
+def test_finished_jobs_expire():
+    manager = JobManager(retention=0)
+    job = DeployJob({})
+    job.state = SUCCEEDED
+    job.finished = 0
+    manager._jobs[job.id] = job
+    manager._latest[("/job.ipynb", "https://connect.example.com/")] = job.id
+    manager.prune()
+    assert manager.get(job.id) is None
+    assert manager.for_notebook("/job.ipynb") == []
+
+
+def test_to_dict_returns_lines_after_cursor():
+    job = DeployJob({})
+    job.append_log(["one", "two", "three"])
+    assert job.to_dict()["lines"] == ["one", "two", "three"]
+
+    state = job.to_dict(2)
+    assert state["lines"] == ["three"]
+    assert state["cursor"] == 3
+    assert job.to_dict(3)["lines"] == []
@@ -1,7 +1,8 @@
 from unittest import TestCase
 from asyncmock import Mock, MagicMock, AsyncMock
+from jupyter_server.services.contents.manager import ContentsManager
 
-from rsconnect_jupyter.managers import ContentsManager, get_model, isawaitable
+from rsconnect_jupyter.managers import get_model, isawaitable
 
 
 class GetModelTestCase(TestCase):
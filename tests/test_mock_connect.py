@@ -0,0 +1,197 @@
+import io
+import json
+import tarfile
+import time
+
+import pytest
+
+import mock_connect
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    previous = mock_connect.store
+    db = str(tmp_path / "connect.db") if request.param == "sqlite" else None
+    yield mock_connect.configure(db, str(tmp_path / "bundles"))
+    mock_connect.store = previous
+
+
+@pytest.fixture
+def client(store, api_key):
+    client = mock_connect.app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = "Key " + api_key
+    return client
+
+
+def make_bundle():
+    manifest = {"metadata": {"appmode": "static", "primary_html": "index.html"}}
+    buffer = io.BytesIO()
+    with tarfile.open(mode="w:gz", fileobj=buffer) as tar:
+        for name, data in [("manifest.json", json.dumps(manifest).encode()), ("index.html", b"<p>hello</p>")]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def create(client, name, title):
+    return client.post("/__api__/applications", json={"name": name, "title": title})
+
+
+def search(client, **params):
+    return client.get("/__api__/applications", query_string=params).get_json()
+
+
+def test_names_are_unique(client):
+    assert create(client, "one", "One").status_code == 200
+    response = create(client, "one", "Another")
+    assert response.status_code == 409
+    assert search(client)["total"] == 1
+
+
+def test_search_by_title_prefix(client):
+    for index, title in enumerate(["Sales", "Sales report", "Salt", "Pepper"]):
+        assert create(client, "app%d" % index, title).status_code == 200
+
+    page = search(client, search="Sal", sort="title", order="desc", count=2)
+    assert page["total"] == 3
+    assert [app["title"] for app in page["applications"]] == ["Salt", "Sales report"]
+    page = search(client, search="Sal", sort="title", order="desc", start=2, count=2)
+    assert [app["title"] for app in page["applications"]] == ["Sales"]
+    assert search(client, search="sal")["total"] == 0
+
+
+def test_updates_are_reindexed(client):
+    app_id = create(client, "renamed", "Before").get_json()["id"]
+    client.post("/__api__/applications/%d" % app_id, json={"title": "After"})
+    assert search(client, search="Before")["total"] == 0
+    assert [app["id"] for app in search(client, search="After")["applications"]] == [app_id]
+    assert client.get("/__api__/applications/%d" % app_id).get_json()["title"] == "After"
+
+
+def test_upload_deploy_and_view(client, store):
+    app_id = create(client, "deployed", "Deployed").get_json()["id"]
+    bundle = client.post("/__api__/applications/%d/upload" % app_id, data=make_bundle()).get_json()
+    assert store.bundle_count() == 1
+    with open(store.bundle_path(bundle["id"]), "rb") as f:
+        assert f.read() == make_bundle()
+
+    task = client.post("/__api__/applications/%d/deploy" % app_id, json={"bundle": bundle["id"]}).get_json()
+    assert client.get("/__api__/tasks/%d" % task["id"]).get_json()["finished"] is True
+    assert client.get("/__api__/applications/%d" % app_id).get_json()["bundle_id"] == bundle["id"]
+    assert client.get("/content/apps/%d" % app_id).data == b"<p>hello</p>"
+
+
+def test_unknown_items(client):
+    assert client.get("/__api__/applications/12345").status_code == 404
+    assert client.get("/__api__/applications/nonsense").status_code == 404
+    assert client.get("/__api__/tasks/12345").status_code == 404
+    response = client.post(
+        "/__api__/applications/%d/deploy" % create(client, "a", "A").get_json()["id"], json={"bundle": 9}
+    )
+    assert response.status_code == 404
+
+
+def test_seed_apps(client, store):
+    mock_connect.seed_apps(50)
+    mock_connect.seed_apps(50)
+    assert store.app_count() == 50
+    page = search(client, search="Seeded notebook 4", sort="updated_time", order="desc")
+    assert page["total"] == 11
+    # all seeded at the same time, so in descending id order
+    ids = [app["id"] for app in page["applications"]]
+    assert ids == sorted(ids, reverse=True)
+
+
+def test_sqlite_store_persists(tmp_path, api_key):
+    previous = mock_connect.store
+    try:
+        db = str(tmp_path / "connect.db")
+        mock_connect.configure(db)
+        client = mock_connect.app.test_client()
+        client.environ_base["HTTP_AUTHORIZATION"] = "Key " + api_key
+        app_id = create(client, "kept", "Kept").get_json()["id"]
+
+        mock_connect.configure(db)
+        assert client.get("/__api__/applications/%d" % app_id).get_json()["name"] == "kept"
+        assert create(client, "kept", "Kept").status_code == 409
+    finally:
+        mock_connect.store = previous
+
+
+@pytest.fixture
+def use_profile():
+    previous = mock_connect.profile
+
+    def use(settings):
+        mock_connect.profile = mock_connect.Profile(settings)
+        return mock_connect.profile
+
+    yield use
+    mock_connect.profile = previous
+
+
+def deploy(client):
+    app_id = create(client, "chatty", "Chatty").get_json()["id"]
+    bundle = client.post("/__api__/applications/%d/upload" % app_id, data=make_bundle()).get_json()
+    return client.post("/__api__/applications/%d/deploy" % app_id, json={"bundle": bundle["id"]}).get_json()
+
+
+def test_tasks_log_over_time(client, use_profile):
+    use_profile({"task": {"lines": 30, "seconds": 0.3}})
+    task = deploy(client)
+    assert task["finished"] is False
+    assert task["last_status"] < 30
+
+    log = list(task["status"])
+    while not task["finished"]:
+        time.sleep(0.05)
+        task = client.get("/__api__/tasks/%d?first_status=%d" % (task["id"], task["last_status"])).get_json()
+        log.extend(task["status"])
+    assert task["code"] == 0
+    assert len(log) == task["last_status"] == 32
+    assert log[:3] == [
+        "Collecting package0",
+        "  Downloading package0-1.0.0-py3-none-any.whl (11 kB)",
+        "Installing collected packages: package0",
+    ]
+    assert log[-2:] == ["Building static content", "Deploying static content"]
+
+
+def test_failing_tasks(client, use_profile):
+    use_profile({"task": {"failure_rate": 1}})
+    task = deploy(client)
+    assert task["finished"] is True
+    assert task["code"] == 1
+    assert task["error"] == "Simulated deployment failure"
+
+
+def test_injected_errors(client, use_profile):
+    use_profile({"errors": {"me": {"rate": 1, "status_codes": [503]}}})
+    assert client.get("/__api__/me").status_code == 503
+    assert client.get("/__api__/applications").status_code == 200
+
+
+def test_profiles_are_repeatable(tmp_path):
+    settings = {
+        "seed": 7,
+        "latency": {"default": {"lognormal": [0.03, 0.5]}, "upload": {"constant": 0.25}},
+        "errors": {"default": {"rate": 0.5}},
+    }
+    path = tmp_path / "profile.json"
+    path.write_text(json.dumps(settings))
+    first, second = mock_connect.Profile(settings), mock_connect.Profile(settings)
+    # requests to other endpoints don't change an endpoint's choices
+    responses = [first.response("get_task") for _ in range(20)]
+    for _ in range(5):
+        second.response("me")
+    assert [second.response("get_task") for _ in range(20)] == responses
+    assert {status_code for _, status_code in responses} == {None, 500}
+    assert mock_connect.use_profile(str(path)).response("upload")[0] == 0.25
+    mock_connect.use_profile(None)
+
+
+def test_throttle():
+    throttle = mock_connect.Throttle(1000)
+    assert 0.4 < throttle.delay(500) <= 0.5
+    assert mock_connect.Throttle(0).delay(10**9) == 0.0
@@ -1,8 +1,22 @@
+import asyncio
+import atexit
+import json
 import logging
+import sys
+import threading
 
 import rsconnect_jupyter
+import rsconnect_jupyter.clients
+from rsconnect_jupyter.environment import environment_fingerprint
+from rsconnect_jupyter.extension import RSConnectJupyter
+from rsconnect_jupyter.jobs import SUCCEEDED, DeployJob
+from rsconnect_jupyter.metrics import REGISTRY
+
+from notebook.services.config import ConfigManager
 
 import pytest
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application
 
 
 class FakeNbApp(object):
@@ -35,7 +49,353 @@ def test_load_jupyter_server_extension(fake_nb_app):
     assert len(fake_nb_app.handlers) == 1
     assert fake_nb_app.handlers.get(".*$") is not None
     host_handlers = fake_nb_app.handlers[".*$"]
-    assert len(host_handlers) == 1
+    assert len(host_handlers) == 3
     route_pattern, handler = host_handlers[0]
+    assert route_pattern == "http://nb-app.example.org/rsconnect_jupyter/job_events/(?P<job_id>\\w+)"
+    assert handler.__name__ == "JobEventsHandler"
+    route_pattern, handler = host_handlers[1]
+    assert route_pattern == "http://nb-app.example.org/rsconnect_jupyter/metrics"
+    assert handler.__name__ == "MetricsHandler"
+    route_pattern, handler = host_handlers[2]
     assert route_pattern == "http://nb-app.example.org/rsconnect_jupyter/(?P<action>\\w+)"
     assert handler.__name__ == "EndpointHandler"
+    assert isinstance(fake_nb_app.settings["rsconnect_jupyter"], RSConnectJupyter)
+
+
+def test_extension_is_shut_down_at_exit(fake_nb_app, monkeypatch):
+    registered = []
+    monkeypatch.setattr(atexit, "register", registered.append)
+    rsconnect_jupyter.load_jupyter_server_extension(fake_nb_app)
+    extension = fake_nb_app.settings["rsconnect_jupyter"]
+    assert registered == [extension.shutdown]
+
+    builder = extension.bundle_builder
+    builder.start()
+    processes = list(builder._pool._processes.values())
+    assert len(processes) == builder.max_workers
+
+    registered[0]()
+    for process in processes:
+        process.join(30)
+        assert not process.is_alive()
+    assert builder._pool is None
+    assert extension.executor._executor._shutdown
+
+
+class AuthenticatedJobEventsHandler(rsconnect_jupyter.JobEventsHandler):
+    def get_current_user(self):
+        return "user"
+
+
+class AuthenticatedEndpointHandler(rsconnect_jupyter.EndpointHandler):
+    def get_current_user(self):
+        return "user"
+
+
+class ExtensionTestCase(AsyncHTTPTestCase):
+    """
+    Serves the extension's handlers, with authentication bypassed, from an
+    RSConnectJupyter made by the `make_extension` fixture for each test.
+    """
+
+    handlers = [(r"/rsconnect_jupyter/(?P<action>\w+)", AuthenticatedEndpointHandler)]
+    # RSConnectJupyter options, over make_extension's
+    extension_config = {}
+
+    @pytest.fixture(autouse=True)
+    def extension_factory(self, make_extension):
+        self.make_extension = make_extension
+
+    def get_settings(self) -> dict:
+        """
+        :return: Application settings besides the extension, e.g. the contents manager.
+        """
+        return {}
+
+    def get_app(self):
+        self.extension = self.make_extension(**self.extension_config)
+        return Application(self.handlers, rsconnect_jupyter=self.extension, base_url="/", **self.get_settings())
+
+
+class JobEventsHandlerTestCase(ExtensionTestCase):
+    handlers = [(r"/rsconnect_jupyter/job_events/(?P<job_id>\w+)", AuthenticatedJobEventsHandler)]
+
+    def add_job(self):
+        job = DeployJob({})
+        self.extension.jobs._jobs[job.id] = job
+        return job
+
+    @staticmethod
+    def parse_events(body):
+        events = []
+        for chunk in body.decode("utf-8").split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in chunk.splitlines() if not line.startswith(":"))
+            if fields:
+                events.append((int(fields["id"]), json.loads(fields["data"])))
+        return events
+
+    def test_streams_log_until_job_finishes(self):
+        job = self.add_job()
+        job.append_log(["first"])
+
+        def finish():
+            job.append_log(["second", "third"])
+            job.state = SUCCEEDED
+            job.set_phase("config")
+
+        self.io_loop.call_later(0.1, finish)
+        response = self.fetch("/rsconnect_jupyter/job_events/" + job.id)
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers["Content-Type"], "text/event-stream")
+        events = self.parse_events(response.body)
+        lines = [line for _, event in events for line in event["lines"]]
+        self.assertEqual(lines, ["first", "second", "third"])
+        self.assertEqual(events[-1][0], 3)
+        self.assertEqual(events[-1][1]["state"], SUCCEEDED)
+
+    def test_resumes_from_last_event_id(self):
+        job = self.add_job()
+        job.append_log(["first", "second"])
+        job.state = SUCCEEDED
+        response = self.fetch("/rsconnect_jupyter/job_events/" + job.id, headers={"Last-Event-ID": "1"})
+        [(event_id, event)] = self.parse_events(response.body)
+        self.assertEqual(event_id, 2)
+        self.assertEqual(event["lines"], ["second"])
+
+    def test_unknown_job(self):
+        response = self.fetch("/rsconnect_jupyter/job_events/nosuchjob")
+        self.assertEqual(response.code, 404)
+
+
+class BatchTestCase(ExtensionTestCase):
+    @pytest.fixture(autouse=True)
+    def connect(self, connect_server, api_key, tmp_path):
+        self.connect_server = connect_server
+        self.api_key = api_key
+        self.nbextensions = tmp_path
+        (tmp_path / "rsconnect_jupyter").mkdir()
+        (tmp_path / "rsconnect_jupyter" / "version.json").write_text('{"version": "1.2.3"}')
+
+    def get_settings(self):
+        config_dir = str(self.nbextensions / "config")
+        self.config_manager = ConfigManager(read_config_path=[config_dir], write_config_dir=config_dir)
+        return {"nbextensions_path": [str(self.nbextensions)], "config_manager": self.config_manager}
+
+    def batch(self, actions, **shared):
+        body = dict(shared, actions=actions)
+        response = self.fetch("/rsconnect_jupyter/batch", method="POST", body=json.dumps(body))
+        self.assertEqual(response.code, 200)
+        return json.loads(response.body)
+
+    def test_runs_actions_with_shared_credentials(self):
+        results = self.batch(
+            [
+                {"action": "plugin_version"},
+                {"action": "js_version"},
+                {"action": "verify_server"},
+                {"action": "app_search", "data": {"notebook_title": "", "count": 1}},
+            ],
+            server_address=self.connect_server,
+            api_key=self.api_key,
+            disable_tls_check=False,
+        )
+        self.assertEqual([result["status"] for result in results], [200, 200, 200, 200])
+        self.assertEqual(results[0]["result"]["rsconnect_jupyter_server_extension"], rsconnect_jupyter.__version__)
+        self.assertEqual(results[1]["result"], {"version": "1.2.3"})
+        self.assertEqual(results[2]["result"]["server_address"], self.connect_server)
+        self.assertEqual(results[3]["result"]["start"], 0)
+
+    def test_uses_saved_credentials_for_server_id(self):
+        self.config_manager.set(
+            "rsconnect_jupyter",
+            {"abc": {"server": self.connect_server, "serverName": "local", "apiKey": self.api_key}},
+        )
+        results = self.batch(
+            [
+                {"action": "config"},
+                {"action": "verify_server", "data": {"server_id": "abc"}},
+                {"action": "get_python_settings", "data": {"server_id": "abc"}},
+                {"action": "verify_server", "data": {"server_id": "xyz"}},
+            ]
+        )
+        self.assertEqual(results[0]["result"]["abc"]["apiKey"], self.api_key)
+        self.assertEqual(results[1]["result"]["server_address"], self.connect_server)
+        self.assertTrue(results[2]["result"]["installations"])
+        self.assertEqual(results[3], {"status": 404, "message": "No saved server: xyz"})
+
+    def test_failures_are_reported_per_action(self):
+        results = self.batch(
+            [
+                {"action": "job_get", "data": {"job_id": "nosuchjob"}},
+                {"action": "batch", "data": {"actions": []}},
+                {"action": "status"},
+            ]
+        )
+        self.assertEqual(results[0], {"status": 404, "message": "No such deployment: nosuchjob"})
+        self.assertEqual(results[1]["status"], 404)
+        self.assertEqual(results[2]["status"], 200)
+
+
+class ExecutorTestCase(ExtensionTestCase):
+    extension_config = {"max_workers": 1, "max_pending": 0, "preload": False, "bundle_prewarm": False}
+
+    @pytest.fixture(autouse=True)
+    def slow_connect(self, monkeypatch):
+        # verify_server blocks until released, as if Connect were slow to answer
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+        def verify_server(pool, url, api_key, disable_tls_check, cadata):
+            self.started.set()
+            self.release.wait(10)
+            return url, "user"
+
+        monkeypatch.setattr(rsconnect_jupyter.clients, "verify_server", verify_server)
+
+    def tearDown(self):
+        self.release.set()
+        super(ExecutorTestCase, self).tearDown()
+
+    def verify(self, api_key):
+        body = {"server_address": "http://connect.example.com/", "api_key": api_key, "disable_tls_check": False}
+        return self.http_client.fetch(
+            self.get_url("/rsconnect_jupyter/verify_server"), method="POST", body=json.dumps(body), raise_error=False
+        )
+
+    async def wait_until_started(self):
+        while not self.started.is_set():
+            await asyncio.sleep(0.01)
+
+    @gen_test
+    async def test_slow_action_does_not_block_status(self):
+        slow = self.verify("key1")
+        await self.wait_until_started()
+
+        response = await self.http_client.fetch(self.get_url("/rsconnect_jupyter/status"))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body)["executor"]["active"], 1)
+        self.assertFalse(slow.done())
+
+        self.release.set()
+        self.assertEqual((await slow).code, 200)
+
+    @gen_test
+    async def test_saturated_executor_returns_503(self):
+        slow = self.verify("key1")
+        await self.wait_until_started()
+
+        response = await self.verify("key2")
+        self.assertEqual(response.code, 503)
+        self.assertIn(b"busy", response.body)
+
+        self.release.set()
+        self.assertEqual((await slow).code, 200)
+        self.assertEqual(self.extension.executor.stats()["rejected"], 1)
+
+
+KERNEL_ENVIRONMENT = {
+    "conda": None,
+    "contents": "six==1.16.0\n",
+    "error": None,
+    "filename": "requirements.txt",
+    "locale": "en_US.UTF-8",
+    "package_manager": "pip",
+    "pip": "23.0",
+    "python": "3.8.10",
+    "source": "pip_freeze",
+}
+
+
+class EnvironmentStoreTestCase(ExtensionTestCase):
+    @pytest.fixture(autouse=True)
+    def notebook_dir(self, tmp_path):
+        self.notebook_dir = tmp_path
+
+    def get_settings(self):
+        from notebook.services.contents.filemanager import FileContentsManager
+
+        return {
+            "contents_manager": FileContentsManager(root_dir=str(self.notebook_dir)),
+            "kernel_manager": None,
+            "kernel_spec_manager": None,
+        }
+
+    def post(self, action, **body):
+        body = dict({"notebook_path": "notebook.ipynb", "python": sys.executable, "conda_mode": False}, **body)
+        return self.fetch("/rsconnect_jupyter/%s" % action, method="POST", body=json.dumps(body))
+
+    def test_fingerprint_is_worked_out_by_the_server(self):
+        response = self.post("environment_store", fingerprint="chosen", environment=dict(KERNEL_ENVIRONMENT, extra=1))
+        self.assertEqual(response.code, 200)
+        self.assertIsNone(self.extension.environments.get("chosen"))
+
+        response = self.post("environment_lookup")
+        self.assertEqual(json.loads(response.body), {"environment": KERNEL_ENVIRONMENT})
+        # not trusted by the server's own inspections
+        fingerprint = environment_fingerprint(sys.executable, str(self.notebook_dir))
+        self.assertIsNone(self.extension.environments.get(fingerprint))
+
+    def test_environments_of_remote_interpreters_are_not_cached(self):
+        # nothing on this machine changes when packages are installed in such a kernel
+        python = str(self.notebook_dir / "remote" / "bin" / "python")
+        response = self.post("environment_store", python=python, environment=KERNEL_ENVIRONMENT)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.extension.environments.stats()["size"], 0)
+        response = self.post("environment_lookup", python=python)
+        self.assertEqual(json.loads(response.body), {"environment": None})
+
+    def test_malformed_environments_are_rejected(self):
+        for environment in [None, "six", {"filename": "../setup.py", "package_manager": "pip", "contents": ""}]:
+            response = self.post("environment_store", environment=environment)
+            self.assertEqual(response.code, 400)
+        self.assertEqual(self.extension.environments.stats()["size"], 0)
+
+
+class AuthenticatedMetricsHandler(rsconnect_jupyter.MetricsHandler):
+    def get_current_user(self):
+        return "user"
+
+
+class MetricsTestCase(ExtensionTestCase):
+    handlers = [(r"/rsconnect_jupyter/metrics", AuthenticatedMetricsHandler)] + ExtensionTestCase.handlers
+
+    @pytest.fixture(autouse=True)
+    def connect(self, connect_server, api_key):
+        self.connect_server = connect_server
+        self.api_key = api_key
+
+    def metric(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_records_actions_and_connect_errors(self):
+        status_requests = self.metric(
+            "rsconnect_jupyter_action_duration_seconds_count", action="status", status_code="200"
+        )
+        rejected = self.metric(
+            "rsconnect_jupyter_action_duration_seconds_count", action="verify_server", status_code="401"
+        )
+        unauthorized = self.metric("rsconnect_jupyter_connect_errors_total", status_code="401")
+
+        self.assertEqual(self.fetch("/rsconnect_jupyter/status").code, 200)
+        body = {
+            "server_address": self.connect_server,
+            "api_key": "not-a-key",
+            "disable_tls_check": False,
+        }
+        response = self.fetch("/rsconnect_jupyter/verify_server", method="POST", body=json.dumps(body))
+        self.assertEqual(response.code, 401)
+
+        self.assertEqual(
+            self.metric("rsconnect_jupyter_action_duration_seconds_count", action="status", status_code="200"),
+            status_requests + 1,
+        )
+        self.assertEqual(
+            self.metric("rsconnect_jupyter_action_duration_seconds_count", action="verify_server", status_code="401"),
+            rejected + 1,
+        )
+        self.assertEqual(self.metric("rsconnect_jupyter_connect_errors_total", status_code="401"), unauthorized + 1)
+
+        response = self.fetch("/rsconnect_jupyter/metrics")
+        self.assertEqual(response.code, 200)
+        self.assertIn(b"rsconnect_jupyter_deploys_in_progress 0.0", response.body)
@@ -0,0 +1,151 @@
+import pytest
+
+from rsconnect_jupyter import search
+from rsconnect_jupyter.clients import ClientPool
+from rsconnect_jupyter.search import AppCatalog, AppSearchCache, TitleIndex
+
+
+@pytest.fixture
+def client(connect_server, api_key):
+    pool = ClientPool(max_size=1, idle_timeout=60)
+    with pool.client(connect_server, api_key) as client:
+        yield client
+    pool.close()
+
+
+def create_app(client, name, title, app_mode=7):
+    app = client.handle_bad_response(client.app_create(name))
+    return client.handle_bad_response(client.app_update(app["id"], {"title": title, "app_mode": app_mode}))
+
+
+def test_title_index_ranks_prefix_matches_first():
+    index = TitleIndex(
+        {
+            1: {"name": "a", "title": "Monthly sales"},
+            2: {"name": "b", "title": "Sales forecast"},
+            3: {"name": "c", "title": "Sales"},
+            4: {"name": "d", "title": "Inventory"},
+            5: {"name": "sales-report", "title": ""},
+        }
+    )
+    assert index.search("sales") == [3, 2, 5, 1]
+    assert index.search("SAL") == [3, 2, 5, 1]
+    assert index.search("in") == [4]
+    assert index.search("") == [4, 1, 3, 2, 5]
+    assert index.search("missing") == []
+
+
+def test_search_pages_through_matches(client):
+    ids = [create_app(client, "pager-%d" % i, "Pager report %d" % i)["id"] for i in range(5)]
+    create_app(client, "pager-api", "Pager report api", app_mode=8)
+    cache = AppSearchCache()
+
+    first = cache.search(client, None, "pager report", 0, 3)
+    assert first["total"] == 5
+    assert first["count"] == 3
+    assert [app["id"] for app in first["applications"]] == ids[:3]
+    assert first["applications"][0]["config_url"].endswith("/content/apps/%d" % ids[0])
+
+    second = cache.search(client, None, "pager report", 3, 3)
+    assert second["start"] == 3
+    assert [app["id"] for app in second["applications"]] == ids[3:]
+
+
+def test_search_lists_current_app_first(client):
+    current = create_app(client, "current-app", "Zebra current")
+    create_app(client, "other-app", "Zebra other")
+    cache = AppSearchCache()
+
+    result = cache.search(client, current["id"], "zebra other", 0, 5)
+    assert [app["id"] for app in result["applications"]][0] == current["id"]
+    assert result["total"] == 2
+
+
+def test_invalidate_picks_up_new_apps(client):
+    cache = AppSearchCache(ttl=3600)
+    assert cache.search(client, None, "invalidated", 0, 5)["total"] == 0
+
+    create_app(client, "invalidated", "Invalidated later")
+    assert cache.search(client, None, "invalidated", 0, 5)["total"] == 0
+
+    cache.invalidate(client.server.url)
+    assert cache.search(client, None, "invalidated", 0, 5)["total"] == 1
+    assert cache.stats()["catalogs"] == 1
+
+
+class UnsortedConnect(object):
+    """
+    Lists apps in the order they were created whatever sort is asked for, as
+    a Connect server that doesn't support sorting would.
+    """
+
+    def __init__(self, count):
+        self.apps = [
+            {
+                "id": i,
+                "name": "app-%d" % i,
+                "title": "Report %d" % i,
+                "app_mode": 7,
+                "url": "",
+                "updated_time": "2024-01-01T00:00:%02dZ" % i,
+            }
+            for i in range(count)
+        ]
+
+    def app_search(self, params):
+        start = params.get("start", 0)
+        page = self.apps[start : start + params["count"]]
+        return {"applications": page, "count": len(page), "total": len(self.apps)}
+
+    def handle_bad_response(self, response):
+        return response
+
+
+def test_refresh_without_server_side_sorting_is_full():
+    connect = UnsortedConnect(3)
+    catalog = AppCatalog()
+    catalog.refresh(connect, full=True)
+    assert not catalog.ordered
+
+    # the newest app is last, where an incremental refresh would never get to
+    connect.apps[-1].update(title="Renamed", updated_time="2024-01-01T00:01:00Z")
+    catalog.refresh(connect, full=False)
+    assert catalog.apps[2]["title"] == "Renamed"
+
+
+def test_incremental_refresh_falls_back_when_order_is_wrong():
+    connect = UnsortedConnect(3)
+    catalog = AppCatalog()
+    connect.apps.reverse()
+    catalog.refresh(connect, full=True)
+    assert catalog.ordered
+
+    connect.apps.reverse()
+    connect.apps[-1].update(title="Renamed", updated_time="2024-01-01T00:01:00Z")
+    catalog.refresh(connect, full=False)
+    assert not catalog.ordered
+    assert catalog.apps[2]["title"] == "Renamed"
+
+
+def test_large_catalogs_are_searched_on_the_server(client, monkeypatch):
+    monkeypatch.setattr(search, "CATALOG_MAX_APPS", 0)
+    ids = [create_app(client, "huge-%d" % i, "Huge catalog %d" % i)["id"] for i in range(3)]
+    cache = AppSearchCache()
+
+    result = cache.search(client, None, "Huge catalog", 1, 5)
+    assert [app["id"] for app in result["applications"]] == ids[1:]
+    assert result["total"] == 3
+    catalog = next(iter(cache._catalogs.values()))
+    assert not catalog.complete
+    assert set(catalog.apps) == set(ids)
+
+
+def test_current_app_outside_the_catalog_is_summarized(client, monkeypatch):
+    monkeypatch.setattr(search, "CATALOG_MAX_APPS", 0)
+    current = create_app(client, "outside-app", "Outside the catalog")
+    cache = AppSearchCache()
+
+    result = cache.search(client, current["id"], "no such title", 0, 5)
+    assert [app["id"] for app in result["applications"]] == [current["id"]]
+    catalog = next(iter(cache._catalogs.values()))
+    assert catalog.apps[current["id"]] == search._summary(current)
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import time
+
+from rsconnect_jupyter.watchdog import UNKNOWN_ACTION, LoopWatchdog
+
+
+async def call_action(action, seconds):
+    # named like EndpointHandler.call_action, so the watchdog attributes the stall to `action`
+    time.sleep(seconds)
+
+
+def watch(blocking, caplog):
+    async def run():
+        watchdog = LoopWatchdog(interval=0.01, threshold=0.1, log=logging.getLogger("watchdog"))
+        watchdog.start()
+        try:
+            await asyncio.sleep(0.05)
+            await blocking()
+            await asyncio.sleep(0.05)
+        finally:
+            watchdog.stop()
+        return watchdog.stats()
+
+    with caplog.at_level(logging.WARNING, logger="watchdog"):
+        return asyncio.run(run())
+
+
+def test_reports_blocking_action_and_stack(caplog):
+    stats = watch(lambda: call_action("deploy", 0.4), caplog)
+    assert stats["samples"] > 0
+    assert stats["max_lag"] >= 0.3
+    assert list(stats["stalls"]) == ["deploy"]
+    assert stats["stalls"]["deploy"]["count"] == 1
+    assert stats["stalls"]["deploy"]["max_seconds"] >= 0.3
+
+    sampled, recovered = [record.getMessage() for record in caplog.records]
+    assert "blocked for more than" in sampled
+    assert "by deploy, in:" in sampled
+    assert "time.sleep(seconds)" in sampled
+    assert "was blocked for" in recovered
+
+
+def test_stall_outside_actions(caplog):
+    async def block():
+        time.sleep(0.4)
+
+    assert list(watch(block, caplog)["stalls"]) == [UNKNOWN_ACTION]
+
+
+def test_no_stalls_when_idle(caplog):
+    async def idle():
+        await asyncio.sleep(0.1)
+
+    stats = watch(idle, caplog)
+    assert stats["stalls"] == {}
+    assert caplog.records == []
@@ -0,0 +1,57 @@
+#!/usr/bin/env node
+/*
+ * Bundles the publishing dialogs into a single minified file named after a
+ * hash of its contents, rsconnect_jupyter/static/publish.<hash>.min.js, and
+ * writes bundle.json telling index.js which file to load on first use.
+ *
+ * Run with `make frontend`; `make dist` and `make install` do so too.
+ */
+const crypto = require('crypto');
+const fs = require('fs');
+const path = require('path');
+const { minify } = require('terser');
+
+const STATIC_DIR = path.join(__dirname, '..', 'rsconnect_jupyter', 'static');
+const MODULE_PREFIX = 'nbextensions/rsconnect_jupyter/';
+// dependencies before the modules using them
+const MODULES = ['rsconnect', 'connect'];
+
+function namedModule(name) {
+  const source = fs.readFileSync(path.join(STATIC_DIR, name + '.js'), 'utf8');
+  // give each anonymous define() its module ID so they can share one file
+  const named = source.replace(/\bdefine\(\s*\[/, "define('" + MODULE_PREFIX + name + "', [");
+  if (named === source) {
+    throw new Error(name + '.js has no anonymous define() call');
+  }
+  return named;
+}
+
+async function main() {
+  const sources = {};
+  MODULES.forEach(function (name) {
+    sources[name + '.js'] = namedModule(name);
+  });
+  const result = await minify(sources, { compress: true, mangle: true });
+
+  const hash = crypto.createHash('sha256').update(result.code).digest('hex').slice(0, 16);
+  const bundleName = 'publish.' + hash + '.min';
+
+  fs.readdirSync(STATIC_DIR)
+    .filter(function (file) {
+      return /^publish\.[0-9a-f]+\.min\.js$/.test(file);
+    })
+    .forEach(function (file) {
+      fs.unlinkSync(path.join(STATIC_DIR, file));
+    });
+  fs.writeFileSync(path.join(STATIC_DIR, bundleName + '.js'), result.code);
+  fs.writeFileSync(
+    path.join(STATIC_DIR, 'bundle.json'),
+    JSON.stringify({ publish: bundleName, modules: MODULES }) + '\n'
+  );
+  console.log('wrote ' + bundleName + '.js (' + result.code.length + ' bytes)');
+}
+
+main().catch(function (err) {
+  console.error(err);
+  process.exit(1);
+});